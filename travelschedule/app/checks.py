@@ -0,0 +1,33 @@
+#起動時・migrate時のチェック（python manage.py check --database default でも実行できる）
+from importlib import import_module
+
+from django.core.checks import Error, Tags, register
+from django.db import connections
+
+#検索テーブルのトリガーの名前はマイグレーション0016と同じものを使う
+plan_search = import_module('app.migrations.0016_plan_search')
+
+
+#予定の検索テーブル（FTS5）を更新するトリガーが全部あるか
+#トリガーはマイグレーション0016で生のSQLで作っているので、Djangoのスキーマエディタは知らない
+#SQLiteで予定・リンク・予定表のテーブルが作り直される（列の追加・変更）と、そのテーブルのトリガーは黙って消え、検索結果が古いままになる
+@register(Tags.database)
+def check_plan_search_triggers(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE 'app\\_plan\\_search%' ESCAPE '\\'")
+            found = cursor.fetchall()
+        if ('table', 'app_plan_search') not in found: #まだ0016を適用していない
+            continue
+        missing = sorted(set(plan_search.TRIGGER_NAMES) - {name for kind, name in found if kind == 'trigger'})
+        if missing:
+            errors.append(Error(
+                f'{alias}の予定の検索テーブルのトリガーがありません: {", ".join(missing)}',
+                hint='予定・リンク・予定表のテーブルを作り直すマイグレーションでは、0021のようにトリガーを消してから変更し、変更の後でTRIGGER_SQLで作り直してください。',
+                id='app.E001',
+            ))
+    return errors
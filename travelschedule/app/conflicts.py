@@ -0,0 +1,85 @@
+#予定の時間の重なり（ダブルブッキング）を見つける
+#予定詳細画面では重なった予定を横に並べて表示する（timeline.layout_day）だけなので、保存した時にサーバー側でも重なりを調べて知らせる
+#宿泊（stay）は他の予定の背景になるブロックとして扱い、宿泊中の観光・食事などは重なりにしない（宿泊同士の重なりだけ調べる）
+#終了時刻と次の開始時刻が同じ（9:00～10:00と10:00～11:00）は重なりにしない
+import heapq
+
+from django.utils.timezone import localtime
+
+from .models import Plan, PlanDayOccurrence
+
+LABEL_FIELDS = ('id', 'schedule_id', 'action_category', 'name', 'arrival_location', 'start_datetime', 'end_datetime')
+
+
+#予定の表示名（名前がなければ到着地、それもなければカテゴリ）
+def plan_label(plan):
+    return plan.name or plan.arrival_location or plan.get_action_category_display()
+
+
+#保存した1件の予定と重なる予定（開始時刻順）
+#宿泊以外は、日別展開テーブル（PlanDayOccurrence）の(予定表, 日付)の索引で、その予定の日付の範囲にある予定だけに絞ってから時刻を比べる
+#（宿泊以外の予定は、またがる日の全部に行があるので、重なる予定は必ずこの範囲に行がある）
+#宿泊はチェックイン・チェックアウトの日にしか行がないので、数の少ない宿泊だけを直接調べる
+def plan_conflicts(plan):
+    if not plan.start_datetime or not plan.end_datetime:
+        return []
+    candidates = Plan.objects.filter(
+        schedule_id=plan.schedule_id,
+        start_datetime__lt=plan.end_datetime,
+        end_datetime__gt=plan.start_datetime,
+    ).exclude(pk=plan.pk)
+    if plan.action_category == 'stay':
+        candidates = candidates.filter(action_category='stay')
+    else:
+        days = PlanDayOccurrence.objects.filter(
+            schedule_id=plan.schedule_id,
+            date__range=(localtime(plan.start_datetime).date(), localtime(plan.end_datetime).date()),
+        )
+        candidates = candidates.filter(id__in=days.values('plan_id')).exclude(action_category='stay')
+    return list(candidates.only(*LABEL_FIELDS).order_by('start_datetime', 'id'))
+
+
+#予定表の中で重なっている予定の組を全部探す　[(先に始まる予定, 後から始まる予定), ...]
+#予定表の予定を開始時刻順に1回読み、まだ終わっていない予定をヒープに入れながら1回なめる（スイープライン）
+#比べるのは実際に重なっている予定同士だけなので、予定が何千件あっても、重なりが少なければ件数にほぼ比例した時間で終わる
+def schedule_conflicts(schedule):
+    plans = (
+        Plan.objects.filter(schedule=schedule, start_datetime__isnull=False, end_datetime__isnull=False)
+        .only(*LABEL_FIELDS).order_by('start_datetime', 'id')
+    )
+    pairs = []
+    active = {'stay': [], 'other': []} #宿泊と宿泊以外で別々に（終了時刻, 順番, 予定）の最小ヒープ
+    for index, plan in enumerate(plans):
+        layer = active['stay' if plan.action_category == 'stay' else 'other']
+        while layer and layer[0][0] <= plan.start_datetime: #もう終わった予定は外す
+            heapq.heappop(layer)
+        for _, _, other in sorted(layer, key=lambda item: item[1]):
+            pairs.append((other, plan))
+        heapq.heappush(layer, (plan.end_datetime, index, plan))
+    return pairs
+
+
+#予定id→重なっている予定idのリスト
+def conflict_map(pairs):
+    result = {}
+    for first, second in pairs:
+        result.setdefault(first.id, []).append(second.id)
+        result.setdefault(second.id, []).append(first.id)
+    return result
+
+
+#JSONで返す形
+def conflict_json(first, second):
+    def summary(plan):
+        return {
+            'id': plan.id,
+            'name': plan_label(plan),
+            'action_category': plan.action_category,
+            'start_datetime': localtime(plan.start_datetime).isoformat(),
+            'end_datetime': localtime(plan.end_datetime).isoformat(),
+        }
+    return {
+        'plans': [summary(first), summary(second)],
+        'start': localtime(max(first.start_datetime, second.start_datetime)).isoformat(), #重なっている時間
+        'end': localtime(min(first.end_datetime, second.end_datetime)).isoformat(),
+    }
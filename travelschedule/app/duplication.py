@@ -0,0 +1,85 @@
+#予定表の複製（前の旅行をもとに次の旅行の予定表を作る）
+#予定・リンク・写真を1件ずつsave()すると、予定500件で数千回のINSERTと日別展開・集計のやり直しになるので、
+#種類ごとにbulk_createでまとめて入れる　1つのトランザクションで行うので、途中で失敗したら何も作られない
+#写真のファイルはコピーせずに同じファイルを指す（storage.pyで内容のハッシュを名前にしているので、同じ写真は1つのファイルでいい
+#どちらかの予定表で写真を削除しても、release_filesが他のPictureから参照されていないか確認してからファイルを消す）
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Link, Picture, Plan, PlanDayOccurrence, Schedule
+from .occurrences import expand_plan
+
+PLAN_FIELDS = (
+    'id', 'action_category', 'transportation_id', 'name', 'start_datetime', 'end_datetime',
+    'memo', 'departure_location', 'arrival_location',
+)
+TITLE_MAX_LENGTH = 20 #ScheduleForm.clean_titleと同じ
+COPY_SUFFIX = 'のコピー'
+
+
+#複製した予定表のタイトル（指定がなければ「元のタイトルのコピー」）
+def copy_title(title):
+    return f'{title[:TITLE_MAX_LENGTH - len(COPY_SUFFIX)]}{COPY_SUFFIX}'
+
+
+#日時をdays日ずらす　日本時間の日付と時刻のままずらす（サマータイムのある地域でも時刻が変わらないように）
+def shift_datetime(value, days):
+    if not days:
+        return value
+    local = timezone.localtime(value)
+    return timezone.make_aware(datetime.combine(local.date() + days, local.time()))
+
+
+#予定表を複製して新しい予定表を返す　new_start_dateを指定すると、旅行期間と全部の予定の日時を同じ日数だけずらす
+#クエリの回数は予定の数に関係なく、元の読み込み3回＋予定表・予定・リンク・写真・日別展開のINSERTだけ
+@transaction.atomic
+def duplicate_schedule(schedule, new_start_date=None, title=None):
+    days = (new_start_date - schedule.trip_start_date) if new_start_date else None
+
+    plans = list(Plan.objects.filter(schedule=schedule).only(*PLAN_FIELDS).order_by('id'))
+    links = list(Link.objects.filter(plan__schedule=schedule).only('plan_id', 'title', 'url').order_by('id'))
+    pictures = list(Picture.objects.filter(plan__schedule=schedule).only('plan_id', 'image', 'renditions_ready').order_by('id'))
+
+    #件数は分かっているので、集計列も作る時に一緒に入れる（refresh_schedule_summaryのUPDATEがいらない）
+    copy = Schedule.objects.create(
+        user=schedule.user,
+        title=title or copy_title(schedule.title),
+        trip_start_date=schedule.trip_start_date + days if days else schedule.trip_start_date,
+        trip_end_date=schedule.trip_end_date + days if days else schedule.trip_end_date,
+        plan_count=len(plans),
+        link_count=len(links),
+        picture_count=len(pictures),
+    )
+
+    new_plans = {} #元の予定id→複製した予定
+    for plan in plans:
+        new_plans[plan.id] = Plan(
+            schedule=copy,
+            action_category=plan.action_category,
+            transportation_id=plan.transportation_id,
+            name=plan.name,
+            start_datetime=shift_datetime(plan.start_datetime, days),
+            end_datetime=shift_datetime(plan.end_datetime, days),
+            memo=plan.memo,
+            departure_location=plan.departure_location,
+            arrival_location=plan.arrival_location,
+        )
+    Plan.objects.bulk_create(new_plans.values(), batch_size=500) #SQLite・PostgreSQLではbulk_createで主キーも入るので、そのままリンク・写真に使える
+
+    Link.objects.bulk_create(
+        [Link(plan=new_plans[link.plan_id], title=link.title, url=link.url) for link in links],
+        batch_size=500,
+    )
+    Picture.objects.bulk_create(
+        [Picture(plan=new_plans[picture.plan_id], image=picture.image.name, renditions_ready=picture.renditions_ready) for picture in pictures],
+        batch_size=500,
+    )
+
+    #新しい予定表にはまだ日別展開の行がないので、DELETEせずにINSERTだけ
+    rows = []
+    for plan in new_plans.values():
+        rows.extend(expand_plan(plan))
+    PlanDayOccurrence.objects.bulk_create(rows, batch_size=500)
+    return copy
@@ -1,11 +1,13 @@
 from django import forms
+from django.conf import settings
 from .models import User
 from django.core.exceptions import ValidationError
 import re
 from django.contrib.auth import authenticate, get_user_model
 from .models import Schedule
 from .models import Plan, Link, Picture, TransportationMethod
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 from django.forms import modelformset_factory
 from django.utils import timezone
 from django.contrib.auth.forms import PasswordChangeForm
@@ -13,6 +15,9 @@ from django.forms import BaseInlineFormSet
 from django.forms import inlineformset_factory
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.password_validation import validate_password
+from .occurrences import sync_plan_occurrences
+from . import transportation as transportation_registry
+from .uploads import completed_uploads
 
 #フォームのバリエーションの役割：ユーザーの入力内容が正しいかチェック
 
@@ -229,6 +234,38 @@ ACTION_CATEGORY_CHOICES = [
 ]
 
 #planモデル用の入力フォーム　予定追加、編集の両方
+#移動手段の選択フィールド　選択肢も入力値の変換もtransportation.pyのメモリ上の一覧から行い、DBに問い合わせない
+class TransportationChoiceField(forms.ChoiceField):
+    def __init__(self, **kwargs):
+        super().__init__(choices=transportation_registry.form_choices, **kwargs) #関数を渡すとフォームを作るたびに最新の一覧から選択肢を作る
+    
+    #送られてきたidをTransportationMethodに変換する　一覧にないidはエラー
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        method = transportation_registry.get_method(value)
+        if method is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+        return method
+    
+    #to_pythonで一覧にあるか確認済みなので、ここでは必須チェックだけ
+    def validate(self, value):
+        if value is None and self.required:
+            raise ValidationError(self.error_messages['required'], code='required')
+
+
+#旅行期間（開始日～終了日）の1日ずつの日付　同じ期間なら作ったものを使い回す（タプルなので使い回しても書き換えられない）
+@lru_cache(maxsize=1024)
+def trip_dates(start, end):
+    return tuple(start + timedelta(days=i) for i in range((end - start).days + 1))
+
+
+#日付セレクトボックスの選択肢　[('2025-08-01', '2025-08-01'), ...]　こちらも期間ごとに使い回す
+@lru_cache(maxsize=1024)
+def trip_date_choices(start, end):
+    return tuple((d.isoformat(), d.strftime('%Y-%m-%d')) for d in trip_dates(start, end))
+
+
 class PlanForm(forms.ModelForm):
     #カテゴリ　ChoiceField：選択肢から１つ選ぶフィールド　choices：上記で定義したカテゴリ一覧を使用　RadioSelect：ラジオボタン（カテゴリを並べて表示するため）
     action_category = forms.ChoiceField(
@@ -236,12 +273,10 @@ class PlanForm(forms.ModelForm):
         label='',
         widget=forms.RadioSelect(attrs={'class': 'category-radio'})
     )
-    #移動手段　ModelChoiceField：外部キー用のフォーム　queryset：DBに入っている移動手段全部取得　required=False：移動カテゴリ以外では使わないので必須にしない　
-    transportation = forms.ModelChoiceField(
-        queryset=TransportationMethod.objects.all(),
+    #移動手段　TransportationChoiceField：移動手段の一覧をメモリから使う選択フィールド（上で定義）　required=False：移動カテゴリ以外では使わないので必須にしない　
+    transportation = TransportationChoiceField(
         required=False,
         widget=forms.Select(attrs={'class': 'transport-select'}),
-        empty_label=None,
         label=''
     )
     #出発地
@@ -370,30 +405,19 @@ class PlanForm(forms.ModelForm):
     def __init__(self, *args, trip_dates=None, **kwargs):
         super().__init__(*args, **kwargs)
         
-        #日付の候補を受け取る
-        date_choices = trip_dates or []
+        #日付の候補（旅行期間の日付）から選択肢を作る　同じ旅行期間ならtrip_date_choicesが作ったものを使い回す
+        date_choices = trip_date_choices(trip_dates[0], trip_dates[-1]) if trip_dates else ()
         
-        #nameは未入力OK、start_dateとend_dateはSelectにする
+        #nameは未入力OK、start_dateとend_dateはSelectにする（Selectは1回だけ作る）
         self.fields['name'].required = False
         self.fields['start_date'].widget = forms.Select(choices=date_choices)
         self.fields['end_date'].widget = forms.Select(choices=date_choices)
+        self.fields['start_date'].input_formats = ['%Y-%m-%d']
+        self.fields['end_date'].input_formats = ['%Y-%m-%d']
         
         #食事カテゴリの時はend_date不要
         if self.data.get('action_category') == 'meal':
             self.fields['end_date'].required = False
-        
-        #trip_datesがある場合はchoicesを作り直す
-        if trip_dates:
-            date_choices = [
-                (d.isoformat(), d.strftime('%Y-%m-%d'))
-                for d in trip_dates
-            ]
-            #Selectを正式にセットし直す　旅行期間が確定した後の本命
-            self.fields['start_date'].widget = forms.Select(choices=date_choices)
-            self.fields['end_date'].widget = forms.Select(choices=date_choices)
-            
-            self.fields['start_date'].input_fprmats = ['%Y-%m-%d']
-            self.fields['end_date'].input_fprmats = ['%Y-%m-%d']
             
         #フォームで選んでいるaction_categoryをどんな状況でも１つ取り出すコード（新規作成、入力してPOSTした後のエラー、編集）
         cat = (
@@ -542,6 +566,7 @@ class PlanForm(forms.ModelForm):
         instance.end_datetime = self.cleaned_data.get('end_datetime')
         if commit:
             instance.save()
+            sync_plan_occurrences(instance) #予定詳細画面用の日別展開テーブルも書き直す
         return instance
     
 
@@ -625,4 +650,63 @@ class BasePictureFormSet(BaseInlineFormSet):
     def  __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         for form in self.forms:
-            form.empty_permitted = True
\ No newline at end of file
+            form.empty_permitted = True
+
+
+#分割アップロードで先に送り終えた写真（uploads.py）を、予定フォームからtokenで受け取るフォーム
+#入力エラーで画面を出し直しても、送り終えた写真はtokenを画面に残しておけばそのまま使える
+class UploadedPicturesForm(forms.Form):
+    upload_tokens = forms.Field(required=False, widget=forms.MultipleHiddenInput) #name="upload_tokens"のhiddenが複数
+    
+    def __init__(self, *args, user=None, schedule=None, picture_formset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.schedule = schedule
+        self.picture_formset = picture_formset
+        self.sessions = []
+    
+    def clean_upload_tokens(self):
+        tokens = [token for token in (self.cleaned_data.get('upload_tokens') or []) if token]
+        self.sessions = completed_uploads(self.user, self.schedule, tokens)
+        if len(self.sessions) != len(set(tokens)):
+            raise ValidationError('アップロードが終わっていない写真があります。もう一度選んでください。')
+        
+        #写真は合計の大きさと枚数（フォームセットで残す写真と合わせて）に上限がある
+        if sum(session.size for session in self.sessions) > settings.PICTURE_UPLOAD_MAX_PLAN_SIZE:
+            raise ValidationError('写真の合計の大きさが上限を超えています。')
+        if self.sessions and self.picture_formset is not None:
+            kept = 0
+            for form in self.picture_formset:
+                cleaned = getattr(form, 'cleaned_data', None) or {}
+                if cleaned.get('DELETE'):
+                    continue
+                if form.instance.pk or cleaned.get('image'):
+                    kept += 1
+            if kept + len(self.sessions) > self.picture_formset.max_num:
+                raise ValidationError(f'写真は{self.picture_formset.max_num}枚までです。')
+        return self.sessions
+
+
+#予定追加・編集画面のフォームセット　どのリクエストでも同じ形なので、読み込み時に1回だけ作る
+#inlineformset_factoryで親（Plan）に紐づく子（Link）をまとめて編集できるフォームセットを作成
+LinkFormSet = inlineformset_factory(
+    Plan, #親
+    Link, #子（１対多）
+    form=LinkForm, #linkモデルの一行分のフォームの形
+    formset=BaseLinkFormSet, #カスタムルール　フォームセット全体に独自のルールを足せる
+    extra=1, #空フォームを最初に1個表示
+    max_num=5,
+    validate_max=True, #６個以上送られたらエラーにする
+    can_delete=True #削除チェックを自動で付ける
+)
+
+PictureFormSet = inlineformset_factory(
+    Plan,
+    Picture,
+    form=PictureForm,
+    formset=BasePictureFormSet,
+    extra=1,
+    max_num=6,
+    validate_max=True,
+    can_delete=True,
+)
@@ -0,0 +1,144 @@
+#予定をiCalendar（.ics）形式で出力する（Googleカレンダー・iPhoneのカレンダーなどに取り込む・購読する用）
+#予定を全部読み込んでから文字列を作ると、予定が多いほどメモリを使うので、
+#iterator(chunk_size=...)で少しずつ読みながら、1件ずつVEVENTの文字列を作ってStreamingHttpResponseで送る
+#宿泊はチェックイン日～チェックアウト日の終日の予定、移動は出発地→到着地と移動手段を入れる
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils.timezone import localtime
+
+from .conflicts import plan_label
+from .models import Plan
+from . import transportation
+
+CHUNK_SIZE = 500 #DBから1回に読む予定の数
+LINE_LIMIT = 75 #1行の上限（バイト）　超える行は折り返す（RFC 5545）
+PRODID = '-//travelschedule//travelschedule//JA'
+PLAN_FIELDS = (
+    'id', 'schedule_id', 'action_category', 'transportation_id', 'name', 'start_datetime', 'end_datetime',
+    'memo', 'departure_location', 'arrival_location', 'updated_at',
+)
+
+
+#文字の中の\、;、,、改行をiCalendarの書き方にする
+def escape_text(value):
+    return (
+        str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\r', '\\n').replace('\n', '\\n')
+    )
+
+
+#75バイトを超える行を折り返す（続きの行は先頭に空白を入れる）　日本語の途中で切らないように1文字ずつ数える
+def fold(line):
+    parts = []
+    current = ''
+    size = 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > LINE_LIMIT:
+            parts.append(current)
+            current = ' '
+            size = 1
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n'.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_date(value):
+    return value.strftime('%Y%m%d')
+
+
+#予定1件分のVEVENT（折り返し済みの文字列）
+def plan_event(plan, schedule_title=None):
+    summary = plan_label(plan)
+    location = plan.arrival_location
+    description = []
+    if schedule_title:
+        description.append(f'予定表：{schedule_title}')
+
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:plan-{plan.id}@travelschedule',
+        f'DTSTAMP:{format_datetime(plan.updated_at)}',
+        f'LAST-MODIFIED:{format_datetime(plan.updated_at)}',
+    ]
+    if plan.action_category == 'stay':
+        #終日の予定　DTENDはその日を含まないので、チェックアウト日の翌日にする
+        check_in = localtime(plan.start_datetime)
+        check_out = localtime(plan.end_datetime)
+        lines.append(f'DTSTART;VALUE=DATE:{format_date(check_in.date())}')
+        lines.append(f'DTEND;VALUE=DATE:{format_date(check_out.date() + timedelta(days=1))}')
+        description.append(f'チェックイン：{check_in:%m/%d %H:%M}　チェックアウト：{check_out:%m/%d %H:%M}')
+    else:
+        lines.append(f'DTSTART:{format_datetime(plan.start_datetime)}')
+        lines.append(f'DTEND:{format_datetime(plan.end_datetime)}')
+
+    if plan.action_category == 'move':
+        method = transportation.get_method(plan.transportation_id) #移動手段はプロセスの中の一覧から取るのでクエリは増えない
+        if plan.departure_location and plan.arrival_location:
+            summary = plan.name or f'{plan.departure_location}→{plan.arrival_location}'
+        if method:
+            summary = f'{summary}（{method}）'
+        location = plan.departure_location or plan.arrival_location
+        for label, value in (('出発', plan.departure_location), ('到着', plan.arrival_location), ('移動手段', method)):
+            if value:
+                description.append(f'{label}：{value}')
+
+    if plan.memo:
+        description.append(plan.memo)
+    lines.append(f'SUMMARY:{escape_text(summary)}')
+    if location:
+        lines.append(f'LOCATION:{escape_text(location)}')
+    if description:
+        text = '\n'.join(description)
+        lines.append(f'DESCRIPTION:{escape_text(text)}')
+    lines.append(f'CATEGORIES:{escape_text(plan.get_action_category_display())}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+#カレンダー全体を少しずつ返すジェネレーター　予定はCHUNK_SIZE件ずつDBから読む
+#feed=Trueの時はカレンダーアプリに定期的に読み直してもらう設定も入れる（購読用）
+def calendar_stream(plans, name, feed=False):
+    header = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(name)}',
+        'X-WR-TIMEZONE:Asia/Tokyo',
+    ]
+    if feed:
+        header += ['REFRESH-INTERVAL;VALUE=DURATION:PT1H', 'X-PUBLISHED-TTL:PT1H']
+    yield ''.join(fold(line) for line in header)
+    for plan in plans.iterator(chunk_size=CHUNK_SIZE):
+        yield plan_event(plan, getattr(plan, 'schedule_title', None))
+    yield fold('END:VCALENDAR')
+
+
+#予定表1件分の予定
+def schedule_plans(schedule):
+    return Plan.objects.filter(schedule=schedule).only(*PLAN_FIELDS).order_by('start_datetime', 'id')
+
+
+#ユーザーの全部の予定表の予定（どの予定表の予定か分かるように予定表のタイトルも付ける）
+def user_plans(user):
+    return (
+        Plan.objects.filter(schedule__user=user).only(*PLAN_FIELDS)
+        .annotate(schedule_title=F('schedule__title')).order_by('start_datetime', 'id')
+    )
+
+
+#.icsのレスポンス　filenameを指定するとダウンロード（添付ファイル）にする
+def calendar_response(plans, name, filename=None, feed=False):
+    response = StreamingHttpResponse(calendar_stream(plans, name, feed=feed), content_type='text/calendar; charset=utf-8')
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
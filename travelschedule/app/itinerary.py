@@ -0,0 +1,128 @@
+#印刷用の行程表（全日程を1ページに並べたHTML）
+#予定詳細画面は日付タブで切り替える画面なので印刷に向かない　旅行前に紙やPDF（ブラウザの印刷→PDFに保存）にする用
+#全部の日の予定・リンク・写真を読み込んでテンプレートを作るのは重いので、workers.pyのスレッドプールで作ってファイルに保存し、
+#予定表のupdated_atが変わるまでは同じファイルをそのまま返す（テンプレートもDBも使わない）
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import transportation
+from . import workers
+from .models import Schedule
+from .occurrences import load_timeline
+from .plan_batch import schedule_version
+
+_lock = threading.Lock()
+_rendering = {} #作成中の(予定表ID, バージョン)→Future　同じ行程表を何人・何回開いても1回だけ作る
+
+
+def schedule_dir(schedule_id):
+    return os.path.join(settings.ITINERARY_DIR, str(schedule_id))
+
+
+#予定表の今のバージョンの行程表のファイル　予定の保存・削除でupdated_atが進むと別の名前になる
+#移動手段の名前も入るので、移動手段の一覧のバージョンも名前に入れる　写真の縮小版ができた時のrendition_versionも同じ
+def itinerary_version(schedule):
+    return f'{schedule_version(schedule)}-{schedule.rendition_version}-{transportation.version()}'
+
+
+def itinerary_path(schedule):
+    return os.path.join(schedule_dir(schedule.id), f'{itinerary_version(schedule)}.html')
+
+
+def is_ready(schedule):
+    return os.path.exists(itinerary_path(schedule))
+
+
+#行程表のHTMLを作って保存する（スレッドプールの中で実行される）　保存したファイルのパスを返す
+#途中まで書いたファイルを返さないように、一時ファイルに書いてから名前を変える　古いバージョンのファイルは消す
+def render_itinerary(schedule_id):
+    from .views import get_schedule_dates #views.pyがこのファイルを読み込むので、ここで読み込む
+
+    with transaction.atomic(): #日付・予定・リンク・写真を同じ時点の内容で読む
+        schedule = Schedule.objects.filter(pk=schedule_id).first()
+        if schedule is None:
+            return None
+        timeline = load_timeline(schedule)
+        dates = get_schedule_dates(schedule)
+    days = [
+        {'number': number, 'date': date, 'entries': timeline.get(date, [])}
+        for number, date in enumerate(dates, start=1)
+    ]
+    html = render_to_string('app/itinerary.html', {
+        'schedule': schedule,
+        'days': days,
+        'generated_at': timezone.now(),
+    })
+
+    path = itinerary_path(schedule)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    #消すのは今作ったものより古いバージョンのファイルだけ　前のバージョンを作るのが後から終わった時に、新しいファイルを消さないようにする
+    #移動手段の一覧のバージョンは新旧が比べられないので、今の一覧で作った時だけ、同じ更新日時の別の一覧のファイルを消す
+    current = os.path.basename(path)
+    mine = _version_order(current)
+    for name in os.listdir(directory):
+        if name == current or not name.endswith('.html'):
+            continue
+        order = _version_order(name)
+        if order < mine or (order == mine and current.endswith(f'-{transportation.version()}.html')):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError: #別のスレッドが先に消した
+                pass
+    return path
+
+
+#ファイル名（itinerary_version）から新旧を比べる値（updated_at, rendition_version）を取り出す　読めない名前は一番古い扱い
+def _version_order(name):
+    try:
+        stamp, rendition_version, _ = name[:-len('.html')].split('-')
+        return float(stamp), int(rendition_version)
+    except ValueError:
+        return -1.0, -1
+
+
+#行程表のファイルを返す　まだなければスレッドプールで作り始めてNoneを返す（作り終わるのを待たない）
+#BACKGROUND_WORKERSが0の時はその場で作るので、そのままファイルを返せる
+def request_itinerary(schedule):
+    path = itinerary_path(schedule)
+    if os.path.exists(path):
+        return path
+    key = (schedule.id, itinerary_version(schedule))
+    future = None
+    with _lock:
+        if key not in _rendering:
+            future = workers.submit(render_itinerary, schedule.id)
+            _rendering[key] = future
+    if future is not None:
+        #作り終わったら（失敗しても）作成中から外す　次に開いた時、失敗していれば作り直す
+        #終わっている時はその場で呼ばれるので、_lockの外で登録する
+        future.add_done_callback(lambda _: _forget(key))
+    return path if os.path.exists(path) else None
+
+
+def _forget(key):
+    with _lock:
+        _rendering.pop(key, None)
+
+
+#予定表を削除した時に、その予定表の行程表のファイルをまとめて消す
+def remove_itineraries(schedule_id):
+    shutil.rmtree(schedule_dir(schedule_id), ignore_errors=True)
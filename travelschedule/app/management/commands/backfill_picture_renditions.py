@@ -0,0 +1,32 @@
+#既存の写真の縮小版（サムネイル・中サイズ・WebP）をまとめて作る管理コマンド
+#使い方：python manage.py backfill_picture_renditions（まだ縮小版がない写真だけ）　--all（全部作り直す）
+#同時に処理するスレッド数はsettings.BACKGROUND_WORKERS（環境変数BACKGROUND_WORKERSで変えられる）
+from django.core.management.base import BaseCommand
+
+from app import workers
+from app.models import Picture
+from app.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    help = '既存の写真の縮小版（サムネイル・中サイズ・WebP）を作る'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='作成済みの写真も作り直す')
+
+    def handle(self, *args, **options):
+        pictures = Picture.objects.exclude(image='').exclude(image__isnull=True)
+        if options['all']:
+            pictures.update(renditions_ready=False) #作り直す写真は一度未作成に戻す
+        else:
+            pictures = pictures.filter(renditions_ready=False)
+
+        #同じ画像を使っている写真は1回作れば全部作成済みになるので、画像ごとに1件だけ処理する
+        picture_ids = {}
+        for picture_id, name in pictures.order_by('id').values_list('id', 'image').iterator():
+            picture_ids.setdefault(name, picture_id)
+
+        futures = [workers.submit(generate_renditions, picture_id) for picture_id in picture_ids.values()]
+        results = [future.result() for future in futures] #全部終わるまで待つ
+        done = sum(1 for result in results if result)
+        self.stdout.write(self.style.SUCCESS(f'{done}件の画像の縮小版を作りました（失敗{len(results) - done}件）'))
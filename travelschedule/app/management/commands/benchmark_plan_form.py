@@ -0,0 +1,108 @@
+#予定追加・編集画面のフォーム準備のベンチマーク
+#以前の処理（リクエストごとにinlineformset_factoryでフォームセットのクラスを作り、日付の選択肢も毎回作る）と
+#今の処理（forms.pyで1回だけ作ったLinkFormSet・PictureFormSetと、旅行期間ごとに使い回す日付の選択肢）を比べる
+#GETはフォームを作って日付セレクトを表示するまで、POSTはフォームを作ってis_valid()までを計測する（DBの保存は含めない）
+#使い方：python manage.py benchmark_plan_form --days 3 7 14 --iterations 500
+import time
+from datetime import date, timedelta
+
+from django import forms
+from django.core.management.base import BaseCommand
+from django.forms import inlineformset_factory
+
+from app.forms import (
+    BaseLinkFormSet,
+    BasePictureFormSet,
+    LinkForm,
+    LinkFormSet,
+    PictureForm,
+    PictureFormSet,
+    PlanForm,
+    trip_dates,
+)
+from app.models import Link, Picture, Plan
+
+
+#以前のPlanForm.__init__　日付のSelectを2回作り、選択肢も毎回作っていた
+class LegacyPlanForm(PlanForm):
+    def __init__(self, *args, trip_dates=None, **kwargs):
+        forms.ModelForm.__init__(self, *args, **kwargs)
+        date_choices = trip_dates or []
+        self.fields['name'].required = False
+        self.fields['start_date'].widget = forms.Select(choices=date_choices)
+        self.fields['end_date'].widget = forms.Select(choices=date_choices)
+        if self.data.get('action_category') == 'meal':
+            self.fields['end_date'].required = False
+        if trip_dates:
+            date_choices = [(d.isoformat(), d.strftime('%Y-%m-%d')) for d in trip_dates]
+            self.fields['start_date'].widget = forms.Select(choices=date_choices)
+            self.fields['end_date'].widget = forms.Select(choices=date_choices)
+
+
+#以前の処理　リクエストごとにフォームセットのクラスと日付リストを作る
+def legacy_scaffolding(start, end):
+    link_formset_class = inlineformset_factory(Plan, Link, form=LinkForm, formset=BaseLinkFormSet, extra=1, max_num=5, validate_max=True, can_delete=True)
+    picture_formset_class = inlineformset_factory(Plan, Picture, form=PictureForm, formset=BasePictureFormSet, extra=1, max_num=6, validate_max=True, can_delete=True)
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return LegacyPlanForm, link_formset_class, picture_formset_class, dates
+
+
+#今の処理
+def current_scaffolding(start, end):
+    return PlanForm, LinkFormSet, PictureFormSet, trip_dates(start, end)
+
+
+#新規の観光予定を送った時のPOSTデータ（リンク・写真は空フォーム1つずつ）
+def post_data(start):
+    data = {
+        'action_category': 'sightseeing', 'name': '城', 'memo': '',
+        'start_date': start.isoformat(), 'start_time': '09:00',
+        'end_date': start.isoformat(), 'end_time': '11:00',
+    }
+    for prefix in ('links', 'pictures'):
+        data.update({f'{prefix}-TOTAL_FORMS': '1', f'{prefix}-INITIAL_FORMS': '0', f'{prefix}-MIN_NUM_FORMS': '0', f'{prefix}-MAX_NUM_FORMS': '6'})
+    return data
+
+
+def run_get(scaffolding, start, end):
+    form_class, link_class, picture_class, dates = scaffolding(start, end)
+    form = form_class(trip_dates=dates)
+    link_class(instance=None, prefix='links')
+    picture_class(instance=None, prefix='pictures')
+    str(form['start_date'])
+    str(form['end_date'])
+
+
+def run_post(scaffolding, start, end, data):
+    form_class, link_class, picture_class, dates = scaffolding(start, end)
+    form = form_class(data, trip_dates=dates)
+    links = link_class(data, instance=None, prefix='links')
+    pictures = picture_class(data, {}, instance=None, prefix='pictures')
+    form.is_valid() and links.is_valid() and pictures.is_valid()
+
+
+class Command(BaseCommand):
+    help = '予定追加・編集画面のフォーム準備（以前の処理と今の処理）のGET/POSTの処理時間を比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, nargs='+', default=[3, 7, 14, 30], help='旅行日数（複数指定可）')
+        parser.add_argument('--iterations', type=int, default=300, help='1回の計測で繰り返す回数')
+        parser.add_argument('--repeat', type=int, default=3, help='計測回数（最小値を表示）')
+
+    def handle(self, *args, **options):
+        start = date(2025, 8, 1)
+        self.stdout.write(f"{'days':>6} {'method':>6} {'legacy(us)':>12} {'current(us)':>12} {'speedup':>8}")
+        for days in options['days']:
+            end = start + timedelta(days=days - 1)
+            data = post_data(start)
+            for method, func, extra in (('GET', run_get, ()), ('POST', run_post, (data,))):
+                legacy = min(self.measure(func, legacy_scaffolding, start, end, extra, options['iterations']) for _ in range(options['repeat']))
+                current = min(self.measure(func, current_scaffolding, start, end, extra, options['iterations']) for _ in range(options['repeat']))
+                self.stdout.write(f'{days:>6} {method:>6} {legacy * 1e6:>12.1f} {current * 1e6:>12.1f} {legacy / current:>7.1f}x')
+
+    #1リクエスト分の平均時間（秒）
+    def measure(self, func, scaffolding, start, end, extra, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func(scaffolding, start, end, *extra)
+        return (time.perf_counter() - started) / iterations
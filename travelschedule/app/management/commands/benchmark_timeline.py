@@ -0,0 +1,74 @@
+#予定詳細画面の重なり判定のベンチマーク
+#以前の処理（planを1件追加するたびに全日程を並び替え・全先行予定と比較）と timeline.layout_day を比べる
+#使い方：python manage.py benchmark_timeline --plans 300 --days 5
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from app.timeline import layout_day
+
+
+#ダミーの予定を作る（DBは使わない）
+def make_plans(count, days, seed):
+    rng = random.Random(seed)
+    base = datetime(2025, 8, 1, 6, 0)
+    plans = []
+    for _ in range(count):
+        start = base + timedelta(days=rng.randrange(days), minutes=rng.randrange(0, 16 * 60))
+        plans.append(SimpleNamespace(start_datetime=start, end_datetime=start + timedelta(minutes=rng.randint(15, 180))))
+    return plans
+
+
+#以前のschedule_detail_viewの処理　重なり判定がplanのループの中にある
+def legacy_layout(plans):
+    plans_by_date = defaultdict(list)
+    for plan in plans:
+        plans_by_date[plan.start_datetime.date()].append(plan)
+        for date, day_plans in plans_by_date.items():
+            sorted_day_plans = sorted(day_plans, key=lambda p: getattr(p, 'display_datetime', p.start_datetime))
+            active_ends = []
+            for p in sorted_day_plans:
+                p.nest_level = 0
+                for end in active_ends:
+                    if p.start_datetime < end:
+                        p.nest_level += 1
+                active_ends.append(p.end_datetime)
+            plans_by_date[date] = sorted_day_plans
+    return plans_by_date
+
+
+#新しい処理　日付ごとに振り分けてから1日1回だけlayout_day
+def new_layout(plans):
+    plans_by_date = defaultdict(list)
+    for plan in plans:
+        plans_by_date[plan.start_datetime.date()].append(plan)
+    for date, day_plans in plans_by_date.items():
+        plans_by_date[date] = layout_day(day_plans)
+    return plans_by_date
+
+
+class Command(BaseCommand):
+    help = '予定詳細画面の重なり判定（以前の処理とtimeline.layout_day）の処理時間を比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', type=int, nargs='+', default=[50, 100, 300, 1000], help='予定の件数（複数指定可）')
+        parser.add_argument('--days', type=int, default=5, help='旅行日数')
+        parser.add_argument('--repeat', type=int, default=3, help='計測回数（最小値を表示）')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'plans':>8} {'legacy(ms)':>12} {'layout_day(ms)':>15} {'speedup':>8}")
+        for count in options['plans']:
+            plans = make_plans(count, options['days'], options['seed'])
+            legacy = min(self.measure(legacy_layout, plans) for _ in range(options['repeat']))
+            new = min(self.measure(new_layout, plans) for _ in range(options['repeat']))
+            self.stdout.write(f'{count:>8} {legacy * 1000:>12.2f} {new * 1000:>15.2f} {legacy / new:>7.1f}x')
+
+    def measure(self, func, plans):
+        started = time.perf_counter()
+        func(plans)
+        return time.perf_counter() - started
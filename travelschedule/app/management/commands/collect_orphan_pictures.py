@@ -0,0 +1,104 @@
+#どのPictureからも参照されていない写真ファイル（と縮小版）を削除、または別のフォルダに移す管理コマンド（media_gc.py）
+#使い方：python manage.py collect_orphan_pictures --dry-run（件数と容量を表示するだけ）
+#        python manage.py collect_orphan_pictures（削除）　--quarantine /path/to/dir（削除せずに移す）
+#        --limit 100000（1回に調べるファイル数　続きは次に実行した時に前回の続きから）　--restart（最初から調べ直す）
+#どこまで調べたかはsettings.PICTURE_GC_CHECKPOINTに書いておく（最後まで調べたら消す）
+import json
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.media_gc import GcStats, batches, find_orphans, walk_files
+from app.models import Picture
+from app.storage import picture_storage
+
+
+class Command(BaseCommand):
+    help = '参照されていない写真ファイルを削除（または別のフォルダに移動）する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='削除せずに件数と容量を表示する（続きの位置も記録しない）')
+        parser.add_argument('--quarantine', help='削除せずにこのフォルダに移す（写真フォルダの外を指定する）')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回のDB問い合わせで調べるファイル数')
+        parser.add_argument('--limit', type=int, help='今回調べるファイル数の上限（続きは次回）')
+        parser.add_argument('--min-age', type=float, default=24, help='更新からこの時間（時）たっていないファイルは対象にしない')
+        parser.add_argument('--restart', action='store_true', help='前回の続きからではなく最初から調べる')
+
+    def handle(self, *args, **options):
+        location = picture_storage.location
+        directory = Picture._meta.get_field('image').upload_to.strip('/')
+        quarantine = options['quarantine']
+        if quarantine:
+            quarantine = os.path.abspath(quarantine)
+            if quarantine.startswith(os.path.join(os.path.abspath(location), directory) + os.sep):
+                raise CommandError('--quarantineには写真フォルダの外を指定してください')
+
+        checkpoint_path = settings.PICTURE_GC_CHECKPOINT
+        start_after = None if options['restart'] else self.read_checkpoint(checkpoint_path)
+        if start_after:
+            self.stdout.write(f'前回の続き（{start_after}の次）から調べます')
+
+        stats = GcStats()
+        min_mtime = time.time() - options['min_age'] * 3600
+        files = walk_files(location, directory, start_after)
+        last_name = None
+        finished = True
+        for batch in batches(files, options['batch_size']):
+            orphans, recent = find_orphans(batch, min_mtime)
+            stats.scanned += len(batch)
+            stats.recent += recent
+            stats.orphans += len(orphans)
+            stats.orphan_bytes += sum(media_file.size for media_file in orphans)
+            if not options['dry_run']:
+                for media_file in orphans:
+                    self.remove(media_file, quarantine)
+            last_name = batch[-1].name
+            if not options['dry_run']:
+                self.write_checkpoint(checkpoint_path, last_name)
+            if options['limit'] and stats.scanned >= options['limit']:
+                finished = False
+                break
+
+        if finished and not options['dry_run'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path) #最後まで調べたので、次は最初から
+
+        if options['dry_run']:
+            verb = '削除できます'
+        else:
+            verb = f'{quarantine}に移しました' if quarantine else '削除しました'
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats.scanned}個のファイルを調べ、参照されていない{stats.orphans}個（{stats.orphan_bytes / 1024 / 1024:.1f}MB）を{verb}'
+            f'　新しいため対象外：{stats.recent}個　{stats.rate:.0f}ファイル/秒'
+        ))
+        if not finished:
+            self.stdout.write(f'続きがあります（{last_name}まで調べました）　もう一度実行すると続きから調べます')
+
+    #削除、または--quarantineのフォルダに同じ相対パスで移す
+    def remove(self, media_file, quarantine):
+        try:
+            if quarantine:
+                target = os.path.join(quarantine, media_file.name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(media_file.path, target)
+            else:
+                os.remove(media_file.path)
+        except FileNotFoundError: #他の処理（storage.release_files）が先に消した
+            pass
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f).get('last')
+        except (FileNotFoundError, ValueError):
+            return None
+
+    #途中で止まっても壊れたファイルが残らないように、別名で書いてから置き換える
+    def write_checkpoint(self, path, last_name):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last': last_name}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,58 @@
+#中身のハッシュ値の名前で保存する前（storage.py）にアップロードされた写真を、ハッシュ値の名前に移して重複をまとめる管理コマンド
+#使い方：python manage.py dedupe_picture_files（移す）　--dry-run（何件まとめられるかを表示するだけ）
+#移した写真の縮小版は作り直しになるので、終わったらbackfill_picture_renditionsを実行する
+import os
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import Picture
+from app.renditions import RENDITIONS, rendition_name
+from app.storage import content_hash, content_name, picture_storage
+
+#すでにハッシュ値の名前になっているファイル（plan_pictures/ab/abcdef…64文字.jpg）
+CONTENT_NAME = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.[^/]+$')
+
+
+class Command(BaseCommand):
+    help = '古い名前の写真ファイルを中身のハッシュ値の名前に移し、同じ中身のファイルを1つにまとめる'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='移さずに件数だけ表示する')
+
+    def handle(self, *args, **options):
+        names = (
+            Picture.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by('image').values_list('image', flat=True).distinct()
+        )
+        moved = 0
+        freed = 0
+        missing = 0
+        seen = set() #--dry-runの時に、この実行の中で先に移したことになるファイル
+        for name in names.iterator():
+            if CONTENT_NAME.search(name):
+                continue
+            if not picture_storage.exists(name):
+                missing += 1
+                continue
+            with picture_storage.open(name, 'rb') as f:
+                target = content_name(os.path.dirname(name), content_hash(f), os.path.splitext(name)[1])
+                already_stored = target in seen or picture_storage.exists(target)
+                seen.add(target)
+                if not options['dry_run'] and not already_stored:
+                    picture_storage.save_as(target, f)
+            moved += 1
+            freed += already_stored #同じ中身のファイルが先にあれば、その分の容量が空く
+            if options['dry_run']:
+                continue
+
+            with transaction.atomic():
+                Picture.objects.filter(image=name).update(image=target, renditions_ready=False)
+            #古いファイルと縮小版を消す（DBの書き換えが終わった後なので、もう誰も参照していない）
+            for old in [name] + [rendition_name(name, kind) for kind in RENDITIONS]:
+                if picture_storage.exists(old):
+                    picture_storage.delete(old)
+
+        verb = '移せます' if options['dry_run'] else '移しました'
+        self.stdout.write(self.style.SUCCESS(f'{moved}個のファイルを{verb}（うち{freed}個は同じ中身のファイルにまとめ）　ファイルが見つからない写真：{missing}件'))
@@ -0,0 +1,13 @@
+#期限切れの写真の分割アップロード（受け取り途中のまま、または予定に使われなかったもの）を一時ファイルごと削除するコマンド
+#cronなどで1日1回くらい実行する　python manage.py purge_upload_sessions
+from django.core.management.base import BaseCommand
+
+from app.uploads import purge_expired
+
+
+class Command(BaseCommand):
+    help = '期限切れの写真の分割アップロードを一時ファイルごと削除します'
+
+    def handle(self, *args, **options):
+        count = purge_expired()
+        self.stdout.write(f'{count}件の分割アップロードを削除しました')
@@ -0,0 +1,25 @@
+#予定の日別展開テーブル（PlanDayOccurrence）を既存データから作り直す管理コマンド
+#使い方：python manage.py rebuild_plan_occurrences（全予定表）　--schedule 3 5（指定した予定表だけ）
+from django.core.management.base import BaseCommand
+
+from app.models import Schedule
+from app.occurrences import rebuild_schedule_occurrences
+
+
+class Command(BaseCommand):
+    help = '予定の日別展開テーブル（PlanDayOccurrence）を既存の予定から作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', type=int, nargs='+', help='作り直す予定表のID（省略時は全予定表）')
+
+    def handle(self, *args, **options):
+        schedule_ids = Schedule.objects.order_by('id').values_list('id', flat=True)
+        if options['schedule']:
+            schedule_ids = schedule_ids.filter(id__in=options['schedule'])
+
+        total = 0
+        count = 0
+        for schedule_id in schedule_ids.iterator():
+            total += rebuild_schedule_occurrences(schedule_id) #予定表1件ずつトランザクションで作り直す
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'{count}件の予定表で{total}行を作り直しました'))
@@ -0,0 +1,33 @@
+#予定表の集計列（予定数・リンク数・写真数）が実際の件数とずれていないか確認して直す管理コマンド
+#使い方：python manage.py reconcile_schedule_summaries（全予定表）　--schedule 3 5（指定した予定表だけ）　--dry-run（確認だけ）
+from django.core.management.base import BaseCommand
+
+from app.models import Schedule
+from app.summary import drifted_schedules, reconcile_summaries
+
+
+class Command(BaseCommand):
+    help = '予定表の集計列（予定数・リンク数・写真数）を実際の件数に合わせて直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', type=int, nargs='+', help='確認する予定表のID（省略時は全予定表）')
+        parser.add_argument('--dry-run', action='store_true', help='ずれている予定表を表示するだけで直さない')
+
+    def handle(self, *args, **options):
+        queryset = Schedule.objects.all()
+        if options['schedule']:
+            queryset = queryset.filter(id__in=options['schedule'])
+
+        if options['dry_run']:
+            drifted = drifted_schedules(queryset).order_by('id')
+            for schedule in drifted:
+                self.stdout.write(
+                    f'予定表{schedule.id}: 予定 {schedule.plan_count}→{schedule.expected_plan_count}'
+                    f'　リンク {schedule.link_count}→{schedule.expected_link_count}'
+                    f'　写真 {schedule.picture_count}→{schedule.expected_picture_count}'
+                )
+            self.stdout.write(f'{len(drifted)}件の予定表の集計がずれています')
+            return
+
+        fixed = reconcile_summaries(queryset)
+        self.stdout.write(self.style.SUCCESS(f'{len(fixed)}件の予定表の集計を直しました'))
@@ -0,0 +1,19 @@
+#予定詳細画面の表示キャッシュのヒット・ミス回数を表示する管理コマンド
+#使い方：python manage.py render_cache_stats（--resetで回数を0に戻す）
+from django.core.management.base import BaseCommand
+
+from app import render_cache
+
+
+class Command(BaseCommand):
+    help = '予定詳細画面の表示キャッシュのヒット・ミス回数を表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='表示した後に回数を0に戻す')
+
+    def handle(self, *args, **options):
+        stats = render_cache.get_stats()
+        self.stdout.write(f"cache: {render_cache.CACHE_ALIAS}")
+        self.stdout.write(f"hits: {stats['hits']}  misses: {stats['misses']}  hit rate: {stats['hit_rate']:.1%}")
+        if options['reset']:
+            render_cache.reset_stats()
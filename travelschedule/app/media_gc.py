@@ -0,0 +1,110 @@
+#どのPictureからも参照されていない写真ファイル（と縮小版）を探す
+#写真の削除（storage.release_files）が途中で失敗した時や、保存がロールバックされて残ったファイル、古い仕組みの時に残ったファイルを片付ける
+#collect_orphan_pictures管理コマンドから使う　ファイルが何百万あっても、名前順に少しずつ読んで、まとまりごとにimage列の索引で1回だけ調べる
+import os
+import time
+
+from .models import Picture
+from .renditions import RENDITIONS
+
+#縮小版の名前の最後の部分（.thumb.jpg、.medium.webpなど　renditions.rendition_name）
+RENDITION_SUFFIXES = tuple(sorted({f".{kind.split('_')[0]}.{ext}" for kind, (_, _, ext) in RENDITIONS.items()}))
+
+
+#写真ファイル1つ分
+class MediaFile:
+    __slots__ = ('name', 'path', 'size', 'mtime')
+
+    def __init__(self, name, entry):
+        stat = entry.stat(follow_symlinks=False)
+        self.name = name #MEDIA_ROOTからの相対パス（Picture.imageに入っている形）
+        self.path = entry.path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+
+#元の画像と縮小版で共通の部分　plan_pictures/ab/abc.jpgもplan_pictures/ab/abc.thumb.webpもplan_pictures/ab/abc
+def base_name(name):
+    for suffix in RENDITION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+#location/directoryの下のファイルを名前順に返す　start_after（前回の続き）が指定されたら、その名前より後から
+#フォルダごとに名前順に並べるので、途中で止めても最後に処理した名前だけ覚えておけば続きから読める
+def walk_files(location, directory, start_after=None):
+    after = tuple(start_after.split('/')) if start_after else None
+
+    def walk(path, parts):
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            entry_parts = parts + (entry.name,)
+            if entry.is_dir(follow_symlinks=False):
+                if after and entry_parts < after[:len(entry_parts)]: #前回までに全部処理したフォルダ
+                    continue
+                yield from walk(entry.path, entry_parts)
+            elif entry.is_file(follow_symlinks=False):
+                if after and entry_parts <= after:
+                    continue
+                yield MediaFile('/'.join(entry_parts), entry)
+
+    root = os.path.join(location, directory)
+    if os.path.isdir(root):
+        yield from walk(root, tuple(directory.strip('/').split('/')))
+
+
+#batch_size件ずつにまとめる　元の画像と縮小版が別のまとまりに分かれないように、同じbase_nameの間では区切らない
+#（名前順に並べると、abc.jpg、abc.medium.jpg、abc.thumb.jpgのように同じbase_nameのファイルは続けて出てくる）
+def batches(files, batch_size):
+    batch = []
+    for media_file in files:
+        if len(batch) >= batch_size and base_name(media_file.name) != base_name(batch[-1].name):
+            yield batch
+            batch = []
+        batch.append(media_file)
+    if batch:
+        yield batch
+
+
+#まとまりの中から、参照されていないファイルを探す　image列の索引でまとまりごとに1回だけ調べる
+#縮小版は、同じbase_nameの元の画像が参照されていれば残す
+#min_mtimeより新しいファイルは、保存中（トランザクションのコミット前）かもしれないので対象にしない
+def find_orphans(batch, min_mtime=None):
+    names = [media_file.name for media_file in batch]
+    referenced = set(Picture.objects.filter(image__in=names).values_list('image', flat=True))
+    referenced_bases = {os.path.splitext(name)[0] for name in referenced}
+    original_bases = {base_name(name) for name in names if not name.endswith(RENDITION_SUFFIXES)}
+    orphans = []
+    recent = 0
+    for media_file in batch:
+        if media_file.name in referenced:
+            continue
+        if media_file.name.endswith(RENDITION_SUFFIXES):
+            base = base_name(media_file.name)
+            if base in referenced_bases:
+                continue
+            #元の画像のファイルだけがなくなっている時（めったにない）は、写真の行が残っていれば縮小版は残す
+            if base not in original_bases and Picture.objects.filter(image__startswith=base + '.').exists():
+                continue
+        if min_mtime is not None and media_file.mtime > min_mtime:
+            recent += 1
+            continue
+        orphans.append(media_file)
+    return orphans, recent
+
+
+#処理の進み具合（件数・容量・速さ）
+class GcStats:
+    def __init__(self):
+        self.scanned = 0
+        self.orphans = 0
+        self.orphan_bytes = 0
+        self.recent = 0
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.scanned / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:00
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.timezone import localtime
+
+
+#既存の予定を日別展開テーブルに入れる（入れないと、移行後に既存の予定表が空で表示される）
+#展開のしかたはoccurrences.expand_planと同じ　移行の時点のモデルを使うので、ここに書いておく
+def fill_occurrences(apps, schema_editor):
+    Plan = apps.get_model('app', 'Plan')
+    PlanDayOccurrence = apps.get_model('app', 'PlanDayOccurrence')
+
+    rows = []
+    plans = Plan.objects.exclude(start_datetime=None).exclude(end_datetime=None).only('id', 'schedule_id', 'action_category', 'start_datetime', 'end_datetime')
+    for plan in plans.iterator(chunk_size=2000):
+        start_date = localtime(plan.start_datetime).date()
+        end_date = localtime(plan.end_datetime).date()
+        if plan.action_category == 'stay':
+            rows.append(PlanDayOccurrence(schedule_id=plan.schedule_id, plan_id=plan.id, date=start_date, display_type='checkin', display_datetime=plan.start_datetime))
+            rows.append(PlanDayOccurrence(schedule_id=plan.schedule_id, plan_id=plan.id, date=end_date, display_type='checkout', display_datetime=plan.end_datetime))
+        else:
+            current_date = start_date
+            while current_date <= end_date:
+                rows.append(PlanDayOccurrence(schedule_id=plan.schedule_id, plan_id=plan.id, date=current_date, display_datetime=plan.start_datetime))
+                current_date += timedelta(days=1)
+        if len(rows) >= 2000:
+            PlanDayOccurrence.objects.bulk_create(rows, batch_size=500)
+            rows = []
+    PlanDayOccurrence.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_link_title_alter_link_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanDayOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('display_type', models.CharField(blank=True, choices=[('', '通常'), ('checkin', 'チェックイン'), ('checkout', 'チェックアウト')], default='', max_length=10)),
+                ('display_datetime', models.DateTimeField()),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='app.plan')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='app.schedule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['schedule', 'date', 'display_datetime'], name='occurrence_schedule_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('plan', 'date', 'display_type'), name='unique_plan_day_occurrence')],
+            },
+        ),
+        migrations.RunPython(fill_occurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+#既存の予定表の集計列を今の件数で埋める
+def fill_summaries(apps, schema_editor):
+    Schedule = apps.get_model('app', 'Schedule')
+    Plan = apps.get_model('app', 'Plan')
+    Link = apps.get_model('app', 'Link')
+    Picture = apps.get_model('app', 'Picture')
+
+    def count(model, schedule_path):
+        counts = model.objects.filter(**{schedule_path: OuterRef('pk')}).order_by().values(schedule_path).annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(counts), 0)
+
+    Schedule.objects.update(
+        plan_count=count(Plan, 'schedule'),
+        link_count=count(Link, 'plan__schedule'),
+        picture_count=count(Picture, 'plan__schedule'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_schedule_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='link_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='picture_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='plan_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='plan',
+            index=models.Index(fields=['schedule', 'start_datetime'], name='plan_schedule_start_idx'),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
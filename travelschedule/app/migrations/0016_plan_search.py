@@ -0,0 +1,100 @@
+#予定の全文検索用テーブル（SQLiteのFTS5仮想テーブル）とそれを書き込みに合わせて更新するトリガー
+#FTS5はSQLite専用なので、他のデータベースでは何もしない（search.pyがLIKE検索に切り替える）
+#trigramトークナイザーで3文字ずつに区切って索引を作るので、単語の区切りがない日本語でも部分一致で探せる
+#rowidはplanのidと同じにして、1件の更新・削除を索引で行えるようにする
+#
+#注意：トリガーは生のSQLで作っているので、Djangoのスキーマエディタはトリガーがあることを知らない
+#SQLiteでは列の追加・変更でテーブルを作り直す（新しいテーブルにコピーして古いテーブルを消す）ので、
+#app_plan・app_link・app_scheduleを作り直すとそのテーブルのトリガーは黙って消え、他のトリガーが参照しているテーブルは作り直しが失敗する
+#これらのテーブルを変えるマイグレーションでは、0021のように先にDROP_TRIGGER_SQLでトリガーを消し、変更の後でTRIGGER_SQLで作り直す
+#トリガーが足りない時はchecks.pyのシステムチェック（app.E001）がmigrateの時にエラーにする
+from django.db import migrations
+
+
+#planの行1件分を検索テーブルに入れるSELECT文（トリガーと既存データの取り込みで共通）
+PLAN_ROW_SELECT = '''
+    SELECT p.id,
+           (SELECT title FROM app_schedule WHERE id = p.schedule_id),
+           p.name, p.memo, p.departure_location, p.arrival_location,
+           (SELECT group_concat(title, ' ') FROM app_link WHERE plan_id = p.id)
+    FROM app_plan p
+'''
+
+INSERT_COLUMNS = 'INSERT INTO app_plan_search(rowid, schedule_title, name, memo, departure_location, arrival_location, link_titles)'
+
+#検索テーブルを書き込みに合わせて更新するトリガー
+TRIGGER_SQL = [
+    #planの追加・更新・削除
+    f'''CREATE TRIGGER app_plan_search_ai AFTER INSERT ON app_plan BEGIN
+        {INSERT_COLUMNS} {PLAN_ROW_SELECT} WHERE p.id = NEW.id;
+    END''',
+    f'''CREATE TRIGGER app_plan_search_au AFTER UPDATE OF schedule_id, name, memo, departure_location, arrival_location ON app_plan BEGIN
+        DELETE FROM app_plan_search WHERE rowid = OLD.id;
+        {INSERT_COLUMNS} {PLAN_ROW_SELECT} WHERE p.id = NEW.id;
+    END''',
+    '''CREATE TRIGGER app_plan_search_ad AFTER DELETE ON app_plan BEGIN
+        DELETE FROM app_plan_search WHERE rowid = OLD.id;
+    END''',
+    #予定表のタイトル変更　タイトルが実際に変わった時だけ、その予定表の予定の行を書き換える
+    '''CREATE TRIGGER app_plan_search_schedule_au AFTER UPDATE OF title ON app_schedule WHEN OLD.title IS NOT NEW.title BEGIN
+        UPDATE app_plan_search SET schedule_title = NEW.title
+        WHERE rowid IN (SELECT id FROM app_plan WHERE schedule_id = NEW.id);
+    END''',
+    #リンクの追加・更新・削除　そのリンクの予定の行のリンクタイトルだけ書き換える
+    '''CREATE TRIGGER app_plan_search_link_ai AFTER INSERT ON app_link BEGIN
+        UPDATE app_plan_search SET link_titles = (SELECT group_concat(title, ' ') FROM app_link WHERE plan_id = NEW.plan_id)
+        WHERE rowid = NEW.plan_id;
+    END''',
+    '''CREATE TRIGGER app_plan_search_link_au AFTER UPDATE OF title, plan_id ON app_link BEGIN
+        UPDATE app_plan_search SET link_titles = (SELECT group_concat(title, ' ') FROM app_link WHERE plan_id = OLD.plan_id)
+        WHERE rowid = OLD.plan_id;
+        UPDATE app_plan_search SET link_titles = (SELECT group_concat(title, ' ') FROM app_link WHERE plan_id = NEW.plan_id)
+        WHERE rowid = NEW.plan_id;
+    END''',
+    '''CREATE TRIGGER app_plan_search_link_ad AFTER DELETE ON app_link BEGIN
+        UPDATE app_plan_search SET link_titles = (SELECT group_concat(title, ' ') FROM app_link WHERE plan_id = OLD.plan_id)
+        WHERE rowid = OLD.plan_id;
+    END''',
+]
+
+TRIGGER_NAMES = [
+    'app_plan_search_ai', 'app_plan_search_au', 'app_plan_search_ad', 'app_plan_search_schedule_au',
+    'app_plan_search_link_ai', 'app_plan_search_link_au', 'app_plan_search_link_ad',
+]
+
+DROP_TRIGGER_SQL = [f'DROP TRIGGER IF EXISTS {name}' for name in TRIGGER_NAMES]
+
+FORWARD_SQL = [
+    '''CREATE VIRTUAL TABLE app_plan_search USING fts5(
+        schedule_title, name, memo, departure_location, arrival_location, link_titles,
+        tokenize = 'trigram'
+    )''',
+    *TRIGGER_SQL,
+    #既存の予定を取り込む
+    f'{INSERT_COLUMNS} {PLAN_ROW_SELECT}',
+]
+
+REVERSE_SQL = [
+    *DROP_TRIGGER_SQL,
+    'DROP TABLE IF EXISTS app_plan_search',
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_schedule_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(FORWARD_SQL), run_sqlite(REVERSE_SQL)),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_plan_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='picture',
+            name='renditions_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
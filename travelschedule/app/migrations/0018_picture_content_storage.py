@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:20
+
+import app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_picture_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='picture',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=app.storage.ContentAddressedStorage(), upload_to='plan_pictures/'),
+        ),
+    ]
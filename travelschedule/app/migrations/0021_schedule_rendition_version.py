@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+#SQLiteでは列の追加でapp_scheduleが作り直され、検索テーブルのトリガー（0016）がapp_scheduleを参照しているので作り直しが失敗する
+#追加の前にトリガーを消して、追加の後に同じトリガーを作り直す
+plan_search = import_module('app.migrations.0016_plan_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_user_calendar_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(plan_search.run_sqlite(plan_search.DROP_TRIGGER_SQL), plan_search.run_sqlite(plan_search.TRIGGER_SQL)),
+        migrations.AddField(
+            model_name='schedule',
+            name='rendition_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(plan_search.run_sqlite(plan_search.TRIGGER_SQL), plan_search.run_sqlite(plan_search.DROP_TRIGGER_SQL)),
+    ]
@@ -6,6 +6,9 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager, Permission
 # Djangoのモデル（テーブル作成の仕組み）を使う基本セット
 from django.db import models
 
+# 写真ファイルを中身のハッシュ値の名前で保存するストレージ
+from .storage import picture_storage
+
 # ユーザーテーブル
 
 # UserManagerでユーザー作成処理をまとめるクラス
@@ -31,6 +34,7 @@ class User(AbstractUser, PermissionsMixin): # AbstractUserをベースにカス
     email = models.EmailField(max_length=255, unique=True) # unique=True でユーザー同士で被らないように
     created_at = models.DateTimeField(auto_now_add=True) # 作成日時
     updated_at = models.DateTimeField(auto_now=True) # 更新日時
+    calendar_token = models.CharField(max_length=64, unique=True, null=True, blank=True) # カレンダーアプリから全予定表を購読するURLに入れる推測できない文字列（ログインなしで読めるので、作り直すと前のURLは使えなくなる）
     
     USERNAME_FIELD = 'email' # 認証でログインIDとして扱うフィールドをemailにする
     REQUIRED_FIELDS = ['name'] #管理者アカウント作成時はemailとnameが必要と宣言
@@ -48,9 +52,24 @@ class Schedule(models.Model): #Scheduleは予定1つ分を表すテーブル
     trip_start_date = models.DateField() #旅行開始日
     trip_end_date = models.DateField() #旅行終了日
     
+    #ホーム画面の予定表カードに表示する集計値（予定・写真が変わった時にsummary.pyで数え直す）
+    plan_count = models.PositiveIntegerField(default=0) #予定の数
+    link_count = models.PositiveIntegerField(default=0) #リンクの数
+    picture_count = models.PositiveIntegerField(default=0) #写真の数
+    
+    #写真の縮小版ができた回数　表示キャッシュ・ETag・行程表を切り替えるのに使う（ユーザーに見える更新日時updated_atは変えない）
+    rendition_version = models.PositiveIntegerField(default=0)
+    
     created_at = models.DateTimeField(auto_now_add=True) #作成日時
     updated_at = models.DateTimeField(auto_now=True) #更新日時
     
+    class Meta:
+        #ホーム画面の一覧（予定日順・更新順）をキーセットページネーションで取るための複合インデックス
+        indexes = [
+            models.Index(fields=['user', 'trip_start_date', 'id'], name='schedule_user_start_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='schedule_user_updated_idx'),
+        ]
+    
     def __str__(self): #__str__でこのモデルを文字として見せる時の代表　admin画面、テンプレート、シェルのprintなどの時
         return self.title
     
@@ -88,6 +107,11 @@ class Plan(models.Model): #Planは予定表の中の1つ1つの予定を表す
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['schedule', 'start_datetime'], name='plan_schedule_start_idx'), #予定表の中の「次の予定」を開始時刻で探す用
+        ]
+    
     #管理者画面でplanデータを分かりやすくする　下記のプリント実行で東京（移動）と表示
     def __str__(self):
         return f"{self.name} ({self.get_action_category_display()})"
@@ -106,13 +130,63 @@ class Link(models.Model):
 #写真テーブル
 class Picture(models.Model):
     plan = models.ForeignKey('Plan', on_delete=models.CASCADE, related_name='pictures')
-    image = models.ImageField(upload_to='plan_pictures/', blank=True, null=True) #画像ファイル専用のフィールド　ファイルの保存とDBにはファイルのパスを保存
+    #画像ファイル専用のフィールド　ファイルの保存とDBにはファイルのパスを保存
+    #同じ中身の画像は1つのファイルを共有する（storage.py）ので、削除の時に他の写真から使われていないかをimage列の索引で調べる
+    image = models.ImageField(upload_to='plan_pictures/', storage=picture_storage, blank=True, null=True, db_index=True)
+    renditions_ready = models.BooleanField(default=False) #縮小版（サムネイル・中サイズ・WebP）を作り終わったか　作るのはrenditions.py
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return str(self.image.name) if self.image else "画像"
     
+    #縮小版のURL　元の画像と同じフォルダに「元の名前.thumb.jpg」のような名前で保存されている
+    def rendition_url(self, kind):
+        from .renditions import rendition_name
+        return self.image.storage.url(rendition_name(self.image.name, kind))
+    
+    @property
+    def thumbnail_url(self):
+        return self.rendition_url('thumb')
+    
+    @property
+    def thumbnail_webp_url(self):
+        return self.rendition_url('thumb_webp')
+    
+    @property
+    def medium_url(self):
+        return self.rendition_url('medium')
+    
+    @property
+    def medium_webp_url(self):
+        return self.rendition_url('medium_webp')
+    
+#写真の分割アップロードの受け取り状況（uploads.py）
+#写真を予定フォームとは別に少しずつ送り、回線が切れても途中から送り直せるように、どこまで受け取ったかを記録しておく
+#送り終わった写真は予定の保存の時にtokenで参照されてPictureになり、この行は削除される
+class UploadSession(models.Model):
+    user = models.ForeignKey('app.User', on_delete=models.CASCADE, related_name='upload_sessions')
+    schedule = models.ForeignKey('Schedule', on_delete=models.CASCADE, related_name='upload_sessions') #どの予定表の予定に付ける写真か
+    token = models.CharField(max_length=64, unique=True) #ブラウザと予定フォームがこのアップロードを指す時に使う推測できない文字列
+    filename = models.CharField(max_length=255) #元のファイル名（拡張子を保存先の名前に使う）
+    size = models.PositiveBigIntegerField() #ファイル全体の大きさ（バイト）
+    received = models.PositiveBigIntegerField(default=0) #受け取り済みの大きさ　続きはここから送ってもらう
+    completed_at = models.DateTimeField(null=True, blank=True) #全部受け取って画像として確認できた日時
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='upload_session_updated_idx'), #期限切れの受け取り途中ファイルを探す用
+        ]
+    
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+    
+    @property
+    def is_complete(self):
+        return self.completed_at is not None
+    
 #移動カテゴリテーブル　選択肢に情報を持たせる、アイコン、並び順、将来カテゴリ追加できるようにテーブル分けた
 class TransportationMethod(models.Model):
     TRANSPORTATION_CHOICES=[
@@ -138,4 +212,29 @@ class TransportationMethod(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f'{self.get_transportation_display()}'
\ No newline at end of file
+        return f'{self.get_transportation_display()}'
+    
+#予定の日別展開テーブル　複数日にまたがる予定や宿泊のチェックイン/チェックアウトを、表示する日ごとに1行にして保存しておく
+#予定詳細画面で「N日目の予定」をこのテーブルへの1回の範囲検索で取れるようにするため（Planの保存・削除の時に書き込む）
+class PlanDayOccurrence(models.Model):
+    DISPLAY_TYPE_CHOICES = [
+        ('', '通常'),
+        ('checkin', 'チェックイン'),
+        ('checkout', 'チェックアウト'),
+    ]
+    schedule = models.ForeignKey('Schedule', on_delete=models.CASCADE, related_name='occurrences') #検索用にscheduleも直接持つ
+    plan = models.ForeignKey('Plan', on_delete=models.CASCADE, related_name='occurrences') #予定が消えたら展開した行も消える
+    date = models.DateField() #表示する日（日本時間の日付）
+    display_type = models.CharField(max_length=10, choices=DISPLAY_TYPE_CHOICES, blank=True, default='')
+    display_datetime = models.DateTimeField() #その日の並び替えに使う時刻
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['schedule', 'date', 'display_datetime'], name='occurrence_schedule_date_idx'), #予定表＋日付の範囲検索用
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['plan', 'date', 'display_type'], name='unique_plan_day_occurrence'),
+        ]
+        
+    def __str__(self):
+        return f'{self.date} {self.plan_id} {self.display_type}'
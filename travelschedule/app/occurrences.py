@@ -0,0 +1,92 @@
+#予定の日別展開テーブル（PlanDayOccurrence）の書き込み・読み込み
+#予定を表示する日ごとに展開する処理を、表示のたびではなく保存・削除の時に1回だけ行う
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils.timezone import localtime
+
+from .models import Plan, PlanDayOccurrence
+from .timeline import TimelineEntry, layout_day
+from . import transportation
+
+
+#1件のplanを表示する日ごとの行（未保存のPlanDayOccurrence）に展開する
+def expand_plan(plan):
+    if not plan.start_datetime or not plan.end_datetime: #日時が未入力の予定は表示しない
+        return []
+
+    #日付ごとに表示するため、datetimeをdateに変換
+    start_date = localtime(plan.start_datetime).date()
+    end_date = localtime(plan.end_datetime).date()
+
+    #宿泊カテゴリだけチェックインとアウトに分ける
+    if plan.action_category == 'stay':
+        return [
+            PlanDayOccurrence(schedule_id=plan.schedule_id, plan=plan, date=start_date, display_type='checkin', display_datetime=plan.start_datetime),
+            PlanDayOccurrence(schedule_id=plan.schedule_id, plan=plan, date=end_date, display_type='checkout', display_datetime=plan.end_datetime),
+        ]
+
+    #宿泊カテゴリ以外は開始日～終了日まで毎日分の行を作る
+    rows = []
+    current_date = start_date
+    while current_date <= end_date:
+        rows.append(PlanDayOccurrence(schedule_id=plan.schedule_id, plan=plan, date=current_date, display_datetime=plan.start_datetime))
+        current_date += timedelta(days=1)
+    return rows
+
+
+#1件のplanを保存した後に呼ぶ　そのplanの行を作り直す
+@transaction.atomic
+def sync_plan_occurrences(plan):
+    PlanDayOccurrence.objects.filter(plan=plan).delete()
+    PlanDayOccurrence.objects.bulk_create(expand_plan(plan))
+
+
+#複数のplanの行をまとめて作り直す　一括保存（bulk_create・bulk_update）の後に呼ぶ　予定の数に関係なくDELETE1回とINSERTだけ
+def sync_occurrences_for_plans(plans):
+    if not plans:
+        return
+    PlanDayOccurrence.objects.filter(plan__in=[plan.pk for plan in plans]).delete()
+    rows = []
+    for plan in plans:
+        rows.extend(expand_plan(plan))
+    PlanDayOccurrence.objects.bulk_create(rows, batch_size=500)
+
+
+#予定表1件分の行をまとめて作り直す　一括処理の後や管理コマンドから呼ぶ
+@transaction.atomic
+def rebuild_schedule_occurrences(schedule_id):
+    PlanDayOccurrence.objects.filter(schedule_id=schedule_id).delete()
+    rows = []
+    for plan in Plan.objects.filter(schedule_id=schedule_id).only('id', 'schedule_id', 'action_category', 'start_datetime', 'end_datetime'):
+        rows.extend(expand_plan(plan))
+    PlanDayOccurrence.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+#予定詳細画面用に、日付→その日のTimelineEntryリスト（時刻順・重なり判定済み）を作る
+#start_date、end_dateを指定するとその期間の日だけを範囲検索する
+def load_timeline(schedule, start_date=None, end_date=None):
+    occurrences = PlanDayOccurrence.objects.filter(schedule=schedule)
+    if start_date:
+        occurrences = occurrences.filter(date__gte=start_date)
+    if end_date:
+        occurrences = occurrences.filter(date__lte=end_date)
+    rows = list(occurrences.values_list('plan_id', 'date', 'display_type', 'display_datetime'))
+
+    #表示する予定本体はまとめて1回で取得し、同じplanが何日出てきても同じオブジェクトを共有する
+    plans = Plan.objects.prefetch_related('links', 'pictures').in_bulk({row[0] for row in rows})
+    #移動手段はJOINせず、メモリに読み込み済みの一覧から付ける（transportation.py）
+    for plan in plans.values():
+        if plan.transportation_id:
+            plan.transportation = transportation.get_method(plan.transportation_id)
+
+    entries_by_date = defaultdict(list)
+    for plan_id, date, display_type, display_datetime in rows:
+        entries_by_date[date].append(TimelineEntry(plans[plan_id], display_type, display_datetime))
+
+    #1日1回だけ並び替え・重なり判定する
+    for date, entries in entries_by_date.items():
+        entries_by_date[date] = layout_day(entries)
+    return entries_by_date
@@ -0,0 +1,55 @@
+#ホーム画面の予定表一覧のキーセットページネーション
+#OFFSETで読み飛ばすのではなく「前のページの最後の1件より後ろ」を複合インデックス（user, 並び替え項目, id）で検索する
+#何ページ目でも検索の重さが変わらない
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+PAGE_SIZE = 20 #1回に表示する予定表の数
+
+#並び替えの種類ごとの（並び替え項目, カーソルの文字列を値に戻す関数）
+SORTS = {
+    'date': ('trip_start_date', parse_date), #予定日の新しい順
+    'updated': ('updated_at', parse_datetime), #更新日時の新しい順
+}
+
+
+#カーソル（前のページの最後の1件の位置）を文字列にする　例）'2025-08-01_12'
+def make_cursor(schedule, sort):
+    field, _ = SORTS[sort]
+    return f'{getattr(schedule, field).isoformat()}_{schedule.id}'
+
+
+#カーソルの文字列を（値, id）に戻す　壊れたカーソルはNone（最初のページ扱い）
+def parse_cursor(cursor, sort):
+    if not cursor:
+        return None
+    _, parse = SORTS[sort]
+    value_str, _, id_str = cursor.rpartition('_')
+    try:
+        value = parse(value_str)
+    except ValueError:
+        return None
+    if value is None or not id_str.isdigit():
+        return None
+    return value, int(id_str)
+
+
+#1ページ分の予定表と、次のページのカーソル（最後のページならNone）を返す
+def paginate_schedules(queryset, sort, cursor=None, page_size=PAGE_SIZE):
+    if sort not in SORTS:
+        sort = 'date'
+    field, _ = SORTS[sort]
+    queryset = queryset.order_by(f'-{field}', '-id') #同じ日付の予定表があっても順番が決まるようにidも並び替えに入れる
+
+    position = parse_cursor(cursor, sort)
+    if position:
+        value, last_id = position
+        #前のページの最後の1件より後ろ（並び替え項目が小さい、または同じでidが小さい）
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': last_id}))
+
+    schedules = list(queryset[:page_size + 1]) #1件多く取って次のページがあるか判定する
+    next_cursor = None
+    if len(schedules) > page_size:
+        schedules = schedules[:page_size]
+        next_cursor = make_cursor(schedules[-1], sort)
+    return schedules, next_cursor
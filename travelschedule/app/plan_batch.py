@@ -0,0 +1,165 @@
+#予定のまとめて追加・更新・削除（JSON）
+#予定追加・編集画面のように1件ずつPOST→リダイレクト→予定詳細画面の再表示をしなくても、1回のリクエストで何件でも変更できるようにする
+#入力チェックは予定追加・編集画面と同じPlanFormで行い、1件でもエラーがあれば何も保存しない（全部保存するか全部しないか）
+#
+#送る形　{"version": "...", "operations": [
+#    {"op": "create", "data": {"action_category": "meal", "name": "昼食", "start_date": "2025-08-01", "start_time": "12:00", ...}},
+#    {"op": "update", "id": 5, "data": {"memo": "予約済み"}},   ←dataに書いた項目だけ変わる
+#    {"op": "delete", "id": 6},
+#]}
+#versionは前に受け取った予定表のバージョン　省略しなければ、その後に別の画面で変更されていた時は保存せずに409を返す
+#（バージョンを比べる前に予定表の行へ書き込んで書き込みロックを取るので、同じバージョンのまとめて変更が2つ同時に来ても通るのは片方だけ）
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.timezone import localtime
+
+from .forms import PlanForm, trip_dates
+from .models import Plan, Schedule
+from .conflicts import conflict_map, schedule_conflicts
+from .occurrences import sync_occurrences_for_plans
+from .summary import refresh_schedule_summary
+
+MAX_OPERATIONS = 100 #1回に送れる件数
+OPERATIONS = ('create', 'update', 'delete')
+FORM_FIELDS = PlanForm._meta.fields
+UPDATE_FIELDS = [
+    'action_category', 'transportation', 'name', 'start_datetime', 'end_datetime',
+    'memo', 'departure_location', 'arrival_location', 'updated_at',
+]
+
+
+#予定表のバージョン　予定の保存・削除で必ず進むupdated_atから作る（予定詳細画面のETagと同じ値の作り方）
+def schedule_version(schedule):
+    return f'{schedule.updated_at.timestamp():.6f}' if schedule.updated_at else '0'
+
+
+#既存の予定をPlanFormに渡せる形にする（予定編集画面のGETと同じく、日時は日付と時刻に分ける）
+def plan_form_data(plan):
+    data = {
+        'action_category': plan.action_category,
+        'name': plan.name or '',
+        'memo': plan.memo or '',
+        'departure_location': plan.departure_location or '',
+        'arrival_location': plan.arrival_location or '',
+        'transportation': plan.transportation_id or '',
+    }
+    for prefix, value in (('start', plan.start_datetime), ('end', plan.end_datetime)):
+        if value:
+            value = localtime(value)
+            data[f'{prefix}_date'] = value.date().isoformat()
+            data[f'{prefix}_time'] = value.strftime('%H:%M')
+    return data
+
+
+#保存した予定をJSONで返す形
+def plan_json(plan):
+    return {
+        'id': plan.id,
+        'action_category': plan.action_category,
+        'name': plan.name,
+        'memo': plan.memo,
+        'departure_location': plan.departure_location,
+        'arrival_location': plan.arrival_location,
+        'transportation': plan.transportation_id,
+        'start_datetime': localtime(plan.start_datetime).isoformat() if plan.start_datetime else None,
+        'end_datetime': localtime(plan.end_datetime).isoformat() if plan.end_datetime else None,
+    }
+
+
+#フォームのエラーを{項目名: [メッセージ, ...]}にする
+def form_errors(form):
+    return {field: [str(message) for message in messages] for field, messages in form.errors.items()}
+
+
+#まとめて変更する　(HTTPステータス, 返すJSON)を返す
+#予定は件数に関係なく、削除はDELETE1回、追加はbulk_create、更新はbulk_updateでまとめて保存し、日別展開テーブル・集計も1回で作り直す
+def apply_batch(schedule, operations, version=None):
+    if not isinstance(operations, list) or not operations:
+        return 400, {'error': 'operationsに変更内容のリストを指定してください'}
+    if len(operations) > MAX_OPERATIONS:
+        return 400, {'error': f'1回に送れるのは{MAX_OPERATIONS}件までです'}
+
+    with transaction.atomic():
+        #同じ予定表への変更が同時に来た時に、後の方が古いバージョンのまま保存しないように、バージョンを読む前に書き込みロックを取る
+        #SQLiteではselect_for_update()は何もしない（読むだけでは他の書き込みを止められない）ので、値の変わらないUPDATEで書き込みロックを取る
+        #（SQLiteはDB全体、他のDBはこの行がロックされ、他の変更がコミットし終わるまで待ってから読み直す）
+        Schedule.objects.filter(pk=schedule.pk).update(updated_at=F('updated_at'))
+        schedule = Schedule.objects.get(pk=schedule.pk)
+        current = schedule_version(schedule)
+        if version is not None and str(version) != current:
+            return 409, {'error': '予定表が他の画面で変更されています。読み込み直してください。', 'version': current}
+
+        #更新・削除する予定を1回のクエリでまとめて取得（この予定表の予定だけ）
+        ids = [op.get('id') for op in operations if isinstance(op, dict) and isinstance(op.get('id'), int)]
+        plans = Plan.objects.filter(schedule=schedule).in_bulk(ids)
+        dates = trip_dates(schedule.trip_start_date, schedule.trip_end_date)
+
+        results = []
+        to_create, to_update, delete_ids = [], [], []
+        seen_ids = set()
+        for index, op in enumerate(operations):
+            kind = op.get('op') if isinstance(op, dict) else None
+            result = {'index': index, 'op': kind}
+            results.append(result)
+            if kind not in OPERATIONS:
+                result['errors'] = {'op': ['createかupdateかdeleteを指定してください']}
+                continue
+
+            plan = None
+            if kind != 'create':
+                plan = plans.get(op.get('id'))
+                result['id'] = op.get('id')
+                if plan is None:
+                    result['errors'] = {'id': ['予定が見つかりません']}
+                    continue
+                if plan.id in seen_ids: #同じ予定への変更が2つあると、どちらが先か分からない
+                    result['errors'] = {'id': ['同じ予定が2回指定されています']}
+                    continue
+                seen_ids.add(plan.id)
+            if kind == 'delete':
+                delete_ids.append(plan.id)
+                continue
+
+            data = op.get('data')
+            if not isinstance(data, dict):
+                result['errors'] = {'data': ['dataに予定の内容を指定してください']}
+                continue
+            #更新は今の内容に送られてきた項目だけを上書きしてチェックする
+            form_data = plan_form_data(plan) if plan else {}
+            form_data.update({field: '' if value is None else value for field, value in data.items() if field in FORM_FIELDS})
+            form = PlanForm(form_data, instance=plan, trip_dates=dates)
+            if not form.is_valid():
+                result['errors'] = form_errors(form)
+                continue
+            saved = form.save(commit=False) #start_datetime・end_datetimeもここで入る
+            saved.schedule = schedule
+            (to_update if plan else to_create).append((result, saved))
+
+        #1件でもエラーがあれば何も保存しない
+        if any('errors' in result for result in results):
+            for result in results:
+                result['ok'] = 'errors' not in result
+            return 400, {'error': '入力内容にエラーがあります', 'results': results, 'version': current}
+
+        now = timezone.now()
+        if delete_ids:
+            Plan.objects.filter(schedule=schedule, pk__in=delete_ids).delete() #リンク・写真・日別展開の行も一緒に消える
+        if to_create:
+            Plan.objects.bulk_create([plan for _, plan in to_create])
+        if to_update:
+            for _, plan in to_update:
+                plan.updated_at = now #bulk_updateではauto_nowが動かない
+            Plan.objects.bulk_update([plan for _, plan in to_update], UPDATE_FIELDS)
+        sync_occurrences_for_plans([plan for _, plan in to_create + to_update])
+        refresh_schedule_summary(schedule) #更新日時（=バージョン）を進めて件数を数え直す
+
+    #保存した予定と時間が重なっている予定（conflicts.py）　予定表全体を1回なめて調べる
+    conflicts = conflict_map(schedule_conflicts(schedule))
+    for result, plan in to_create + to_update:
+        result['id'] = plan.id
+        result['plan'] = plan_json(plan)
+        result['conflicts'] = conflicts.get(plan.id, [])
+    for result in results:
+        result['ok'] = True
+    return 200, {'results': results, 'version': schedule_version(schedule)}
@@ -0,0 +1,301 @@
+#旅行会社などから届いた行程表（CSV・iCalendar）から予定をまとめて取り込む
+#ファイルは全部読み込まずに1行（1件）ずつ読み、予定追加・編集画面と同じPlanFormでチェックする
+#チェックを通った予定はBATCH_SIZE件ずつbulk_createで保存し（日別展開の行も一緒に）、通らなかった行は行番号とエラーを返す
+#全部の保存は1つのトランザクションで行う（途中で失敗したら1件も取り込まれない）
+#
+#CSVの1行目は項目名（英語の項目名か、下のCSV_COLUMNSの日本語）
+#  action_category,name,start_date,start_time,end_date,end_time,departure_location,arrival_location,transportation,memo
+#  move,,2025-08-01,09:00,2025-08-01,11:30,東京,新大阪,shinkansen,指定席
+#カテゴリと移動手段は、英語（move、train）でも日本語（移動、電車）でもいい
+import codecs
+import csv
+import io
+import os
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import transaction
+from django.utils import timezone
+
+from .conflicts import conflict_json, schedule_conflicts
+from .forms import ACTION_CATEGORY_CHOICES, PlanForm, trip_dates
+from .models import Plan, PlanDayOccurrence, Schedule
+from .occurrences import expand_plan
+from .plan_batch import FORM_FIELDS, form_errors
+from .summary import refresh_schedule_summary
+from . import transportation
+
+BATCH_SIZE = 500 #1回のbulk_createで保存する予定の数
+MAX_ROWS = 20000 #1つのファイルから取り込める予定の数
+MAX_ERRORS = 100 #返すエラーの行の数（数はすべて数える）
+MAX_CONFLICTS = 20 #返す時間の重なりの数
+SNIFF_SIZE = 64 * 1024 #文字コードを調べるために先に読む大きさ
+
+#CSVの日本語の項目名
+CSV_COLUMNS = {
+    'カテゴリ': 'action_category',
+    '名前': 'name',
+    '開始日': 'start_date',
+    '開始時刻': 'start_time',
+    '終了日': 'end_date',
+    '終了時刻': 'end_time',
+    '出発地': 'departure_location',
+    '到着地': 'arrival_location',
+    '移動手段': 'transportation',
+    'メモ': 'memo',
+}
+FIELD_LABELS = {field: label for label, field in CSV_COLUMNS.items()} #エラーを画面に出す時の項目名
+CATEGORY_NAMES = {label: value for value, label in ACTION_CATEGORY_CHOICES} | {'観光': 'sightseeing'}
+
+#終日の予定（宿泊）を取り込む時のチェックイン・チェックアウトの時刻
+DEFAULT_CHECK_IN = '15:00'
+DEFAULT_CHECK_OUT = '10:00'
+
+
+#ファイルの形がおかしくて読めない時のエラー
+class PlanImportError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+#カテゴリを英語の値にする（移動→move）
+def category_value(value):
+    value = (value or '').strip()
+    return CATEGORY_NAMES.get(value, value.lower())
+
+
+#移動手段を名前（train・電車）からidにする　見つからなければそのまま（PlanFormが選択肢にないエラーにする）
+def transportation_value(value):
+    value = (value or '').strip()
+    if not value or value.isdigit():
+        return value
+    for method in transportation.all_methods():
+        if value.lower() == method.transportation or value == str(method):
+            return str(method.id)
+    return value
+
+
+#ファイルの文字コードを決める　UTF-8として読めなければShift_JIS（Excelで保存したCSV）
+def detect_encoding(file):
+    head = file.read(SNIFF_SIZE)
+    file.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False) #途中で切れた文字はエラーにしない
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+
+def text_lines(file):
+    return io.TextIOWrapper(file, encoding=detect_encoding(file), errors='replace', newline='')
+
+
+#CSVを1行ずつ（行番号, PlanFormに渡すデータ）にする
+def csv_rows(file):
+    reader = csv.reader(text_lines(file))
+    try:
+        yield from _csv_rows(reader)
+    except csv.Error as e: #引用符が閉じていない、1つの項目が長すぎる（131072文字を超える）など
+        raise PlanImportError(f'CSVの{reader.line_num}行目を読めません（{e}）')
+
+
+def _csv_rows(reader):
+    header = next(reader, None)
+    if not header:
+        raise PlanImportError('CSVが空です')
+    columns = [CSV_COLUMNS.get(name.strip(), name.strip()) for name in header]
+    if not {'action_category', 'start_date'} <= set(columns):
+        raise PlanImportError('CSVの1行目に項目名（action_category、start_dateなど）を書いてください')
+    for values in reader:
+        if not any(value.strip() for value in values): #空の行
+            continue
+        data = {column: value.strip() for column, value in zip(columns, values) if column in FORM_FIELDS}
+        data['action_category'] = category_value(data.get('action_category'))
+        data['transportation'] = transportation_value(data.get('transportation'))
+        for key in ('start_date', 'end_date'):
+            if data.get(key):
+                data[key] = data[key].replace('/', '-')
+        yield reader.line_num, data
+
+
+#iCalendarの行を、折り返し（次の行の先頭が空白）をつなげて1行ずつ返す
+def unfolded_lines(lines):
+    current = None
+    for number, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current_number, current
+        current, current_number = line, number
+    if current is not None:
+        yield current_number, current
+
+
+def unescape_text(value):
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+#DTSTART・DTENDの値を（日本時間のdatetime, 終日かどうか）にする
+def parse_ics_datetime(params, value):
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d'), True
+    parsed = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    elif params.get('TZID'):
+        try:
+            parsed = parsed.replace(tzinfo=ZoneInfo(params['TZID']))
+        except (ZoneInfoNotFoundError, ValueError):
+            parsed = timezone.make_aware(parsed)
+    else: #タイムゾーンの指定がなければ日本時間
+        parsed = timezone.make_aware(parsed)
+    return timezone.localtime(parsed).replace(tzinfo=None), False
+
+
+#VEVENT1件分をPlanFormに渡すデータにする　ics.pyで出力したファイルは同じ内容に戻る
+def event_data(props):
+    start, all_day = props['DTSTART']
+    end, _ = props.get('DTEND', props['DTSTART'])
+    category = category_value(props.get('CATEGORIES', '').split(',')[0])
+    memo_lines = []
+    details = {}
+    for line in props.get('DESCRIPTION', '').split('\n'):
+        label, sep, value = line.partition('：')
+        if sep and label in ('出発', '到着', '移動手段', '予定表', 'チェックイン'):
+            details[label] = value
+        elif line:
+            memo_lines.append(line)
+
+    data = {'name': props.get('SUMMARY', '')[:24], 'memo': '\n'.join(memo_lines)}
+    if all_day:
+        last_day = end - timedelta(days=1) if end > start else start #DTENDはその日を含まない
+        if category == 'stay' or last_day > start: #何日かにまたがる終日の予定は宿泊
+            category = 'stay'
+            data.update(start_time=DEFAULT_CHECK_IN, end_time=DEFAULT_CHECK_OUT)
+        else:
+            data.update(start_time='00:00', end_time='23:59')
+        data.update(start_date=start.date().isoformat(), end_date=last_day.date().isoformat())
+    else:
+        data.update(
+            start_date=start.date().isoformat(), start_time=start.strftime('%H:%M'),
+            end_date=end.date().isoformat(), end_time=end.strftime('%H:%M'),
+        )
+
+    if category == 'move':
+        data.update(
+            departure_location=details.get('出発', ''),
+            arrival_location=details.get('到着', props.get('LOCATION', '')),
+            transportation=transportation_value(details.get('移動手段')),
+        )
+        if details.get('出発') and details.get('到着') and data['name'].startswith(f"{details['出発']}→"):
+            data['name'] = '' #出力の時に作った「出発地→到着地（移動手段）」は名前にしない
+    else:
+        category = category if category in CATEGORY_NAMES.values() else 'sightseeing'
+        data['arrival_location'] = props.get('LOCATION', '')[:24]
+    data['action_category'] = category
+    return data
+
+
+#iCalendarのVEVENTを1件ずつ（行番号, PlanFormに渡すデータ）にする
+def ics_rows(file):
+    props = None
+    found_calendar = False
+    for number, line in unfolded_lines(text_lines(file)):
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name, *param_parts = name.split(';')
+        name = name.upper()
+        params = dict(part.split('=', 1) for part in param_parts if '=' in part)
+        if name == 'BEGIN' and value == 'VCALENDAR':
+            found_calendar = True
+        elif name == 'BEGIN' and value == 'VEVENT':
+            props, start_number = {}, number
+        elif name == 'END' and value == 'VEVENT' and props is not None:
+            if props.get('DTSTART') is None or ('DTEND' in props and props['DTEND'] is None):
+                yield start_number, {'start_date': ''} #日時がない・読めない予定はPlanFormの必須エラーとして返す
+            else:
+                yield start_number, event_data(props)
+            props = None
+        elif props is not None:
+            if name in ('DTSTART', 'DTEND'):
+                try:
+                    props[name] = parse_ics_datetime(params, value.strip())
+                except ValueError:
+                    props[name] = None
+            elif name in ('SUMMARY', 'LOCATION', 'DESCRIPTION', 'CATEGORIES'):
+                props[name] = unescape_text(value)
+    if not found_calendar:
+        raise PlanImportError('iCalendar（.ics）のファイルではありません')
+
+
+#ファイル名（拡張子）からCSVかiCalendarかを決める
+def file_rows(uploaded_file):
+    ext = os.path.splitext(uploaded_file.name or '')[1].lower()
+    if ext == '.csv':
+        return csv_rows(uploaded_file)
+    if ext in ('.ics', '.ical', '.ifb'):
+        return ics_rows(uploaded_file)
+    raise PlanImportError('CSV（.csv）かiCalendar（.ics）のファイルを選んでください')
+
+
+#予定を取り込む　rowsは(行番号, PlanFormに渡すデータ)　dry_run=Trueの時はチェックだけして保存しない
+#返すのは{'created': 保存した数, 'error_count': エラーの行の数, 'errors': [{'row': 行番号, 'errors': {...}}], 'conflicts': [...]}
+def import_plans(schedule, rows, dry_run=False):
+    result = {'created': 0, 'error_count': 0, 'errors': [], 'conflict_count': 0, 'conflicts': []}
+    created_ids = set()
+    with transaction.atomic():
+        schedule = Schedule.objects.select_for_update().get(pk=schedule.pk) #取り込み中に他の画面で期間を変えられないように
+        dates = trip_dates(schedule.trip_start_date, schedule.trip_end_date)
+        pending = []
+        count = 0
+        for number, data in rows:
+            count += 1
+            if count > MAX_ROWS:
+                raise PlanImportError(f'1回に取り込めるのは{MAX_ROWS}件までです')
+            form = PlanForm(data) #日付の選択肢（画面のSelect用）は作らない　旅行期間の中かどうかは下で確かめる
+            errors = form_errors(form) if not form.is_valid() else {}
+            if not errors:
+                outside = [d for d in (form.cleaned_data['start_date'], form.cleaned_data['end_date']) if d and not dates[0] <= d <= dates[-1]]
+                if outside:
+                    errors = {'start_date': [f'旅行期間（{dates[0]}～{dates[-1]}）の外の日付です']}
+            if errors:
+                result['error_count'] += 1
+                if len(result['errors']) < MAX_ERRORS:
+                    result['errors'].append({'row': number, 'errors': errors})
+                continue
+            plan = form.save(commit=False)
+            plan.schedule = schedule
+            pending.append(plan)
+            if len(pending) >= BATCH_SIZE:
+                _save_batch(pending, dry_run, created_ids)
+                result['created'] += len(pending)
+                pending = []
+        if pending:
+            _save_batch(pending, dry_run, created_ids)
+            result['created'] += len(pending)
+        if not dry_run and result['created']:
+            refresh_schedule_summary(schedule)
+
+    #取り込んだ予定と時間が重なっている予定（conflicts.py）
+    if created_ids:
+        pairs = [pair for pair in schedule_conflicts(schedule) if pair[0].id in created_ids or pair[1].id in created_ids]
+        result['conflict_count'] = len(pairs)
+        result['conflicts'] = [conflict_json(first, second) for first, second in pairs[:MAX_CONFLICTS]]
+    return result
+
+
+#BATCH_SIZE件分の予定と日別展開の行をまとめて保存する（メモリには1回分しか持たない）
+def _save_batch(plans, dry_run, created_ids):
+    if dry_run:
+        return
+    Plan.objects.bulk_create(plans)
+    rows = []
+    for plan in plans:
+        rows.extend(expand_plan(plan))
+    PlanDayOccurrence.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    created_ids.update(plan.id for plan in plans)
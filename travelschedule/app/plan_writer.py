@@ -0,0 +1,104 @@
+#予定追加・編集画面の保存処理
+#予定本体・リンク・写真・日別展開テーブル・予定表の集計を1つのトランザクションでまとめて保存する
+#リンクと写真は1件ずつsave()/delete()せず、追加はbulk_create、更新はbulk_update、削除はid指定の1回のDELETEにまとめるので、
+#リンクや写真の数が増えてもDBとのやり取りの回数は変わらない
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Link, Picture
+from .occurrences import sync_plan_occurrences
+from .renditions import schedule_renditions
+from .storage import release_file
+from .summary import refresh_schedule_summary
+from .uploads import claim_uploads
+
+
+#写真フォームセットを、削除するid・追加する写真・差し替える写真に分ける
+def _split_pictures(picture_formset, plan):
+    delete_ids, to_create, to_update = [], [], []
+    for picture_form in picture_formset: #picture_formでフォームセットの中の1枚分のフォーム
+        instance = picture_form.instance #既存画像ならinstance.pkがある（DBに存在）　新規ならinstance.pkがない
+        delete_flag = picture_form.cleaned_data.get('DELETE', False) #そのフォームで削除にチェック入ったか
+        image = picture_form.cleaned_data.get('image') #新しくアップロードされた画像ファイルが入っているか
+
+        if delete_flag:
+            if instance.pk: #既存画像に削除チェックが入っていたら削除
+                delete_ids.append(instance.pk)
+            continue
+        if not instance.pk:
+            if image: #新規の写真　何も選ばれていない空フォームは無視する
+                picture = picture_form.save(commit=False)
+                picture.plan = plan #その画像をどの予定の画像か紐づける（FKセット）
+                to_create.append(picture)
+        elif picture_form.has_changed(): #既存の写真を別の画像に差し替えた時だけ更新（変わっていない写真は触らない）
+            old_image = picture_form.initial.get('image')
+            if old_image:
+                release_file(str(old_image)) #差し替え前の画像は、他の写真が使っていなければコミット後に削除する
+            to_update.append(picture_form.save(commit=False))
+    return delete_ids, to_create, to_update
+
+
+#リンクフォームセットを、削除するid・追加するリンク・更新するリンクに分ける
+def _split_links(link_formset, plan):
+    link_instances = link_formset.save(commit=False) #新規と内容が変わった既存のリンク（DBにはまだ保存しない）
+
+    #削除チェックが入ったリンク（deleted_objects）と、URLが空になった既存のリンクは削除
+    delete_ids = {obj.pk for obj in link_formset.deleted_objects}
+    for form in link_formset:
+        if form.instance.pk and not form.cleaned_data.get('url'):
+            delete_ids.add(form.instance.pk)
+
+    to_create, to_update = [], []
+    for link in link_instances:
+        if link.pk in delete_ids:
+            continue
+        if not (link.url and link.url.strip()): #URLが空のもの（スペースだけも）は保存しない
+            continue
+        link.plan = plan #どの予定のリンクかFKで紐づける
+        (to_update if link.pk else to_create).append(link)
+    return list(delete_ids), to_create, to_update
+
+
+#予定本体と、そのリンク・写真をまとめて保存する　途中で失敗した時は全部元に戻る
+#（写真ファイルだけはストレージに書かれた後で戻せないので、残ったファイルは後で掃除する）
+@transaction.atomic
+def save_plan(form, link_formset, picture_formset, schedule, uploads=()): #uploadsは分割アップロードで送り終えた写真（UploadSession）
+    plan = form.save(commit=False) #commit=FalseでDBに保存しないでオブジェクトだけ作る
+    plan.schedule = schedule #planモデルをscheduleと紐づけ
+    plan.save()
+    sync_plan_occurrences(plan) #予定詳細画面用の日別展開テーブルを書き直す
+
+    now = timezone.now() #bulk_updateではauto_nowが動かないので更新日時は自分で入れる
+
+    #写真
+    delete_ids, to_create, to_update = _split_pictures(picture_formset, plan)
+    to_create += claim_uploads(uploads, plan) #分割アップロード済みの写真も一緒に追加する（uploads.py）
+    if delete_ids:
+        Picture.objects.filter(plan=plan, pk__in=delete_ids).delete()
+    if to_create:
+        Picture.objects.bulk_create(to_create) #bulk_createでも画像ファイルの保存（pre_save）は行われる
+    if to_update:
+        image_field = Picture._meta.get_field('image')
+        for picture in to_update:
+            image_field.pre_save(picture, False) #bulk_updateは画像ファイルを保存しないので、ここでファイルだけ保存する
+            picture.renditions_ready = False #新しい画像の縮小版はまだない
+            picture.updated_at = now
+        Picture.objects.bulk_update(to_update, ['image', 'renditions_ready', 'updated_at'])
+    #新しい写真の縮小版は、保存が確定した後にスレッドプールで作る（renditions.py）
+    schedule_renditions([picture.pk for picture in to_create + to_update])
+
+    #リンク
+    delete_ids, to_create, to_update = _split_links(link_formset, plan)
+    if delete_ids:
+        Link.objects.filter(plan=plan, pk__in=delete_ids).delete()
+    if to_create:
+        Link.objects.bulk_create(to_create)
+    if to_update:
+        for link in to_update:
+            link.updated_at = now
+        Link.objects.bulk_update(to_update, ['title', 'url', 'updated_at'])
+
+    #予定表画面（ホーム画面）で更新順に並び替えできるように、予定が更新された＝予定表も更新されたと印をつける
+    #ホーム画面用の件数の数え直しと一緒にUPDATE1回で行う（summary.py）
+    refresh_schedule_summary(schedule)
+    return plan
@@ -0,0 +1,69 @@
+#予定詳細画面の表示キャッシュ
+#予定の保存・削除の時にはSchedule.updated_atが必ず更新されるので、updated_atをキャッシュのバージョンとして使う
+#キーは（予定表ID, updated_at, rendition_version, 表示部分）　予定表が変わると新しいキーになり、古いキーは使われなくなって自然に追い出される
+#写真の縮小版ができた時はupdated_atは変えずにrendition_versionが進む（renditions.py）
+from django.conf import settings
+from django.core.cache import caches
+
+from . import transportation
+
+#使うキャッシュの名前　settings.CACHESのどれを使うかをSCHEDULE_RENDER_CACHEで切り替えられる
+CACHE_ALIAS = getattr(settings, 'SCHEDULE_RENDER_CACHE', 'default')
+
+HITS_KEY = 'schedule_render:hits'
+MISSES_KEY = 'schedule_render:misses'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+#予定表と表示部分（例：'day:2025-08-01'）からキャッシュのキーを作る
+#表示には移動手段の名前も入るので、移動手段の一覧のバージョンもキーに入れる（管理画面で名前を変えると新しいキーになる）
+def make_key(schedule, part):
+    version = f'{schedule.updated_at.isoformat()}-{schedule.rendition_version}' if schedule.updated_at else '0'
+    return f'schedule_render:{schedule.id}:{version}:{transportation.version()}:{part}'
+
+
+#キャッシュにあればそれを返し、なければcompute()で作ってキャッシュに入れる
+#ヒット・ミスの回数はキャッシュの中に数える（複数プロセスでも同じキャッシュを使っていれば合計になる）
+def get_or_compute(schedule, part, compute):
+    cache = get_cache()
+    key = make_key(schedule, part)
+    value = cache.get(key)
+    if value is not None:
+        _count(cache, HITS_KEY)
+        return value, True
+
+    _count(cache, MISSES_KEY)
+    value = compute()
+    cache.set(key, value)
+    return value, False
+
+
+def _count(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError: #まだキーがない時（最初の1回・追い出された後）
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+#ヒット・ミスの回数とヒット率を返す
+def get_stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,93 @@
+#写真の縮小版（サムネイル・中サイズとそれぞれのWebP）を作る
+#スマホの写真は1枚5～10MBあるので、予定詳細画面では縮小版を表示し、元の画像は拡大表示やダウンロードの時だけ使う
+#縮小版はアップロード後にworkers.pyのスレッドプールで作り、元の画像と同じフォルダに保存する
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import workers
+from .models import Picture, Schedule
+
+logger = logging.getLogger(__name__)
+
+#種類：(長い辺の最大ピクセル, 保存形式, 拡張子)
+RENDITIONS = {
+    'thumb': (320, 'JPEG', 'jpg'),
+    'thumb_webp': (320, 'WEBP', 'webp'),
+    'medium': (1280, 'JPEG', 'jpg'),
+    'medium_webp': (1280, 'WEBP', 'webp'),
+}
+QUALITY = {'JPEG': 82, 'WEBP': 80}
+
+
+#縮小版のファイル名　plan_pictures/abc.jpg → plan_pictures/abc.thumb.jpg、plan_pictures/abc.thumb.webp
+def rendition_name(name, kind):
+    base, _ = os.path.splitext(name)
+    _, _, ext = RENDITIONS[kind]
+    return f"{base}.{kind.split('_')[0]}.{ext}"
+
+
+#画像1枚分の縮小版を全種類作って保存する
+def _write_renditions(storage, name):
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image) #スマホの写真の向き（EXIF）を反映してから縮小する
+        image.load()
+
+    #JPEGは透明を持てないので白背景に貼り付ける
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    for kind, (max_size, image_format, _) in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail((max_size, max_size)) #縦横比を保ったまま、元より大きくはしない
+        buffer = BytesIO()
+        resized.save(buffer, format=image_format, quality=QUALITY[image_format])
+        storage.save_as(rendition_name(name, kind), ContentFile(buffer.getvalue())) #元の画像から決まる名前のまま保存（作り直しの時は上書き）
+
+
+#写真1件の縮小版を作る（スレッドプールの中で実行される）
+#作り終わったら同じ画像を使っている写真全部を作成済みにし、その予定表のrendition_versionを進めて表示キャッシュを切り替える
+#（updated_atを進めると、ホーム画面の更新順の並びや最終更新日時までユーザーが何もしていないのに変わってしまう）
+def generate_renditions(picture_id):
+    name = Picture.objects.filter(pk=picture_id).values_list('image', flat=True).first()
+    if not name:
+        return False
+    storage = Picture._meta.get_field('image').storage
+    #同じ画像（storage.pyで同じファイルを共有）の縮小版がもうあれば作り直さない
+    already_made = Picture.objects.filter(image=name, renditions_ready=True).exists()
+    try:
+        if not already_made:
+            _write_renditions(storage, name)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning('写真 %s の縮小版を作れませんでした', name, exc_info=True)
+        return False
+
+    #作っている間に別の画像に差し替えられていたら、作成済みにはしない（差し替え後の画像の分が別に作られる）
+    with transaction.atomic():
+        updated = Picture.objects.filter(image=name, renditions_ready=False).update(renditions_ready=True)
+        if updated:
+            Schedule.objects.filter(plans__pictures__image=name).update(rendition_version=F('rendition_version') + 1)
+    return True
+
+
+#保存が確定した後で（トランザクションがコミットされてから）縮小版の作成をスレッドプールに渡す
+def schedule_renditions(picture_ids):
+    picture_ids = [picture_id for picture_id in picture_ids if picture_id]
+    if not picture_ids:
+        return
+
+    def submit_all():
+        for picture_id in picture_ids:
+            workers.submit(generate_renditions, picture_id)
+    transaction.on_commit(submit_all)
@@ -0,0 +1,79 @@
+#予定表・予定の検索
+#予定（名前・メモ・出発地・到着地・リンクのタイトル・予定表のタイトル）はFTS5の検索テーブル（app_plan_search）で探す
+#検索テーブルはマイグレーション0016のトリガーで書き込みのたびに更新されるので、ここでは読むだけ
+from django.db import connection
+from django.db.models import Q
+
+from .models import Plan, Schedule
+
+MIN_FTS_LENGTH = 3 #trigramは3文字単位の索引なので、2文字以下の語はFTSでは探せない
+MAX_RESULTS = 50
+
+
+#検索語を空白で区切る（全角スペースも区切りにする）
+def split_terms(query):
+    return (query or '').replace('　', ' ').split()
+
+
+#FTS5を使えるか　SQLite以外、または短い語が混ざっている時はLIKE検索にする
+def use_fts(terms):
+    return connection.vendor == 'sqlite' and all(len(term) >= MIN_FTS_LENGTH for term in terms)
+
+
+#FTS5のMATCH用の文字列を作る　1語ずつ""で囲んで記号をそのまま探せるようにし、空白区切りでAND検索にする
+def build_match(terms):
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+#ログイン中のユーザーの予定から探して、一致度の高い順にidを返す
+def _fts_plan_ids(user, terms, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT app_plan_search.rowid
+            FROM app_plan_search
+            JOIN app_plan ON app_plan.id = app_plan_search.rowid
+            JOIN app_schedule ON app_schedule.id = app_plan.schedule_id
+            WHERE app_plan_search MATCH %s AND app_schedule.user_id = %s
+            ORDER BY app_plan_search.rank
+            LIMIT %s
+            ''',
+            [build_match(terms), user.id, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+#短い語やSQLite以外のデータベース用　全ての語がどこかの項目に含まれる予定を探す
+def _like_plan_ids(user, terms, limit):
+    plans = Plan.objects.filter(schedule__user=user)
+    for term in terms:
+        plans = plans.filter(
+            Q(name__icontains=term)
+            | Q(memo__icontains=term)
+            | Q(departure_location__icontains=term)
+            | Q(arrival_location__icontains=term)
+            | Q(schedule__title__icontains=term)
+            | Q(links__title__icontains=term)
+        )
+    return list(plans.order_by('-start_datetime').values_list('id', flat=True).distinct()[:limit])
+
+
+#予定の検索　一致した予定を予定表と一緒に1回で取得し、検索の順番のまま返す
+def search_plans(user, query, limit=MAX_RESULTS):
+    terms = split_terms(query)
+    if not terms:
+        return []
+    ids = _fts_plan_ids(user, terms, limit) if use_fts(terms) else _like_plan_ids(user, terms, limit)
+    plans = Plan.objects.select_related('schedule').in_bulk(ids)
+    return [plans[plan_id] for plan_id in ids if plan_id in plans]
+
+
+#予定表タイトルの検索（予定がまだない予定表も見つかるように）　1ユーザーの予定表の数は少ないのでLIKEで探す
+def search_schedules(user, query):
+    terms = split_terms(query)
+    if not terms:
+        return []
+    schedules = Schedule.objects.filter(user=user)
+    for term in terms:
+        schedules = schedules.filter(title__icontains=term)
+    return list(schedules.order_by('-trip_start_date', '-id')[:MAX_RESULTS])
@@ -0,0 +1,32 @@
+#モデルのシグナル受け取り　apps.pyのready()で読み込んで登録する
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import transportation
+from .itinerary import remove_itineraries
+from .models import Picture, Schedule, TransportationMethod
+from .storage import release_file
+
+
+#移動手段が管理画面などで保存・削除されたら、メモリに読み込んだ一覧を捨てる
+#コミット前に捨てると、その間に別のリクエストが変更前の一覧を読み直してずっと使い続けるので、コミット後に捨てる
+@receiver(post_save, sender=TransportationMethod)
+@receiver(post_delete, sender=TransportationMethod)
+def invalidate_transportation_registry(sender, **kwargs):
+    transaction.on_commit(transportation.invalidate)
+
+
+#写真が削除されたら、そのファイルを他の写真が使っていないかをコミット後に調べ、使われていなければ削除する（storage.py）
+#予定や予定表の削除で写真がまとめて消える時も、ここを通るので1回にまとめて調べる
+@receiver(post_delete, sender=Picture)
+def release_picture_file(sender, instance, **kwargs):
+    if instance.image:
+        release_file(instance.image.name)
+
+
+#予定表が削除されたら、印刷用の行程表のファイル（itinerary.py）もコミット後に消す
+@receiver(post_delete, sender=Schedule)
+def remove_schedule_itineraries(sender, instance, **kwargs):
+    schedule_id = instance.id
+    transaction.on_commit(lambda: remove_itineraries(schedule_id))
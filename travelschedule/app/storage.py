@@ -0,0 +1,112 @@
+#写真ファイルの保存先　ファイルの中身のハッシュ値（SHA-256）をファイル名にして、同じ画像は1回だけ保存する
+#plan_pictures/写真.jpg → plan_pictures/ab/abcdef…(64文字).jpg
+#同じ画像を別の予定に付けたり、同じ写真をもう一度アップロードした時は、書き込まずに既存のファイル名を返す
+#ファイルは複数のPictureから参照されるので、削除はrelease_files()で最後の参照がなくなった時だけ行う
+import hashlib
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+
+
+#ファイルの中身からハッシュ値を計算する（大きいファイルも少しずつ読む）
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE) if hasattr(content, 'chunks') else iter(lambda: content.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+#ハッシュ値からファイル名を作る　フォルダが大きくなりすぎないように先頭2文字でフォルダを分ける
+def content_name(directory, digest, ext):
+    return os.path.join(directory, digest[:2], f'{digest}{ext.lower()}')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1]
+        name = content_name(directory, content_hash(content), ext)
+        if self.exists(name): #同じ中身のファイルがもうある時は書き込まない
+            self.touch(name) #使い始めた時刻を残す　コミット前に別の写真の削除で消されないように（release_files）
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    #ファイルの更新日時を今にする（他のスレッドが消した後なら何もしない）
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    #ファイルが最近保存・再利用されたか
+    def recently_used(self, name, seconds):
+        try:
+            return os.path.getmtime(self.path(name)) > time.time() - seconds
+        except FileNotFoundError:
+            return False
+
+    #ハッシュ値の名前にせず、指定した名前のまま保存する（縮小版など、元の画像から名前が決まるファイル用）　同じ名前があれば上書き
+    def save_as(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+
+picture_storage = ContentAddressedStorage()
+
+
+#削除されたPictureのファイル名をトランザクションの終わりまで貯めておき、コミット後にまとめて片付ける
+#（ロールバックされた時に残った名前は次のコミットで一緒に調べられるが、参照が残っているので削除はされない）
+_pending = threading.local()
+
+
+def release_file(name):
+    if not name:
+        return
+    if getattr(_pending, 'names', None) is None:
+        _pending.names = set()
+    _pending.names.add(name)
+    transaction.on_commit(_flush_pending) #何回登録しても最初の1回でまとめて処理し、残りは何もしない
+
+
+def _flush_pending():
+    names = getattr(_pending, 'names', None)
+    _pending.names = None
+    if names:
+        from . import workers
+        workers.submit(release_files, sorted(names))
+
+
+#どのPictureからも参照されなくなったファイルを、その縮小版と一緒に削除する
+#image列の索引で参照が残っているファイル名を1回で調べる（削除する直前にもう一度確認する）
+#コミット済みの行だけでは、別のリクエストが同じ画像をコミット前に保存している途中かは分からないので、
+#PICTURE_RELEASE_GRACE_SECONDS以内に保存・再利用されたファイルは消さずに、参照がないままならcollect_orphan_picturesに任せる
+def release_files(names):
+    from .models import Picture
+    from .renditions import RENDITIONS, rendition_name
+
+    names = set(names)
+    referenced = set(Picture.objects.filter(image__in=names).values_list('image', flat=True))
+    deleted = []
+    for name in sorted(names - referenced):
+        if Picture.objects.filter(image=name).exists(): #調べた後で同じ画像がアップロードされた時は残す
+            continue
+        if picture_storage.recently_used(name, settings.PICTURE_RELEASE_GRACE_SECONDS):
+            continue
+        for target in [name] + [rendition_name(name, kind) for kind in RENDITIONS]:
+            if picture_storage.exists(target):
+                picture_storage.delete(target)
+        deleted.append(name)
+    return deleted
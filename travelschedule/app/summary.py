@@ -0,0 +1,72 @@
+#ホーム画面の予定表カードに出す集計値（予定数・リンク数・写真数・次の予定）
+#カードごとに数えるとN+1になるので、数はScheduleの列に持たせ、予定・リンク・写真が変わった時にUPDATE1回で数え直す
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from .models import Link, Picture, Plan, Schedule
+
+
+#予定表ごとの件数を数えるサブクエリ（UPDATEや比較の中で予定表1行ずつに対して実行される）
+def _count_subquery(model, schedule_path):
+    counts = (
+        model.objects.filter(**{schedule_path: OuterRef('pk')})
+        .order_by()
+        .values(schedule_path)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts), 0) #1件もない時はサブクエリがNULLになるので0にする
+
+
+#集計列に入れる正しい値の式
+def summary_expressions():
+    return {
+        'plan_count': _count_subquery(Plan, 'schedule'),
+        'link_count': _count_subquery(Link, 'plan__schedule'),
+        'picture_count': _count_subquery(Picture, 'plan__schedule'),
+    }
+
+
+#予定表1件の集計列を数え直す　予定・リンク・写真を保存・削除した後に、同じトランザクションの中で呼ぶ
+#touch=Trueの時はupdated_atも同じUPDATEで更新する（予定が変わった＝予定表も更新されたという印と、表示キャッシュの切り替え用）
+def refresh_schedule_summary(schedule, touch=True):
+    values = summary_expressions()
+    if touch:
+        schedule.updated_at = timezone.now() #画面側で使うキャッシュキーも新しい時刻にそろえる
+        values['updated_at'] = schedule.updated_at
+    Schedule.objects.filter(pk=schedule.pk).update(**values) #数えるのも書き込むのもUPDATE文1回（auto_nowはupdate()では動かないので明示的に入れる）
+
+
+#集計列が実際の件数とずれている予定表を探す（管理コマンドで使う）
+def drifted_schedules(queryset=None):
+    queryset = Schedule.objects.all() if queryset is None else queryset
+    expected = {f'expected_{name}': expression for name, expression in summary_expressions().items()}
+    return queryset.annotate(**expected).filter(
+        ~Q(plan_count=F('expected_plan_count'))
+        | ~Q(link_count=F('expected_link_count'))
+        | ~Q(picture_count=F('expected_picture_count'))
+    )
+
+
+#ずれている予定表の集計列をまとめて直す　updated_atは触らない（中身は変わっていないため）
+def reconcile_summaries(queryset=None):
+    ids = list(drifted_schedules(queryset).values_list('id', flat=True))
+    if ids:
+        Schedule.objects.filter(id__in=ids).update(**summary_expressions())
+    return ids
+
+
+#ホーム画面の一覧用に「次の予定」をサブクエリで付ける（一覧の取得と同じ1回のクエリで済む）
+#今より後に始まる予定のうち一番早いもの　plan_schedule_start_idxの範囲検索で探す
+def with_next_plan(queryset, now=None):
+    upcoming = Plan.objects.filter(
+        schedule=OuterRef('pk'),
+        start_datetime__gte=now or timezone.now(),
+    ).order_by('start_datetime', 'id').annotate(
+        label=Coalesce(NullIf('name', Value('')), 'arrival_location'), #移動の予定は名前が空なので到着地を出す
+    )
+    return queryset.annotate(
+        next_plan_name=Subquery(upcoming.values('label')[:1]),
+        next_plan_start=Subquery(upcoming.values('start_datetime')[:1]),
+    )
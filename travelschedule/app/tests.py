@@ -1,3 +1,1761 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.core.management import call_command
+from django.utils import timezone
+from types import SimpleNamespace
+from datetime import date, datetime, timedelta
+import random
+import os
+from io import StringIO, BytesIO
+from contextlib import contextmanager
+from unittest import mock
+import shutil
+import time
+import tempfile
+from PIL import Image
 
-# Create your tests here.
+from .models import User, Schedule, Plan, Link, Picture, TransportationMethod, PlanDayOccurrence
+from .occurrences import sync_plan_occurrences, rebuild_schedule_occurrences
+from .timeline import TimelineEntry, layout_day
+from . import render_cache
+from .pagination import PAGE_SIZE
+from .summary import refresh_schedule_summary, drifted_schedules
+from .search import search_plans
+from .checks import check_plan_search_triggers
+from .forms import PlanForm, trip_dates, trip_date_choices
+from . import transportation
+from . import workers
+from .renditions import generate_renditions, rendition_name
+from django.core.files.storage import default_storage, FileSystemStorage
+from .storage import picture_storage, release_files
+from .models import UploadSession
+from .uploads import UploadError, append_chunk, part_path, purge_expired
+from .media_gc import walk_files
+from .plan_batch import schedule_version
+from .conflicts import plan_conflicts, schedule_conflicts
+from .duplication import duplicate_schedule
+from .trip_shift import shift_schedule
+from .trimming import trim_preview, trim_schedule
+from .ics import calendar_stream, fold, schedule_plans
+from .plan_import import import_plans, csv_rows, ics_rows
+from . import itinerary
+from concurrent.futures import Future
+import json
+
+
+#テスト用の予定を作る　start,endは9:00からの分数
+def make_entry(start, end, stay=False):
+    base = datetime(2025, 8, 1, 9, 0)
+    entry = SimpleNamespace(
+        start_datetime=base + timedelta(minutes=start),
+        end_datetime=base + timedelta(minutes=end),
+    )
+    if stay:
+        entry.is_stay_display = True
+        entry.display_datetime = entry.start_datetime
+    return entry
+
+
+#以前のschedule_detail_viewと同じ重なり判定（全ての先行予定の終了時刻と比べる）
+def legacy_nest_levels(entries):
+    sorted_entries = sorted(entries, key=lambda e: getattr(e, 'display_datetime', e.start_datetime))
+    active_ends = []
+    levels = []
+    for entry in sorted_entries:
+        level = 0
+        if not getattr(entry, 'is_stay_display', False):
+            for end in active_ends:
+                if entry.start_datetime < end:
+                    level += 1
+            active_ends.append(entry.end_datetime)
+        levels.append(level)
+    return levels
+
+
+#テスト用の小さい画像ファイル（アップロードされたファイルとして使う）
+def make_image(name='photo.png', color='red', size=(8, 8)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+#画像を保存するテスト用　MEDIA_ROOTを一時フォルダにして、テストが終わったら消す
+class TempMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        upload_dir = tempfile.mkdtemp() #分割アップロードの一時ファイル用
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        itinerary_dir = tempfile.mkdtemp() #印刷用の行程表のファイル用
+        self.addCleanup(shutil.rmtree, itinerary_dir, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, UPLOAD_SESSION_DIR=upload_dir, ITINERARY_DIR=itinerary_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+        self.upload_dir = upload_dir
+        self.itinerary_dir = itinerary_dir
+
+
+#タイムライン計算（timeline.layout_day）のテスト
+class LayoutDayTests(SimpleTestCase):
+    def test_no_overlap(self):
+        entries = [make_entry(60, 90), make_entry(0, 30), make_entry(30, 60)]
+        result = layout_day(entries)
+        self.assertEqual([e.start_datetime.minute for e in result], [0, 30, 0])
+        self.assertEqual([e.nest_level for e in result], [0, 0, 0])
+        self.assertEqual([e.lane for e in result], [0, 0, 0])
+        self.assertEqual([e.lane_count for e in result], [1, 1, 1])
+        self.assertEqual(len({e.cluster for e in result}), 3)
+
+    def test_overlap_lanes(self):
+        a = make_entry(0, 120)
+        b = make_entry(30, 60)
+        c = make_entry(70, 100) #bの列が空いたので再利用される
+        d = make_entry(200, 210)
+        layout_day([a, b, c, d])
+        self.assertEqual([a.nest_level, b.nest_level, c.nest_level, d.nest_level], [0, 1, 1, 0])
+        self.assertEqual([a.lane, b.lane, c.lane, d.lane], [0, 1, 1, 0])
+        self.assertEqual([a.lane_count, b.lane_count, c.lane_count, d.lane_count], [2, 2, 2, 1])
+        self.assertEqual(a.cluster, c.cluster)
+        self.assertNotEqual(a.cluster, d.cluster)
+
+    def test_stay_is_background(self):
+        stay = make_entry(0, 600, stay=True)
+        meal = make_entry(10, 40)
+        layout_day([stay, meal])
+        self.assertEqual(stay.nest_level, 0)
+        self.assertEqual(meal.nest_level, 0)
+        self.assertNotEqual(stay.cluster, meal.cluster)
+
+    def test_matches_legacy_nest_level(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            entries = []
+            for _ in range(rng.randint(0, 40)):
+                start = rng.randint(0, 600)
+                entries.append(make_entry(start, start + rng.randint(0, 180), stay=rng.random() < 0.1))
+            expected = legacy_nest_levels(entries)
+            self.assertEqual([e.nest_level for e in layout_day(entries)], expected)
+
+    def test_lanes_never_collide(self):
+        rng = random.Random(1)
+        entries = []
+        for _ in range(200):
+            start = rng.randint(0, 1000)
+            entries.append(make_entry(start, start + rng.randint(1, 120)))
+        layout_day(entries)
+        for x in entries:
+            for y in entries:
+                if x is not y and x.lane == y.lane:
+                    overlap = x.start_datetime < y.end_datetime and y.start_datetime < x.end_datetime
+                    self.assertFalse(overlap)
+            self.assertLess(x.lane, x.lane_count)
+
+
+#表示用データ（TimelineEntry）のテスト
+class TimelineEntryTests(SimpleTestCase):
+    def test_entry_shares_plan_without_copy(self):
+        plan = make_entry(0, 60)
+        checkin = TimelineEntry(plan, 'checkin', plan.start_datetime)
+        checkout = TimelineEntry(plan, 'checkout', plan.end_datetime)
+        self.assertIs(checkin.plan, checkout.plan)
+        self.assertTrue(checkin.is_stay_display)
+        self.assertEqual(checkout.display_datetime, plan.end_datetime)
+        self.assertFalse(hasattr(checkin, '__dict__')) #__slots__で余計な属性を持たない
+
+    def test_plain_entry_sorts_by_plan_start(self):
+        late = TimelineEntry(make_entry(60, 90))
+        early = TimelineEntry(make_entry(0, 30))
+        self.assertEqual(layout_day([late, early]), [early, late])
+        self.assertFalse(early.is_stay_display)
+
+
+#予定詳細画面の表示テスト
+class ScheduleDetailViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@example.com', name='test', password='pass1234', username='test')
+        self.client.force_login(self.user)
+        render_cache.get_cache().clear()
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        for plan in [
+            Plan(schedule=self.schedule, action_category='sightseeing', name='A', start_datetime=aware(2025, 8, 1, 9), end_datetime=aware(2025, 8, 1, 12)),
+            Plan(schedule=self.schedule, action_category='meal', name='B', start_datetime=aware(2025, 8, 1, 10), end_datetime=aware(2025, 8, 1, 11)),
+            Plan(schedule=self.schedule, action_category='stay', name='ホテル', start_datetime=aware(2025, 8, 1, 15), end_datetime=aware(2025, 8, 2, 10)),
+        ]:
+            plan.save()
+            sync_plan_occurrences(plan)
+
+    def test_overlapping_plans_are_laid_out_in_lanes(self):
+        response = self.client.get(reverse('app:schedule_detail', args=[self.schedule.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'plan-lanes-multi')
+        self.assertContains(response, 'チェックイン')
+        self.assertNotContains(response, 'チェックアウト') #2日目は最初は読み込まない
+        self.assertEqual(len(response.context['sorted_dates']), 3)
+        html = response.content.decode()
+        self.assertLess(html.index('>A<'), html.index('>B<'))
+        self.assertEqual(html.count('この予定は他の予定と重なっています'), 1)
+
+    def test_selected_day_is_rendered_first(self):
+        response = self.client.get(reverse('app:schedule_detail', args=[self.schedule.id]) + '?selected_day=2')
+        self.assertEqual(response.context['selected_day'], 2)
+        self.assertContains(response, 'チェックアウト')
+        self.assertNotContains(response, 'チェックイン')
+
+    def test_day_fragment(self):
+        response = self.client.get(reverse('app:schedule_day', args=[self.schedule.id, '2025-08-02']))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'チェックアウト')
+        self.assertNotContains(response, '<html')
+        self.assertEqual(self.client.get(reverse('app:schedule_day', args=[self.schedule.id, 'abc'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('app:schedule_day', args=[self.schedule.id, '2025-02-30'])).status_code, 404)
+
+    def test_render_cache_is_versioned_by_updated_at(self):
+        url = reverse('app:schedule_day', args=[self.schedule.id, '2025-08-01'])
+        self.assertEqual(self.client.get(url)['X-Render-Cache'], 'miss')
+        with self.assertNumQueries(3): #セッション、ユーザー、予定表の3回だけ（予定の検索とテンプレート描画はしない）
+            response = self.client.get(url)
+        self.assertEqual(response['X-Render-Cache'], 'hit')
+        self.assertEqual(render_cache.get_stats()['hits'], 1)
+
+        #予定表が更新されると新しいバージョンのキーになる
+        self.schedule.save()
+        self.assertEqual(self.client.get(url)['X-Render-Cache'], 'miss')
+
+    def test_transportation_change_invalidates_cache_and_etag(self):
+        #管理画面で移動手段を変えたら、予定表を保存し直さなくても新しい表示になる
+        with self.captureOnCommitCallbacks(execute=True):
+            method = TransportationMethod.objects.create(transportation='car', transportation_icon_class='fas fa-car')
+        plan = Plan.objects.create(schedule=self.schedule, action_category='move', transportation=method, departure_location='東京', arrival_location='横浜',
+                                   start_datetime=timezone.make_aware(datetime(2025, 8, 1, 7)), end_datetime=timezone.make_aware(datetime(2025, 8, 1, 8)))
+        sync_plan_occurrences(plan)
+        self.schedule.save()
+        url = reverse('app:schedule_day', args=[self.schedule.id, '2025-08-01'])
+        first = self.client.get(url)
+        self.assertContains(first, 'fas fa-car')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        method.transportation_icon_class = 'fas fa-car-side'
+        with self.captureOnCommitCallbacks(execute=True):
+            method.save() #コミット後にsignals.pyで移動手段の一覧が読み直される
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Render-Cache'], 'miss')
+        self.assertContains(response, 'fas fa-car-side')
+
+    def test_other_users_schedule_is_404(self):
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('app:schedule_day', args=[self.schedule.id, '2025-08-01'])).status_code, 404)
+
+
+#条件付きGET（ETag / Last-Modified）のテスト
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='etag@example.com', name='etag', password='pass1234', username='etag')
+        self.client.force_login(self.user)
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-02')
+
+    def assertNotModifiedUntilChanged(self, url, change):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        with self.assertNumQueries(3): #セッション、ユーザー、検証値の3回だけでテンプレートも描画しない
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        change()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_schedule_detail(self):
+        self.assertNotModifiedUntilChanged(reverse('app:schedule_detail', args=[self.schedule.id]), lambda: self.schedule.save())
+
+    def test_schedule_day(self):
+        self.assertNotModifiedUntilChanged(reverse('app:schedule_day', args=[self.schedule.id, '2025-08-01']), lambda: self.schedule.save())
+
+    def test_home_changes_when_schedule_deleted(self):
+        other = Schedule.objects.create(user=self.user, title='古い旅行', trip_start_date='2024-08-01', trip_end_date='2024-08-02')
+        self.assertNotModifiedUntilChanged(reverse('app:home'), lambda: other.delete())
+
+    def test_home_changes_when_next_plan_starts(self):
+        #予定表が変わらなくても、カードの「次の予定」の開始時刻を過ぎたら304にしない
+        start = timezone.now() + timedelta(hours=1)
+        Plan.objects.create(schedule=self.schedule, action_category='meal', name='昼食', start_datetime=start, end_datetime=start + timedelta(hours=1))
+        Plan.objects.create(schedule=self.schedule, action_category='meal', name='夕食', start_datetime=start + timedelta(hours=6), end_datetime=start + timedelta(hours=7))
+        url = reverse('app:home')
+        first = self.client.get(url)
+        self.assertContains(first, '昼食')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=start + timedelta(minutes=1)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '夕食')
+
+    def test_other_users_schedule_is_not_revealed(self):
+        other = User.objects.create_user(email='other2@example.com', name='other2', password='pass1234', username='other2')
+        self.client.force_login(other)
+        response = self.client.get(reverse('app:schedule_detail', args=[self.schedule.id]), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+#ホーム画面のキーセットページネーションのテスト
+class HomePaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='page@example.com', name='page', password='pass1234', username='page')
+        self.client.force_login(self.user)
+        #同じ開始日の予定表を混ぜて、idでも順番が決まることを確かめる
+        self.schedules = [
+            Schedule.objects.create(user=self.user, title=f'旅行{i}', trip_start_date=datetime(2025, 1, 1 + i // 3).date(), trip_end_date='2025-12-31')
+            for i in range(PAGE_SIZE * 2 + 5)
+        ]
+
+    def collect(self, sort):
+        titles = []
+        response = self.client.get(reverse('app:home') + f'?sort={sort}')
+        titles += [s.title for s in response.context['schedules']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(reverse('app:home_schedules'), {'sort': sort, 'cursor': cursor})
+            self.assertNotContains(response, '<html')
+            titles += [s.title for s in response.context['schedules']]
+            cursor = response.context['next_cursor']
+        return titles
+
+    def test_date_order_visits_every_schedule_once(self):
+        expected = [s.title for s in sorted(self.schedules, key=lambda s: (s.trip_start_date, s.id), reverse=True)]
+        self.assertEqual(self.collect('date'), expected)
+
+    def test_updated_order_visits_every_schedule_once(self):
+        expected = [s.title for s in Schedule.objects.filter(user=self.user).order_by('-updated_at', '-id')]
+        self.assertEqual(self.collect('updated'), expected)
+
+    def test_first_page_has_sentinel_and_broken_cursor_starts_over(self):
+        response = self.client.get(reverse('app:home'))
+        self.assertContains(response, 'schedule-list-sentinel')
+        self.assertEqual(len(response.context['schedules']), PAGE_SIZE)
+        self.assertFalse(response.context['no_schedules'])
+        response = self.client.get(reverse('app:home_schedules'), {'cursor': 'abc_def'})
+        self.assertEqual(len(response.context['schedules']), PAGE_SIZE)
+
+
+#日別展開テーブル（PlanDayOccurrence）のテスト
+class PlanDayOccurrenceTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='occ@example.com', name='occ', password='pass1234', username='occ')
+        self.schedule = Schedule.objects.create(user=user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-05')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        self.tour = Plan.objects.create(schedule=self.schedule, action_category='sightseeing', name='周遊', start_datetime=aware(2025, 8, 1, 9), end_datetime=aware(2025, 8, 3, 18))
+        self.stay = Plan.objects.create(schedule=self.schedule, action_category='stay', name='宿', start_datetime=aware(2025, 8, 3, 15), end_datetime=aware(2025, 8, 4, 10))
+
+    def rows(self):
+        return list(PlanDayOccurrence.objects.order_by('date', 'display_datetime').values_list('plan_id', 'date', 'display_type'))
+
+    def test_sync_expands_days_and_stays(self):
+        sync_plan_occurrences(self.tour)
+        sync_plan_occurrences(self.stay)
+        d = lambda day: datetime(2025, 8, day).date()
+        self.assertEqual(self.rows(), [
+            (self.tour.id, d(1), ''), (self.tour.id, d(2), ''), (self.tour.id, d(3), ''),
+            (self.stay.id, d(3), 'checkin'), (self.stay.id, d(4), 'checkout'),
+        ])
+
+    def test_resync_and_cascade_delete(self):
+        sync_plan_occurrences(self.tour)
+        self.tour.end_datetime = self.tour.start_datetime
+        self.tour.save()
+        sync_plan_occurrences(self.tour)
+        self.assertEqual(len(self.rows()), 1)
+        self.tour.delete()
+        self.assertEqual(self.rows(), [])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_plan_occurrences', stdout=StringIO())
+        self.assertEqual(len(self.rows()), 5)
+
+
+#予定表の集計列（summary.py）のテスト
+class ScheduleSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='sum@example.com', name='sum', password='pass1234', username='sum')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-05')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        self.plan = Plan.objects.create(schedule=self.schedule, action_category='sightseeing', name='城', start_datetime=aware(2025, 8, 2, 9), end_datetime=aware(2025, 8, 2, 11))
+        Link.objects.create(plan=self.plan, title='L', url='https://example.com/')
+        Picture.objects.create(plan=self.plan, image='plan_pictures/a.jpg')
+        self.client.force_login(self.user)
+
+    def counts(self):
+        self.schedule.refresh_from_db()
+        return (self.schedule.plan_count, self.schedule.link_count, self.schedule.picture_count)
+
+    def test_refresh_counts_and_touches_updated_at(self):
+        before = Schedule.objects.get(id=self.schedule.id).updated_at
+        refresh_schedule_summary(self.schedule)
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.assertGreater(self.schedule.updated_at, before)
+
+    def test_plan_delete_updates_counts(self):
+        refresh_schedule_summary(self.schedule)
+        self.client.post(reverse('app:plan_delete_view', args=[self.plan.id]))
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_trimming_updates_counts(self):
+        refresh_schedule_summary(self.schedule)
+        self.client.post(reverse('app:edit_schedule_title'), {
+            'schedule_id': self.schedule.id, 'title': '旅行', 'start_date': '2025-08-03', 'end_date': '2025-08-05',
+        })
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_home_shows_summary_and_next_plan(self):
+        refresh_schedule_summary(self.schedule)
+        Plan.objects.filter(id=self.plan.id).update(start_datetime=timezone.now() + timedelta(days=1), end_datetime=timezone.now() + timedelta(days=2))
+        response = self.client.get(reverse('app:home'))
+        self.assertContains(response, '予定1件')
+        self.assertContains(response, '写真1枚')
+        self.assertContains(response, '次の予定：')
+        self.assertContains(response, '城')
+
+    def test_past_plans_are_not_next(self):
+        response = self.client.get(reverse('app:home'))
+        self.assertNotContains(response, '次の予定：')
+
+    def test_reconcile_command_repairs_drift(self):
+        self.assertEqual(list(drifted_schedules().values_list('id', flat=True)), [self.schedule.id])
+        before = Schedule.objects.get(id=self.schedule.id).updated_at
+        out = StringIO()
+        call_command('reconcile_schedule_summaries', '--dry-run', stdout=out)
+        self.assertIn('1件', out.getvalue())
+        self.assertEqual(self.counts(), (0, 0, 0))
+        call_command('reconcile_schedule_summaries', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.assertEqual(self.schedule.updated_at, before) #直すだけでは更新日時は変えない
+        self.assertFalse(drifted_schedules().exists())
+
+
+#検索（search.py、FTS5の検索テーブルとトリガー）のテスト
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='search@example.com', name='search', password='pass1234', username='search')
+        self.schedule = Schedule.objects.create(user=self.user, title='札幌旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-05')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        self.ramen = Plan.objects.create(schedule=self.schedule, action_category='meal', name='味噌ラーメン屋', memo='バターコーンが美味しい', start_datetime=aware(2025, 8, 2, 12), end_datetime=aware(2025, 8, 2, 13))
+        self.move = Plan.objects.create(schedule=self.schedule, action_category='move', departure_location='新千歳空港', arrival_location='札幌駅', start_datetime=aware(2025, 8, 1, 9), end_datetime=aware(2025, 8, 1, 10))
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        other_schedule = Schedule.objects.create(user=other, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-05')
+        Plan.objects.create(schedule=other_schedule, action_category='meal', name='醤油ラーメン屋', start_datetime=aware(2025, 8, 2, 12), end_datetime=aware(2025, 8, 2, 13))
+
+    def found(self, query):
+        return [plan.id for plan in search_plans(self.user, query)]
+
+    def test_japanese_partial_match_only_own_plans(self):
+        self.assertEqual(self.found('ラーメン'), [self.ramen.id])
+        self.assertEqual(self.found('千歳空'), [self.move.id])
+        self.assertEqual(self.found('バターコーン 味噌'), [self.ramen.id]) #空白区切りはAND
+
+    def test_index_follows_writes(self):
+        self.ramen.memo = '塩バター'
+        self.ramen.save()
+        self.assertEqual(self.found('コーン'), [])
+        Link.objects.create(plan=self.move, title='時刻表ページ', url='https://example.com/')
+        self.assertEqual(self.found('時刻表'), [self.move.id])
+        self.schedule.title = '北海道ドライブ'
+        self.schedule.save()
+        self.assertEqual(sorted(self.found('北海道')), sorted([self.ramen.id, self.move.id]))
+        self.move.delete()
+        self.assertEqual(self.found('時刻表'), [])
+
+    def test_system_check_finds_missing_triggers(self):
+        #マイグレーションでテーブルが作り直されてトリガーが消えたら、migrateの時のチェックでエラーにする
+        self.assertEqual(check_plan_search_triggers(None, databases=['default']), [])
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER app_plan_search_ai') #テストの終わりにロールバックされる
+        errors = check_plan_search_triggers(None, databases=['default'])
+        self.assertEqual([error.id for error in errors], ['app.E001'])
+        self.assertIn('app_plan_search_ai', errors[0].msg)
+
+    def test_short_terms_use_like(self):
+        self.assertEqual(self.found('味噌'), [self.ramen.id])
+        self.assertEqual(self.found('"'), [])
+
+    def test_search_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('app:search'), {'q': '札幌'})
+        self.assertContains(response, '札幌旅行') #予定表タイトルの一致
+        self.assertContains(response, '?selected_day=2') #ラーメン屋は2日目
+        self.assertNotContains(response, '醤油')
+
+
+#移動手段の一覧（transportation.py）のテスト
+class TransportationRegistryTests(TestCase):
+    def setUp(self):
+        transportation.invalidate()
+        self.train = TransportationMethod.objects.create(transportation='train', transportation_icon_class='fas fa-train')
+
+    def test_loaded_once(self):
+        with self.assertNumQueries(1):
+            transportation.all_methods()
+            transportation.template_choices()
+            self.assertEqual(transportation.get_method(str(self.train.id)), self.train)
+
+    def test_invalidated_by_signals(self):
+        transportation.all_methods()
+        #一覧を捨てるのはコミットの後
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            bus = TransportationMethod.objects.create(transportation='bus', transportation_icon_class='fas fa-bus')
+            self.assertEqual([m['label'] for m in transportation.template_choices()], ['train'])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual([m['label'] for m in transportation.template_choices()], ['train', 'bus'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.train.transportation_icon_class = 'fas fa-subway'
+            self.train.save()
+        self.assertEqual(transportation.get_method(self.train.id).transportation_icon_class, 'fas fa-subway')
+        with self.captureOnCommitCallbacks(execute=True):
+            bus.delete()
+        self.assertEqual(transportation.form_choices(), [(self.train.id, '電車')])
+
+    def test_unknown_id_does_not_reload_every_time(self):
+        transportation.all_methods()
+        with self.assertNumQueries(0): #読み込んだばかりなので、一覧にないidでも読み直さない
+            self.assertIsNone(transportation.get_method(999))
+            self.assertIsNone(transportation.get_method(998))
+        #他のプロセスで追加された移動手段は、時間がたてば読み直して見つかる
+        other = TransportationMethod.objects.create(transportation='ship', transportation_icon_class='fas fa-ship')
+        with mock.patch('app.transportation.time.monotonic', return_value=time.monotonic() + transportation.MISS_RELOAD_INTERVAL + 1):
+            with self.assertNumQueries(1):
+                self.assertEqual(transportation.get_method(other.id), other)
+
+    def test_plan_form_uses_registry(self):
+        data = {
+            'action_category': 'move', 'departure_location': '東京', 'arrival_location': '大阪',
+            'start_date': '2025-08-01', 'start_time': '09:00', 'end_date': '2025-08-01', 'end_time': '10:00',
+        }
+        transportation.all_methods()
+        with self.assertNumQueries(0):
+            PlanForm().as_p() #選択肢の表示はメモリから
+        with self.assertNumQueries(1): #保存前のモデル側の存在チェック（他のプロセスで削除された移動手段を弾く）だけ
+            form = PlanForm({**data, 'transportation': self.train.id})
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['transportation'], self.train)
+        self.assertIn('transportation', PlanForm({**data, 'transportation': 999}).errors)
+        self.assertIn('transportation', PlanForm(data).errors) #移動の時は必須
+
+
+#予定フォームの日付の選択肢のテスト
+class PlanFormDateChoicesTests(SimpleTestCase):
+    def test_choices_are_memoized_per_trip(self):
+        start, end = datetime(2025, 8, 1).date(), datetime(2025, 8, 3).date()
+        self.assertEqual(trip_dates(start, end), (start, start + timedelta(days=1), end))
+        self.assertIs(trip_date_choices(start, end), trip_date_choices(start, end))
+        form = PlanForm(trip_dates=trip_dates(start, end))
+        self.assertEqual(list(form.fields['start_date'].widget.choices), [('2025-08-01', '2025-08-01'), ('2025-08-02', '2025-08-02'), ('2025-08-03', '2025-08-03')])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_plan_form', '--days', '3', '--iterations', '2', '--repeat', '1', stdout=out)
+        self.assertIn('POST', out.getvalue())
+
+
+#予定の保存（plan_writer.py）のテスト
+class PlanSaveTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='save@example.com', name='save', password='pass1234', username='save')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        self.client.force_login(self.user)
+
+    #新規の観光予定のPOSTデータ　リンクlinks件、写真pictures枚
+    def post_data(self, links, pictures):
+        data = {
+            'action_category': 'sightseeing', 'name': '城', 'memo': '',
+            'start_date': '2025-08-02', 'start_time': '09:00', 'end_date': '2025-08-02', 'end_time': '11:00',
+            'links-TOTAL_FORMS': links, 'links-INITIAL_FORMS': 0, 'links-MIN_NUM_FORMS': 0, 'links-MAX_NUM_FORMS': 5,
+            'pictures-TOTAL_FORMS': pictures, 'pictures-INITIAL_FORMS': 0, 'pictures-MIN_NUM_FORMS': 0, 'pictures-MAX_NUM_FORMS': 6,
+        }
+        for i in range(links):
+            data[f'links-{i}-title'] = f'L{i}'
+            data[f'links-{i}-url'] = f'https://example.com/{i}'
+        for i in range(pictures):
+            data[f'pictures-{i}-image'] = make_image(f'p{i}.png')
+        return data
+
+    def post(self, data):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), data)
+        self.assertEqual(response.status_code, 302)
+        return len(captured)
+
+    def test_round_trips_do_not_depend_on_link_and_picture_count(self):
+        few = self.post(self.post_data(1, 1))
+        many = self.post(self.post_data(5, 6))
+        self.assertEqual(few, many)
+        plan = Plan.objects.latest('id')
+        self.assertEqual((plan.links.count(), plan.pictures.count()), (5, 6))
+        self.schedule.refresh_from_db()
+        self.assertEqual((self.schedule.plan_count, self.schedule.link_count, self.schedule.picture_count), (2, 6, 7))
+
+    def test_edit_updates_and_deletes_in_bulk(self):
+        self.post(self.post_data(3, 2))
+        plan = Plan.objects.get()
+        links = list(plan.links.order_by('id'))
+        pictures = list(plan.pictures.order_by('id'))
+        data = self.post_data(0, 0)
+        data.update({
+            'links-TOTAL_FORMS': 3, 'links-INITIAL_FORMS': 3,
+            'links-0-id': links[0].id, 'links-0-title': '変更', 'links-0-url': links[0].url,
+            'links-1-id': links[1].id, 'links-1-title': '', 'links-1-url': '', #URLを空にしたら削除
+            'links-2-id': links[2].id, 'links-2-title': links[2].title, 'links-2-url': links[2].url, 'links-2-DELETE': 'on',
+            'pictures-TOTAL_FORMS': 2, 'pictures-INITIAL_FORMS': 2,
+            'pictures-0-id': pictures[0].id, 'pictures-0-DELETE': 'on',
+            'pictures-1-id': pictures[1].id, 'pictures-1-image': make_image('new.png', color='blue'),
+        })
+        response = self.client.post(reverse('app:plan_edit', args=[self.schedule.id, plan.id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(plan.links.values_list('title', flat=True)), ['変更'])
+        self.assertEqual(plan.pictures.count(), 1)
+        self.assertNotIn(plan.pictures.get().image.name, [p.image.name for p in pictures]) #差し替えた画像になっている
+
+    def test_failure_rolls_back_everything(self):
+        with mock.patch('app.plan_writer.refresh_schedule_summary', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), self.post_data(2, 1))
+        self.assertFalse(Plan.objects.exists())
+        self.assertFalse(Link.objects.exists())
+        self.assertFalse(Picture.objects.exists())
+        self.assertFalse(PlanDayOccurrence.objects.exists())
+
+
+#写真の縮小版（renditions.py、workers.py）のテスト
+@override_settings(BACKGROUND_WORKERS=0)
+class PictureRenditionTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        render_cache.get_cache().clear()
+        self.user = User.objects.create_user(email='pic@example.com', name='pic', password='pass1234', username='pic')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        self.client.force_login(self.user)
+
+    def post_plan(self):
+        data = {
+            'action_category': 'sightseeing', 'name': '城', 'memo': '',
+            'start_date': '2025-08-01', 'start_time': '09:00', 'end_date': '2025-08-01', 'end_time': '11:00',
+            'links-TOTAL_FORMS': 0, 'links-INITIAL_FORMS': 0, 'links-MIN_NUM_FORMS': 0, 'links-MAX_NUM_FORMS': 5,
+            'pictures-TOTAL_FORMS': 1, 'pictures-INITIAL_FORMS': 0, 'pictures-MIN_NUM_FORMS': 0, 'pictures-MAX_NUM_FORMS': 6,
+            'pictures-0-image': make_image('big.png', size=(2000, 1000)),
+        }
+        return self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), data)
+
+    def day_html(self):
+        return self.client.get(reverse('app:schedule_day', args=[self.schedule.id, '2025-08-01'])).content.decode()
+
+    def test_renditions_are_made_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.post_plan()
+        picture = Picture.objects.get()
+        self.assertFalse(picture.renditions_ready)
+        self.assertIn('picture-placeholder', self.day_html()) #作るまでは仮の表示
+        updated_at = Schedule.objects.get(pk=self.schedule.pk).updated_at
+        etag = self.client.get(reverse('app:schedule_detail', args=[self.schedule.id]))['ETag']
+
+        for callback in callbacks:
+            callback()
+        picture.refresh_from_db()
+        self.assertTrue(picture.renditions_ready)
+        with default_storage.open(rendition_name(picture.image.name, 'thumb')) as f:
+            self.assertEqual(max(Image.open(f).size), 320)
+        with default_storage.open(rendition_name(picture.image.name, 'medium_webp')) as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+        html = self.day_html() #予定表のrendition_versionが進むのでキャッシュされた仮の表示は使われない
+        self.assertIn(picture.thumbnail_url, html)
+        self.assertNotIn('picture-placeholder', html)
+        self.assertEqual(self.client.get(reverse('app:schedule_detail', args=[self.schedule.id]), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).updated_at, updated_at) #ユーザーに見える更新日時は変えない
+
+    def test_backfill_command_and_broken_image(self):
+        plan = Plan.objects.create(schedule=self.schedule, action_category='meal', name='店', start_datetime=timezone.now(), end_datetime=timezone.now())
+        good = Picture.objects.create(plan=plan, image=make_image('a.png'))
+        broken = Picture.objects.create(plan=plan, image=SimpleUploadedFile('b.png', b'not an image'))
+        out = StringIO()
+        with self.assertLogs('app.renditions', 'WARNING'): #壊れた画像は警告を出して飛ばす
+            self.assertFalse(generate_renditions(broken.id))
+            call_command('backfill_picture_renditions', stdout=out)
+        self.assertIn('1件', out.getvalue())
+        self.assertEqual(list(Picture.objects.filter(renditions_ready=True).values_list('id', flat=True)), [good.id])
+
+    @override_settings(BACKGROUND_WORKERS=1)
+    def test_worker_pool_runs_outside_request(self):
+        import threading
+        self.assertNotEqual(workers.submit(threading.current_thread).result(timeout=5), threading.current_thread())
+
+
+#写真ファイルの重複をまとめる保存（storage.py）のテスト
+@override_settings(BACKGROUND_WORKERS=0)
+class PictureStorageTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(email='store@example.com', name='store', password='pass1234', username='store')
+        schedule = Schedule.objects.create(user=user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        make_plan = lambda: Plan.objects.create(schedule=schedule, action_category='meal', name='店', start_datetime=timezone.now(), end_datetime=timezone.now())
+        self.plan1, self.plan2 = make_plan(), make_plan()
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, f), self.media_root) for root, _, files in os.walk(self.media_root) for f in files)
+
+    @override_settings(PICTURE_RELEASE_GRACE_SECONDS=0)
+    def test_same_bytes_are_stored_once_and_deleted_with_last_reference(self):
+        first = Picture.objects.create(plan=self.plan1, image=make_image('a.png'))
+        second = Picture.objects.create(plan=self.plan2, image=make_image('b.png'))
+        other = Picture.objects.create(plan=self.plan2, image=make_image('c.png', color='blue'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^plan_pictures/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(len(self.stored_files()), 2)
+        generate_renditions(first.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(picture_storage.exists(second.image.name)) #まだ別の予定が使っている
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan2.delete() #予定の削除で写真がまとめて消える時も片付ける
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(Picture.objects.filter(pk=other.pk).exists())
+
+    def test_recently_reused_file_is_not_released(self):
+        first = Picture.objects.create(plan=self.plan1, image=make_image('a.png'))
+        name = first.image.name
+        path = picture_storage.path(name)
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+        #別のリクエストが同じ画像を保存した（まだコミットしていないかもしれない）ので、ファイルの更新日時が今になる
+        picture_storage.save('plan_pictures/b.png', make_image('b.png'))
+        self.assertGreater(os.path.getmtime(path), old)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(picture_storage.exists(name)) #すぐには消さない
+
+        os.utime(path, (old, old))
+        self.assertEqual(release_files([name]), [name]) #しばらくたっても参照がなければ消す
+        self.assertFalse(picture_storage.exists(name))
+
+    def test_delete_rolled_back_keeps_file(self):
+        picture = Picture.objects.create(plan=self.plan1, image=make_image())
+        with self.captureOnCommitCallbacks(execute=True):
+            pass
+        from django.db import transaction
+        try:
+            with transaction.atomic():
+                Picture.objects.filter(pk=picture.pk).delete()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            Link.objects.create(plan=self.plan1, url='https://example.com/') #次のコミットで残っていた名前も調べられる
+            transaction.on_commit(lambda: None)
+        self.assertTrue(picture_storage.exists(picture.image.name))
+
+    def test_dedupe_command_moves_legacy_files(self):
+        legacy = FileSystemStorage()
+        image = make_image()
+        names = [legacy.save('plan_pictures/old1.png', image), legacy.save('plan_pictures/old2.png', make_image())]
+        for plan, name in zip((self.plan1, self.plan2), names):
+            Picture.objects.create(plan=plan, image=name)
+        out = StringIO()
+        call_command('dedupe_picture_files', '--dry-run', stdout=out)
+        self.assertIn('2個のファイルを移せます（うち1個', out.getvalue())
+        call_command('dedupe_picture_files', stdout=StringIO())
+        self.assertEqual(Picture.objects.values('image').distinct().count(), 1)
+        self.assertEqual(self.stored_files(), [Picture.objects.first().image.name])
+
+
+#写真の分割アップロード（uploads.py）のテスト
+@override_settings(BACKGROUND_WORKERS=0)
+class ChunkedUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='up@example.com', name='up', password='pass1234', username='up')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        self.client.force_login(self.user)
+        buffer = BytesIO()
+        Image.effect_noise((64, 64), 64).convert('RGB').save(buffer, format='PNG') #分けて送れるように、圧縮しても小さくならない画像
+        self.image = buffer.getvalue()
+
+    def start(self, size=None, filename='旅行.png'):
+        return self.client.post(reverse('app:upload_start', args=[self.schedule.id]), {'filename': filename, 'size': size or len(self.image)})
+
+    def send(self, url, offset, data):
+        return self.client.post(url, data, content_type='application/octet-stream', headers={'Upload-Offset': str(offset)})
+
+    def plan_data(self, tokens, **extra):
+        data = {
+            'action_category': 'sightseeing', 'name': '城', 'memo': '',
+            'start_date': '2025-08-02', 'start_time': '09:00', 'end_date': '2025-08-02', 'end_time': '11:00',
+            'links-TOTAL_FORMS': 0, 'links-INITIAL_FORMS': 0, 'links-MIN_NUM_FORMS': 0, 'links-MAX_NUM_FORMS': 5,
+            'pictures-TOTAL_FORMS': 0, 'pictures-INITIAL_FORMS': 0, 'pictures-MIN_NUM_FORMS': 0, 'pictures-MAX_NUM_FORMS': 6,
+            'upload_tokens': tokens,
+        }
+        data.update(extra)
+        return data
+
+    def test_interrupted_upload_resumes_and_is_attached_to_plan(self):
+        status = self.start().json()
+        self.assertEqual((status['offset'], status['complete']), (0, False))
+        url = status['url']
+
+        self.assertEqual(self.send(url, 0, self.image[:100]).json()['offset'], 100)
+        #回線が切れて、送るはずだった200バイトのうち50バイトしか届かなかった
+        session = UploadSession.objects.get()
+        append_chunk(session, 100, BytesIO(self.image[100:150]), 200)
+        self.assertEqual(self.client.get(url).json()['offset'], 150)
+
+        response = self.send(url, 100, self.image[100:300]) #古い位置から送り直すと、続きの位置を返す
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 150))
+        status = self.send(url, 150, self.image[150:]).json()
+        self.assertTrue(status['complete'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), self.plan_data([status['token']]))
+        self.assertEqual(response.status_code, 302)
+        picture = Picture.objects.get()
+        self.assertTrue(picture.image.name.endswith('.png'))
+        with picture.image.open('rb') as f:
+            self.assertEqual(f.read(), self.image)
+        self.assertTrue(picture.renditions_ready)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(part_path(status['token'])))
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.picture_count, 1)
+
+    def test_same_offset_sent_twice_does_not_overwrite(self):
+        status = self.start().json()
+        session = UploadSession.objects.get(token=status['token'])
+        stale = UploadSession.objects.get(token=status['token']) #同時に来たもう1つのリクエスト（まだoffset=0だと思っている）
+        append_chunk(session, 0, BytesIO(self.image[:10]), 10)
+        with self.assertRaises(UploadError) as cm:
+            append_chunk(stale, 0, BytesIO(b'x' * 5), 5)
+        self.assertEqual((cm.exception.status, cm.exception.offset), (409, 10))
+        with open(part_path(status['token']), 'rb') as f:
+            self.assertEqual(f.read(), self.image[:10]) #先に書いた方のデータはそのまま
+
+    @override_settings(PICTURE_UPLOAD_MAX_FILE_SIZE=1000, PICTURE_UPLOAD_MAX_PLAN_SIZE=1500)
+    def test_size_limits(self):
+        self.assertEqual(self.start(size=1001).status_code, 413)
+        self.assertEqual(self.start(size=800).status_code, 201)
+        self.assertEqual(self.start(size=800).status_code, 413) #同じ予定に送っている途中の写真と合わせて上限を超える
+        self.assertEqual(self.start(size=10, filename='memo.txt').status_code, 400)
+        self.assertEqual(self.start(size=10, filename='IMG_0001.HEIC').status_code, 400) #Pillowで確かめられない形式は送り始める前に断る
+
+        url = UploadSession.objects.get().token
+        response = self.send(reverse('app:upload', args=[url]), 0, b'x' * 801)
+        self.assertEqual(response.status_code, 413)
+
+    def test_non_image_is_rejected_and_other_users_cannot_touch_upload(self):
+        status = self.start(size=4).json()
+        response = self.send(status['url'], 0, b'abcd')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(part_path(status['token'])))
+
+        status = self.start().json()
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status['url']).status_code, 404)
+        self.assertEqual(self.start().status_code, 404)
+
+    def test_invalid_plan_form_keeps_finished_uploads(self):
+        status = self.start().json()
+        self.send(status['url'], 0, self.image)
+        pending = self.start().json() #送り終わっていない写真は使えない
+        response = self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), self.plan_data([status['token'], pending['token']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'アップロードが終わっていない写真があります')
+        self.assertContains(response, f'value="{status["token"]}"')
+
+        response = self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), self.plan_data([status['token']], start_date=''))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'value="{status["token"]}"') #他の入力エラーで出し直しても残る
+        self.assertFalse(Picture.objects.exists())
+
+    def test_purge_expired_sessions(self):
+        old = self.start().json()
+        new = self.start().json()
+        UploadSession.objects.filter(token=old['token']).update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(purge_expired(), 1)
+        self.assertEqual(list(UploadSession.objects.values_list('token', flat=True)), [new['token']])
+        self.assertFalse(os.path.exists(part_path(old['token'])))
+
+
+#参照されていない写真ファイルの片付け（media_gc.py、collect_orphan_pictures）のテスト
+@override_settings(BACKGROUND_WORKERS=0)
+class OrphanPictureGcTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        checkpoint = override_settings(PICTURE_GC_CHECKPOINT=os.path.join(self.upload_dir, 'gc.json'))
+        checkpoint.enable()
+        self.addCleanup(checkpoint.disable)
+        user = User.objects.create_user(email='gc@example.com', name='gc', password='pass1234', username='gc')
+        schedule = Schedule.objects.create(user=user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        plan = Plan.objects.create(schedule=schedule, action_category='meal', name='店', start_datetime=timezone.now(), end_datetime=timezone.now())
+        self.kept = Picture.objects.create(plan=plan, image=make_image('kept.png'))
+        generate_renditions(self.kept.id)
+        orphan = Picture.objects.create(plan=plan, image=make_image('orphan.png', color='blue'))
+        generate_renditions(orphan.id)
+        Picture.objects.filter(pk=orphan.pk).delete() #シグナルを通さずに消して、ファイルだけ残った状態にする
+        self.orphan_name = orphan.image.name
+        FileSystemStorage().save('plan_pictures/stray.txt', StringIO('x'))
+        self.make_old()
+
+    #全部のファイルを2日前に更新されたことにする
+    def make_old(self):
+        old = time.time() - 2 * 86400
+        for root, _, files in os.walk(self.media_root):
+            for f in files:
+                os.utime(os.path.join(root, f), (old, old))
+
+    def files(self):
+        return sorted(os.path.relpath(os.path.join(root, f), self.media_root).replace(os.sep, '/') for root, _, files in os.walk(self.media_root) for f in files)
+
+    def run_gc(self, *args):
+        out = StringIO()
+        call_command('collect_orphan_pictures', *args, stdout=out)
+        return out.getvalue()
+
+    def kept_files(self):
+        return sorted([self.kept.image.name] + [rendition_name(self.kept.image.name, kind) for kind in ('thumb', 'thumb_webp', 'medium', 'medium_webp')])
+
+    def test_dry_run_then_delete(self):
+        before = self.files()
+        self.assertIn('11個のファイルを調べ、参照されていない6個', self.run_gc('--dry-run'))
+        self.assertEqual(self.files(), before)
+        self.run_gc()
+        self.assertEqual(self.files(), self.kept_files())
+
+    def test_quarantine_moves_orphans(self):
+        quarantine = os.path.join(self.upload_dir, 'quarantine')
+        self.run_gc('--quarantine', quarantine)
+        self.assertEqual(self.files(), self.kept_files())
+        self.assertTrue(os.path.exists(os.path.join(quarantine, self.orphan_name)))
+
+    def test_resumes_from_checkpoint(self):
+        output = self.run_gc('--batch-size', '1', '--limit', '4')
+        self.assertIn('続きがあります', output)
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, 'gc.json')))
+        self.assertIn('前回の続き', self.run_gc('--batch-size', '1'))
+        self.assertEqual(self.files(), self.kept_files())
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, 'gc.json'))) #最後まで調べたら最初からに戻る
+
+    def test_recent_files_are_left_alone(self):
+        FileSystemStorage().save('plan_pictures/uploading.png', make_image())
+        self.run_gc()
+        self.assertIn('plan_pictures/uploading.png', self.files())
+
+    def test_walk_files_in_name_order_after_checkpoint(self):
+        names = [media_file.name for media_file in walk_files(self.media_root, 'plan_pictures')]
+        self.assertEqual(names, sorted(names, key=lambda name: name.split('/')))
+        self.assertEqual([media_file.name for media_file in walk_files(self.media_root, 'plan_pictures', names[3])], names[4:])
+
+
+#予定のまとめて追加・更新・削除（plan_batch.py）のテスト
+class PlanBatchApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='batch@example.com', name='batch', password='pass1234', username='batch')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        self.client.force_login(self.user)
+        start = timezone.make_aware(datetime(2025, 8, 1, 9, 0))
+        self.plans = [
+            Plan.objects.create(schedule=self.schedule, action_category='sightseeing', name=f'観光{i}', start_datetime=start, end_datetime=start + timedelta(hours=1))
+            for i in range(2)
+        ]
+        for plan in self.plans:
+            sync_plan_occurrences(plan)
+        self.schedule.refresh_from_db()
+
+    def send(self, operations, version=None):
+        payload = {'operations': operations}
+        if version is not None:
+            payload['version'] = version
+        return self.client.post(reverse('app:plan_batch', args=[self.schedule.id]), json.dumps(payload), content_type='application/json')
+
+    def meal(self, name, day='2025-08-02'):
+        return {'op': 'create', 'data': {'action_category': 'meal', 'name': name, 'start_date': day, 'start_time': '12:00', 'end_time': '13:00'}}
+
+    def test_create_update_delete_in_one_request(self):
+        response = self.send([
+            self.meal('昼食'),
+            {'op': 'update', 'id': self.plans[0].id, 'data': {'memo': '予約済み', 'start_date': '2025-08-03', 'end_date': '2025-08-03'}},
+            {'op': 'delete', 'id': self.plans[1].id},
+        ], version=schedule_version(self.schedule))
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(all(result['ok'] for result in body['results']))
+        self.assertEqual(body['results'][0]['conflicts'], [])
+        created = Plan.objects.get(id=body['results'][0]['id'])
+        self.assertEqual((created.name, timezone.localtime(created.end_datetime).date().isoformat()), ('昼食', '2025-08-02')) #食事は終了日=開始日
+        self.plans[0].refresh_from_db()
+        self.assertEqual((self.plans[0].memo, self.plans[0].name), ('予約済み', '観光0')) #送っていない項目はそのまま
+        self.assertFalse(Plan.objects.filter(id=self.plans[1].id).exists())
+        self.assertEqual(
+            sorted(PlanDayOccurrence.objects.filter(schedule=self.schedule).values_list('plan_id', 'date')),
+            sorted([(self.plans[0].id, datetime(2025, 8, 3).date()), (created.id, datetime(2025, 8, 2).date())]),
+        )
+        self.schedule.refresh_from_db()
+        self.assertEqual(body['version'], schedule_version(self.schedule))
+        self.assertEqual(self.schedule.plan_count, 2)
+
+    def test_one_invalid_item_rejects_whole_batch(self):
+        response = self.send([self.meal('昼食'), self.meal(''), {'op': 'delete', 'id': 999999}])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['ok'] for result in results], [True, False, False])
+        self.assertIn('name', results[1]['errors'])
+        self.assertEqual(Plan.objects.count(), 2)
+
+    def test_stale_version_is_rejected(self):
+        response = self.send([self.meal('昼食')], version='1.000000')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], schedule_version(self.schedule))
+        self.assertEqual(Plan.objects.count(), 2)
+
+    def test_write_lock_is_taken_before_version_is_read(self):
+        #SQLiteではSELECT ... FOR UPDATEがないので、バージョンを読む前に予定表の行へ書き込んでロックを取る
+        before = Schedule.objects.get(pk=self.schedule.pk).updated_at
+        with CaptureQueriesContext(connection) as captured:
+            response = self.send([self.meal('昼食')], version='1.000000')
+        self.assertEqual(response.status_code, 409)
+        statements = [query['sql'] for query in captured if 'app_schedule' in query['sql']]
+        self.assertTrue(statements[1].startswith('UPDATE'), statements) #1つ目はビューでの予定表の取得
+        self.assertTrue(statements[2].startswith('SELECT'), statements)
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).updated_at, before) #ロックを取るだけで更新日時は変わらない
+
+    def test_other_users_plans_and_schedules_are_not_touched(self):
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.send([{'op': 'delete', 'id': self.plans[0].id}]).status_code, 404)
+        other_schedule = Schedule.objects.create(user=other, title='別', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        response = self.client.post(reverse('app:plan_batch', args=[other_schedule.id]), json.dumps({'operations': [{'op': 'delete', 'id': self.plans[0].id}]}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Plan.objects.filter(id=self.plans[0].id).exists())
+
+    def test_round_trips_do_not_depend_on_batch_size(self):
+        def queries(count):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.send([self.meal(f'食事{i}') for i in range(count)])
+            self.assertEqual(response.status_code, 200)
+            return len(captured)
+        self.assertEqual(queries(2), queries(20))
+
+
+#予定の時間の重なり（conflicts.py）のテスト
+class PlanConflictTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='conflict@example.com', name='conflict', password='pass1234', username='conflict')
+        self.schedule = Schedule.objects.create(user=self.user, title='旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        self.client.force_login(self.user)
+
+    def add(self, name, start, end, category='sightseeing'):
+        plan = Plan.objects.create(
+            schedule=self.schedule, action_category=category, name=name,
+            start_datetime=timezone.make_aware(start), end_datetime=timezone.make_aware(end),
+        )
+        sync_plan_occurrences(plan)
+        return plan
+
+    def test_plan_conflicts(self):
+        castle = self.add('城', datetime(2025, 8, 1, 9), datetime(2025, 8, 1, 11))
+        lunch = self.add('昼食', datetime(2025, 8, 1, 10), datetime(2025, 8, 1, 12), 'meal')
+        museum = self.add('美術館', datetime(2025, 8, 1, 11), datetime(2025, 8, 1, 12)) #城とは終わりと始まりが同じだけ
+        hotel = self.add('ホテル', datetime(2025, 8, 1, 15), datetime(2025, 8, 3, 10), 'stay')
+        inn = self.add('旅館', datetime(2025, 8, 2, 15), datetime(2025, 8, 3, 10), 'stay')
+        night_bus = self.add('夜行バス', datetime(2025, 8, 1, 23), datetime(2025, 8, 2, 6))
+        onsen = self.add('温泉', datetime(2025, 8, 2, 5), datetime(2025, 8, 2, 7)) #日付をまたいだ予定とも重なる
+
+        self.assertEqual(plan_conflicts(castle), [lunch])
+        self.assertEqual(plan_conflicts(lunch), [castle, museum])
+        self.assertEqual(plan_conflicts(hotel), [inn]) #宿泊は宿泊同士だけ
+        self.assertEqual(plan_conflicts(onsen), [night_bus])
+        pairs = {(a.id, b.id) for a, b in schedule_conflicts(self.schedule)}
+        self.assertEqual(pairs, {(castle.id, lunch.id), (lunch.id, museum.id), (hotel.id, inn.id), (night_bus.id, onsen.id)})
+
+    def test_schedule_conflicts_match_brute_force(self):
+        rng = random.Random(7)
+        plans = []
+        for i in range(80):
+            start = datetime(2025, 8, 1, 6) + timedelta(minutes=rng.randrange(0, 3 * 24 * 60, 15))
+            category = 'stay' if i % 10 == 0 else 'sightseeing'
+            plans.append(self.add(f'予定{i}', start, start + timedelta(minutes=rng.randrange(15, 600, 15)), category))
+        expected = set()
+        for a in plans:
+            for b in plans:
+                if a.id < b.id and (a.action_category == 'stay') == (b.action_category == 'stay') \
+                        and a.start_datetime < b.end_datetime and b.start_datetime < a.end_datetime:
+                    expected.add(frozenset((a.id, b.id)))
+        self.assertEqual({frozenset((a.id, b.id)) for a, b in schedule_conflicts(self.schedule)}, expected)
+        for plan in plans[:10]:
+            self.assertEqual({other.id for other in plan_conflicts(plan)}, {other for pair in expected if plan.id in pair for other in pair} - {plan.id})
+
+    def test_conflicts_endpoint_and_save_warning(self):
+        self.add('城', datetime(2025, 8, 1, 9), datetime(2025, 8, 1, 11))
+        data = {
+            'action_category': 'meal', 'name': '昼食', 'memo': '',
+            'start_date': '2025-08-01', 'start_time': '10:00', 'end_date': '2025-08-01', 'end_time': '12:00',
+            'links-TOTAL_FORMS': 0, 'links-INITIAL_FORMS': 0, 'links-MIN_NUM_FORMS': 0, 'links-MAX_NUM_FORMS': 5,
+            'pictures-TOTAL_FORMS': 0, 'pictures-INITIAL_FORMS': 0, 'pictures-MIN_NUM_FORMS': 0, 'pictures-MAX_NUM_FORMS': 6,
+        }
+        response = self.client.post(reverse('app:plan_create_or_edit', args=[self.schedule.id]), data, follow=True)
+        self.assertContains(response, '「城」と時間が重なっています')
+
+        conflicts = self.client.get(reverse('app:schedule_conflicts', args=[self.schedule.id])).json()['conflicts']
+        self.assertEqual([[plan['name'] for plan in conflict['plans']] for conflict in conflicts], [['城', '昼食']])
+        self.assertEqual((conflicts[0]['start'], conflicts[0]['end']), ('2025-08-01T10:00:00+09:00', '2025-08-01T11:00:00+09:00'))
+
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('app:schedule_conflicts', args=[self.schedule.id])).status_code, 404)
+
+
+#クエリ数の上限チェック（N+1の再発防止）
+#データ量を変えて同じURLを開き、SQLの回数と合計時間が上限を超えないか確かめる　超えた時は実行されたSQLを全部表示する
+class QueryBudgetMixin:
+    DATA_SIZES = (1, 20, 100) #予定表1件あたりの予定の数
+    MAX_QUERY_TIME = 0.5 #1リクエストのSQL合計時間の上限（秒）
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, label=''):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        total_time = sum(float(q['time']) for q in captured.captured_queries)
+        if len(captured) > max_queries or total_time > self.MAX_QUERY_TIME:
+            lines = '\n'.join(f"  {i}. ({q['time']}s) {q['sql']}" for i, q in enumerate(captured.captured_queries, start=1))
+            self.fail(
+                f'{label}: {len(captured)}回のクエリ（上限{max_queries}回）、合計{total_time:.3f}秒（上限{self.MAX_QUERY_TIME}秒）\n{lines}'
+            )
+
+    #テスト用の予定表を作る　予定ごとにリンク・写真を付け、宿泊や複数日の予定も混ぜる
+    def seed_schedule(self, user, plan_count, links_per_plan=2, pictures_per_plan=2):
+        schedule = Schedule.objects.create(user=user, title=f'旅行{plan_count}', trip_start_date='2025-08-01', trip_end_date='2025-08-05')
+        transport = TransportationMethod.objects.get_or_create(transportation='train', defaults={'transportation_icon_class': 'fas fa-train'})[0]
+        categories = ['move', 'sightseeing', 'meal', 'stay']
+        plans = []
+        for i in range(plan_count):
+            start = timezone.make_aware(datetime(2025, 8, 1 + i % 4, 8) + timedelta(minutes=37 * i % 600))
+            category = categories[i % 4]
+            end = start + (timedelta(days=1) if category == 'stay' else timedelta(hours=2))
+            plans.append(Plan(
+                schedule=schedule, action_category=category, name=f'予定{i}', memo='メモ',
+                transportation=transport if category == 'move' else None,
+                departure_location='東京', arrival_location='大阪',
+                start_datetime=start, end_datetime=end,
+            ))
+        plans = Plan.objects.bulk_create(plans)
+        Link.objects.bulk_create([Link(plan=p, title=f'L{j}', url=f'https://example.com/{p.id}/{j}') for p in plans for j in range(links_per_plan)])
+        Picture.objects.bulk_create([Picture(plan=p, image=f'plan_pictures/{p.id}_{j}.jpg') for p in plans for j in range(pictures_per_plan)])
+        rebuild_schedule_occurrences(schedule.id)
+        refresh_schedule_summary(schedule, touch=False) #一括作成ではsave()を通らないので集計列を数え直す
+        return schedule
+
+
+#app/urls.pyの全URLのクエリ数上限
+class ViewQueryBudgetTests(TempMediaMixin, QueryBudgetMixin, TestCase):
+    #URL名ごとの上限回数　データ量に関係なくこの回数以内に収まること（新しいURLを追加したらここにも追加する）
+    BUDGETS = {
+        'index': 0,
+        'register': 0,
+        'login': 0,
+        'logout': 4,
+        'home': 4,
+        'home_schedules': 4,
+        'search': 5,
+        'schedule_detail': 8,
+        'schedule_day': 7,
+        'plan_create_or_edit': 3,
+        'plan_edit': 6,
+        'plan_edit_post': 18,
+        'mypage': 3,
+        'change_username': 2,
+        'change_email': 2,
+        'change_password': 2,
+        'edit_schedule_title': 18, #期間外の予定の削除はDjangoのdelete()で、予定の関連（日別展開・リンク・写真）も確認するので数回増える
+        'delete_schedule': 13,
+        'duplicate_schedule': 17,
+        'shift_schedule': 13,
+        'trim_preview': 5,
+        'schedule_calendar': 4,
+        'itinerary': 3, #作成済みのファイルを返す時（作るのはスレッドプールなのでリクエストのクエリには入らない）
+        'calendar_feed': 3,
+        'calendar_token': 3,
+        'plan_import': 10, #bulk_createのINSERTはSQLiteの変数の数の上限ごとに分かれるので、予定100件で3回増える
+        'plan_delete_view': 12,
+        'plan_batch': 15, #バージョンを読む前の書き込みロック（値の変わらないUPDATE）で1回増える
+        'schedule_conflicts': 4,
+        'upload_start': 5,
+        'upload': 3,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='budget@example.com', name='budget', password='pass1234', username='budget')
+        render_cache.get_cache().clear()
+        transportation.invalidate() #他のテストで読み込んだ移動手段の一覧を捨てる
+
+    def test_every_url_has_a_budget(self):
+        from . import urls
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - set(self.BUDGETS), set())
+
+    #URL名ごとのリクエスト（method, url, data）
+    def requests_for(self, schedule):
+        plan = schedule.plans.order_by('id').first()
+        day = '2025-08-01'
+        User.objects.filter(pk=schedule.user_id).update(calendar_token=f'feed{schedule.id}')
+        itinerary.render_itinerary(schedule.id) #行程表は作成済みの状態で計測する
+        upload = UploadSession.objects.create(user=schedule.user, schedule=schedule, token=f'budget{schedule.id}', filename='photo.jpg', size=1000)
+        return {
+            'index': ('get', reverse('app:index'), None),
+            'register': ('get', reverse('app:register'), None),
+            'login': ('get', reverse('app:login'), None),
+            'home': ('get', reverse('app:home'), None),
+            'home_schedules': ('get', reverse('app:home_schedules') + '?sort=updated&cursor=2099-01-01T00:00:00%2B00:00_999999', None),
+            'search': ('get', reverse('app:search') + '?q=予定1', None),
+            'schedule_detail': ('get', reverse('app:schedule_detail', args=[schedule.id]), None),
+            'schedule_day': ('get', reverse('app:schedule_day', args=[schedule.id, day]), None),
+            'plan_create_or_edit': ('get', reverse('app:plan_create_or_edit', args=[schedule.id]), None),
+            'plan_edit': ('get', reverse('app:plan_edit', args=[schedule.id, plan.id]), None),
+            'plan_edit_post': ('post', reverse('app:plan_edit', args=[schedule.id, plan.id]), self.plan_post_data(plan)),
+            'mypage': ('get', reverse('app:mypage'), None),
+            'change_username': ('get', reverse('app:change_username'), None),
+            'change_email': ('get', reverse('app:change_email'), None),
+            'change_password': ('get', reverse('app:change_password'), None),
+            'edit_schedule_title': ('post', reverse('app:edit_schedule_title'), {
+                'schedule_id': schedule.id, 'title': '変更', 'start_date': '2025-08-02', 'end_date': '2025-08-04',
+            }),
+            'plan_delete_view': ('post', reverse('app:plan_delete_view', args=[plan.id]), {}),
+            'plan_batch': ('post_json', reverse('app:plan_batch', args=[schedule.id]), {'operations': [
+                {'op': 'update', 'id': plan.id, 'data': {'memo': 'まとめて変更'}},
+                {'op': 'create', 'data': {'action_category': 'meal', 'name': '昼食', 'start_date': day, 'start_time': '12:00', 'end_time': '13:00'}},
+            ]}),
+            'schedule_conflicts': ('get', reverse('app:schedule_conflicts', args=[schedule.id]), None),
+            'upload_start': ('post', reverse('app:upload_start', args=[schedule.id]), {'filename': 'photo.jpg', 'size': 1000}),
+            'upload': ('get', reverse('app:upload', args=[upload.token]), None),
+            'duplicate_schedule': ('post', reverse('app:duplicate_schedule', args=[schedule.id]), {'start_date': '2025-09-01'}),
+            'shift_schedule': ('post', reverse('app:shift_schedule', args=[schedule.id]), {'days': 7}),
+            'trim_preview': ('get', reverse('app:trim_preview', args=[schedule.id]) + '?start_date=2025-08-02&end_date=2025-08-03', None),
+            'schedule_calendar': ('get', reverse('app:schedule_calendar', args=[schedule.id]), None),
+            'itinerary': ('get', reverse('app:itinerary', args=[schedule.id]), None),
+            'calendar_feed': ('get', reverse('app:calendar_feed', args=[f'feed{schedule.id}']), None),
+            'calendar_token': ('post', reverse('app:calendar_token'), {}),
+            'plan_import': ('post', reverse('app:plan_import', args=[schedule.id]), {'file': SimpleUploadedFile('plans.csv', 
+                'action_category,name,start_date,start_time,end_date,end_time\nmeal,昼食,2025-08-01,12:00,,13:00\nsightseeing,城,2025-08-02,10:00,2025-08-02,12:00\n'.encode())}),
+            'delete_schedule': ('post', reverse('app:delete_schedule', args=[schedule.id]), {'schedule_id': schedule.id}),
+            'logout': ('get', reverse('app:logout'), None),
+        }
+
+    #予定編集フォームのPOSTデータ（既存のリンク・写真フォームもそのまま送る）
+    def plan_post_data(self, plan):
+        local_start = timezone.localtime(plan.start_datetime)
+        local_end = timezone.localtime(plan.end_datetime)
+        data = {
+            'action_category': plan.action_category, 'name': plan.name, 'memo': 'メモ',
+            'departure_location': '東京', 'arrival_location': '大阪',
+            'transportation': plan.transportation_id or '',
+            'start_date': local_start.date().isoformat(), 'start_time': local_start.strftime('%H:%M'),
+            'end_date': local_end.date().isoformat(), 'end_time': local_end.strftime('%H:%M'),
+        }
+        for prefix, objects, field in [('links', list(plan.links.all()), 'url'), ('pictures', list(plan.pictures.all()), None)]:
+            data[f'{prefix}-TOTAL_FORMS'] = len(objects) + 1
+            data[f'{prefix}-INITIAL_FORMS'] = len(objects)
+            data[f'{prefix}-MIN_NUM_FORMS'] = 0
+            data[f'{prefix}-MAX_NUM_FORMS'] = 6
+            for i, obj in enumerate(objects):
+                data[f'{prefix}-{i}-id'] = obj.id
+                data[f'{prefix}-{i}-plan'] = plan.id
+                if field:
+                    data[f'{prefix}-{i}-{field}'] = obj.url
+                    data[f'{prefix}-{i}-title'] = obj.title
+        return data
+
+    def test_query_budgets_at_several_data_sizes(self):
+        for size in self.DATA_SIZES:
+            #他の予定表もあるユーザーで計測する
+            self.seed_schedule(self.user, size)
+            for name in self.BUDGETS:
+                schedule = self.seed_schedule(self.user, size)
+                transportation.all_methods() #移動手段の一覧は起動後1回だけ読み込むので、読み込み済みの状態で計測する
+                method, url, data = self.requests_for(schedule)[name]
+                self.client.force_login(self.user)
+                with self.subTest(url=name, plans=size):
+                    with self.assertQueryBudget(self.BUDGETS[name], label=f'{name}（予定{size}件）'):
+                        if method == 'post_json':
+                            response = self.client.post(url, json.dumps(data), content_type='application/json')
+                        else:
+                            response = getattr(self.client, method)(url, data) if data is not None else getattr(self.client, method)(url)
+                        if response.streaming: #ストリーミングのレスポンスは中身を読み切るまでにかかったクエリも数える
+                            b''.join(response.streaming_content)
+                    self.assertLess(response.status_code, 400)
+
+
+#予定表の複製（duplication.py）
+class DuplicateScheduleTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='copy@example.com', name='copy', password='pass1234', username='copy')
+        self.schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 20).id) #日付をdate型で読み直す
+
+    def test_copies_plans_links_and_pictures_sharing_files(self):
+        Picture.objects.filter(plan__schedule=self.schedule).update(renditions_ready=True)
+        copy = duplicate_schedule(self.schedule)
+
+        self.assertEqual((copy.title, copy.trip_start_date, copy.trip_end_date), ('旅行20のコピー', date(2025, 8, 1), date(2025, 8, 5)))
+        fields = ('action_category', 'name', 'memo', 'transportation_id', 'start_datetime', 'end_datetime', 'departure_location', 'arrival_location')
+        self.assertEqual(
+            list(copy.plans.order_by('id').values_list(*fields)),
+            list(self.schedule.plans.order_by('id').values_list(*fields)),
+        )
+        for model, columns in ((Link, ('plan__name', 'title', 'url')), (Picture, ('plan__name', 'image', 'renditions_ready'))):
+            self.assertEqual(
+                sorted(model.objects.filter(plan__schedule=copy).values_list(*columns)),
+                sorted(model.objects.filter(plan__schedule=self.schedule).values_list(*columns)),
+            )
+        #元の予定表とは別の行
+        self.assertFalse(Plan.objects.filter(schedule=copy, id__in=self.schedule.plans.values('id')).exists())
+        self.assertEqual(
+            PlanDayOccurrence.objects.filter(schedule=copy).count(),
+            PlanDayOccurrence.objects.filter(schedule=self.schedule).count(),
+        )
+        copy.refresh_from_db()
+        self.assertEqual((copy.plan_count, copy.link_count, copy.picture_count), (20, 40, 40))
+        self.assertFalse(drifted_schedules().exists())
+
+    def test_new_start_date_shifts_every_plan(self):
+        copy = duplicate_schedule(self.schedule, new_start_date=date(2026, 3, 28), title='次の旅行')
+        self.assertEqual((copy.title, copy.trip_start_date, copy.trip_end_date), ('次の旅行', date(2026, 3, 28), date(2026, 4, 1)))
+        for original, shifted in zip(self.schedule.plans.order_by('id'), copy.plans.order_by('id')):
+            before, after = timezone.localtime(original.start_datetime), timezone.localtime(shifted.start_datetime)
+            self.assertEqual((after.date() - before.date()).days, 239)
+            self.assertEqual(after.time(), before.time())
+        self.assertEqual(
+            set(PlanDayOccurrence.objects.filter(schedule=copy).values_list('date', flat=True)),
+            {date(2026, 3, 28) + timedelta(days=i) for i in range(5)},
+        )
+
+    def test_large_schedule_is_copied_in_bulk(self):
+        schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 500).id)
+        started = time.monotonic()
+        with self.assertQueryBudget(30, label='予定表の複製（予定500件）'): #INSERTはSQLiteの変数の数の上限（999）ごとに分かれる
+            copy = duplicate_schedule(schedule, new_start_date=date(2025, 9, 1))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(copy.plans.count(), 500)
+        self.assertEqual(Picture.objects.filter(plan__schedule=copy).count(), 1000)
+
+    def test_view_copies_own_schedule_only(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('app:duplicate_schedule', args=[self.schedule.id]), {'start_date': '2025-10-01'})
+        copy = Schedule.objects.exclude(id=self.schedule.id).get()
+        self.assertRedirects(response, reverse('app:schedule_detail', args=[copy.id]))
+        self.assertEqual(copy.trip_start_date, date(2025, 10, 1))
+
+        #存在しない日付は500にせず、形が正しくない日付と同じくホームに戻す（複製しない）
+        response = self.client.post(reverse('app:duplicate_schedule', args=[self.schedule.id]), {'start_date': '2025-02-30'})
+        self.assertRedirects(response, reverse('app:home'), fetch_redirect_response=False)
+        #日程をずらす時と同じく、前後10年を超える日付も複製しない（9999-12-31に近い日付で予定の日時があふれない）
+        response = self.client.post(reverse('app:duplicate_schedule', args=[self.schedule.id]), {'start_date': '9999-12-30'})
+        self.assertRedirects(response, reverse('app:home'), fetch_redirect_response=False)
+
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(reverse('app:duplicate_schedule', args=[self.schedule.id])).status_code, 404)
+        self.assertEqual(Schedule.objects.count(), 2)
+
+
+#旅行全体の日程をずらす（trip_shift.py）
+class ShiftScheduleTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='shift@example.com', name='shift', password='pass1234', username='shift')
+        self.schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 20).id)
+
+    def test_moves_schedule_plans_and_day_rows(self):
+        before = {plan.id: (plan.start_datetime, plan.end_datetime) for plan in self.schedule.plans.all()}
+        old_updated = self.schedule.updated_at
+        shift_schedule(self.schedule, 7)
+
+        self.schedule.refresh_from_db()
+        self.assertEqual((self.schedule.trip_start_date, self.schedule.trip_end_date), (date(2025, 8, 8), date(2025, 8, 12)))
+        self.assertGreater(self.schedule.updated_at, old_updated) #キャッシュ・ETagが新しくなる
+        for plan in self.schedule.plans.all():
+            start, end = before[plan.id]
+            self.assertEqual((plan.start_datetime, plan.end_datetime), (start + timedelta(days=7), end + timedelta(days=7)))
+        self.assertEqual(
+            set(PlanDayOccurrence.objects.filter(schedule=self.schedule).values_list('date', flat=True)),
+            {date(2025, 8, 8) + timedelta(days=i) for i in range(5)},
+        )
+        self.assertEqual(self.schedule.plan_count, 20) #予定は1件も消えない
+
+    def test_query_count_does_not_depend_on_plan_count(self):
+        schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 500).id)
+        with self.assertQueryBudget(15, label='日程をずらす（予定500件）'): #日別展開のINSERTだけSQLiteの変数の数の上限ごとに分かれる
+            shift_schedule(schedule, -3)
+        self.assertEqual(schedule.trip_start_date, date(2025, 7, 29))
+
+    def test_view_accepts_new_start_date(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('app:shift_schedule', args=[self.schedule.id]), {'start_date': '2025-07-30'})
+        self.assertRedirects(response, reverse('app:schedule_detail', args=[self.schedule.id]))
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.trip_end_date, date(2025, 8, 3))
+
+        #存在しない日付は500にせずホームに戻す
+        response = self.client.post(reverse('app:shift_schedule', args=[self.schedule.id]), {'start_date': '2025-02-30'})
+        self.assertRedirects(response, reverse('app:home'), fetch_redirect_response=False)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.trip_end_date, date(2025, 8, 3))
+
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(reverse('app:shift_schedule', args=[self.schedule.id]), {'days': 1}).status_code, 404)
+
+
+#旅行期間を短くした時の期間外の予定の削除（trimming.py）
+class TrimScheduleTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='trim@example.com', name='trim', password='pass1234', username='trim')
+        self.schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 20).id) #8/1～8/4の予定と8/1～8/5の宿泊
+
+    def expected_outside(self, start, end):
+        start = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(end, datetime.max.time()))
+        return {plan.id for plan in self.schedule.plans.all() if plan.start_datetime < start or plan.end_datetime > end}
+
+    def test_preview_counts_what_trim_deletes(self):
+        outside = self.expected_outside(date(2025, 8, 2), date(2025, 8, 3))
+        preview = trim_preview(self.schedule, date(2025, 8, 2), date(2025, 8, 3))
+        self.assertEqual((preview['plans'], preview['links'], preview['pictures']), (len(outside), len(outside) * 2, len(outside) * 2))
+        self.assertEqual(len(preview['names']), 5)
+
+        images = set(Picture.objects.filter(plan__in=outside).values_list('image', flat=True))
+        with mock.patch('app.signals.release_file') as release: #写真の削除のsignalでファイルを解放する
+            deleted = trim_schedule(self.schedule, date(2025, 8, 2), date(2025, 8, 3))
+        self.assertEqual(deleted, len(outside))
+        self.assertEqual({call.args[0] for call in release.call_args_list}, images) #写真のファイルは参照がなくなったら消す
+        self.assertFalse(Plan.objects.filter(id__in=outside).exists())
+        for model in (Link, Picture, PlanDayOccurrence):
+            self.assertFalse(model.objects.filter(plan_id__in=outside).exists())
+        self.assertEqual(self.schedule.plans.count(), 20 - len(outside))
+        self.assertFalse(drifted_schedules().exists())
+        self.assertEqual(trim_preview(self.schedule, date(2025, 8, 2), date(2025, 8, 3))['plans'], 0)
+
+    def test_query_count_grows_only_per_delete_batch(self):
+        schedule = Schedule.objects.get(id=self.seed_schedule(self.user, 500).id)
+        #日別展開・リンクはDELETE1回ずつ　写真（約500枚）と予定（約250件）はDjangoのdelete()が100件ずつのDELETEに分けるので、その分だけ増える
+        with self.assertQueryBudget(18, label='期間外の予定の削除（予定500件）'):
+            trim_schedule(schedule, date(2025, 8, 2), date(2025, 8, 3))
+
+    def test_edit_schedule_title_trims_only_own_schedule(self):
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        data = {'schedule_id': self.schedule.id, 'title': '変更', 'start_date': '2025-08-02', 'end_date': '2025-08-03'}
+        self.assertEqual(self.client.post(reverse('app:edit_schedule_title'), data).status_code, 404)
+        self.assertEqual(self.schedule.plans.count(), 20)
+        self.assertEqual(self.client.get(reverse('app:trim_preview', args=[self.schedule.id]), {'start_date': '2025-08-02', 'end_date': '2025-08-03'}).status_code, 404)
+
+        self.client.force_login(self.user)
+        preview = self.client.get(reverse('app:trim_preview', args=[self.schedule.id]), {'start_date': '2025-08-02', 'end_date': '2025-08-03'}).json()
+        self.client.post(reverse('app:edit_schedule_title'), data)
+        self.schedule.refresh_from_db()
+        self.assertEqual((self.schedule.title, self.schedule.plan_count), ('変更', 20 - preview['plans']))
+        self.assertEqual(self.client.get(reverse('app:trim_preview', args=[self.schedule.id]), {'start_date': '2025-08-03', 'end_date': '2025-08-02'}).status_code, 400)
+
+    def test_nonexistent_dates_are_ignored(self):
+        self.client.force_login(self.user)
+        #2月30日のような存在しない日付は500にせず、形が正しくない日付と同じ扱いにする
+        response = self.client.get(reverse('app:trim_preview', args=[self.schedule.id]), {'start_date': '2025-02-30', 'end_date': '2025-08-03'})
+        self.assertEqual(response.status_code, 400)
+        data = {'schedule_id': self.schedule.id, 'title': '変更', 'start_date': '2025-08-02', 'end_date': '2025-08-32'}
+        self.assertRedirects(self.client.post(reverse('app:edit_schedule_title'), data), reverse('app:home'), fetch_redirect_response=False)
+        self.schedule.refresh_from_db()
+        self.assertNotEqual(self.schedule.title, '変更') #変更しない
+        self.assertEqual(self.schedule.plan_count, 20)
+
+
+#カレンダー（.ics）出力と購読用URL（ics.py）
+class CalendarExportTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='ics@example.com', name='ics', password='pass1234', username='ics')
+        self.schedule = Schedule.objects.create(user=self.user, title='大阪旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        train = TransportationMethod.objects.get_or_create(transportation='shinkansen')[0]
+        transportation.invalidate()
+        Plan.objects.create(schedule=self.schedule, action_category='move', transportation=train, departure_location='東京', arrival_location='新大阪',
+                            start_datetime=aware(2025, 8, 1, 9), end_datetime=aware(2025, 8, 1, 11, 30), memo='指定席, 3号車')
+        Plan.objects.create(schedule=self.schedule, action_category='stay', name='梅田ホテル',
+                            start_datetime=aware(2025, 8, 1, 15), end_datetime=aware(2025, 8, 3, 10))
+        self.client.force_login(self.user)
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_fold_keeps_lines_short_without_splitting_characters(self):
+        line = 'DESCRIPTION:' + 'あいうえお' * 30
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', '').rstrip('\r\n'), line)
+
+    def test_schedule_export(self):
+        response = self.client.get(reverse('app:schedule_calendar', args=[self.schedule.id]))
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = self.read(response).replace('\r\n ', '')
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('SUMMARY:東京→新大阪（新幹線）', body)
+        self.assertIn('DTSTART:20250801T000000Z', body) #9:00（日本時間）
+        self.assertIn('DESCRIPTION:出発：東京\\n到着：新大阪\\n移動手段：新幹線\\n指定席\\, 3号車', body)
+        self.assertIn('DTSTART;VALUE=DATE:20250801\r\nDTEND;VALUE=DATE:20250804', body) #宿泊はチェックアウト日まで終日
+
+        #変わっていなければ304
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('app:schedule_calendar', args=[self.schedule.id]), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        refresh_schedule_summary(self.schedule)
+        self.assertEqual(self.client.get(reverse('app:schedule_calendar', args=[self.schedule.id]), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('app:schedule_calendar', args=[self.schedule.id])).status_code, 404)
+
+    def test_account_feed(self):
+        self.client.post(reverse('app:calendar_token'))
+        self.user.refresh_from_db()
+        url = reverse('app:calendar_feed', args=[self.user.calendar_token])
+        self.assertContains(self.client.get(reverse('app:mypage')), url)
+
+        second = Schedule.objects.create(user=self.user, title='京都旅行', trip_start_date='2025-09-01', trip_end_date='2025-09-01')
+        Plan.objects.create(schedule=second, action_category='sightseeing', name='清水寺',
+                            start_datetime=timezone.make_aware(datetime(2025, 9, 1, 10)), end_datetime=timezone.make_aware(datetime(2025, 9, 1, 12)))
+        self.client.logout() #カレンダーアプリはログインしない
+        response = self.client.get(url)
+        body = self.read(response)
+        self.assertEqual(body.count('BEGIN:VEVENT'), 3)
+        self.assertIn('DESCRIPTION:予定表：京都旅行', body)
+        self.assertIn('REFRESH-INTERVAL;VALUE=DURATION:PT1H', body)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        second.delete() #予定表を削除しても検証値が変わる
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        #作り直すと前のURLは使えない
+        self.client.force_login(self.user)
+        self.client.post(reverse('app:calendar_token'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_large_export_reads_plans_in_chunks(self):
+        schedule = self.seed_schedule(self.user, 1200, links_per_plan=0, pictures_per_plan=0)
+        with self.assertQueryBudget(6, label='カレンダー出力（予定1200件）'):
+            body = self.read(self.client.get(reverse('app:schedule_calendar', args=[schedule.id])))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1200)
+
+
+#行程表（CSV・iCalendar）の取り込み（plan_import.py）
+class PlanImportTests(TestCase):
+    CSV_HEADER = 'カテゴリ,名前,開始日,開始時刻,終了日,終了時刻,出発地,到着地,移動手段,メモ\n'
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='import@example.com', name='import', password='pass1234', username='import')
+        self.schedule = Schedule.objects.create(user=self.user, title='取り込み', trip_start_date=date(2025, 8, 1), trip_end_date=date(2025, 8, 3))
+        TransportationMethod.objects.get_or_create(transportation='shinkansen')
+        transportation.invalidate()
+        self.client.force_login(self.user)
+
+    def csv_file(self, text, encoding='utf-8', name='plans.csv'):
+        return SimpleUploadedFile(name, (self.CSV_HEADER + text).encode(encoding), content_type='text/csv')
+
+    def test_csv_rows_are_validated_with_plan_form(self):
+        result = import_plans(self.schedule, csv_rows(self.csv_file(
+            '移動,,2025/08/01,09:00,2025/08/01,11:30,東京,新大阪,新幹線,指定席\n'
+            '観光,,2025-08-01,13:00,2025-08-01,15:00,,,,\n'             #名前がない
+            '\n'
+            '宿泊,梅田ホテル,2025-08-01,15:00,2025-08-03,10:00,,,,\n'
+            '移動,,2025-08-03,17:00,2025-08-03,19:30,新大阪,東京,ロケット,\n'  #ない移動手段
+            '食事,夕食,2025-08-05,18:00,,19:00,,,,\n'                    #旅行期間の外
+        )))
+        self.assertEqual((result['created'], result['error_count']), (2, 3))
+        self.assertEqual([error['row'] for error in result['errors']], [3, 6, 7])
+        self.assertIn('name', result['errors'][0]['errors'])
+        self.assertIn('transportation', result['errors'][1]['errors'])
+        self.assertIn('start_date', result['errors'][2]['errors'])
+
+        move = self.schedule.plans.get(action_category='move')
+        self.assertEqual((move.departure_location, str(move.transportation), move.memo), ('東京', '新幹線', '指定席'))
+        self.assertEqual(timezone.localtime(move.start_datetime), timezone.make_aware(datetime(2025, 8, 1, 9)))
+        self.assertEqual(PlanDayOccurrence.objects.filter(schedule=self.schedule).count(), 3) #移動1日＋宿泊のチェックイン・アウト
+        self.assertFalse(drifted_schedules().exists())
+
+    def test_shift_jis_csv(self):
+        result = import_plans(self.schedule, csv_rows(self.csv_file('食事,たこ焼き,2025-08-02,12:00,,13:00,,,,\n', encoding='cp932')))
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(self.schedule.plans.get().name, 'たこ焼き')
+
+    def test_ics_export_can_be_imported_again(self):
+        import_plans(self.schedule, csv_rows(self.csv_file(
+            '移動,,2025-08-01,09:00,2025-08-01,11:30,東京,新大阪,新幹線,指定席\n'
+            '宿泊,梅田ホテル,2025-08-01,15:00,2025-08-03,10:00,,梅田,,朝食付き\n'
+            '観光,大阪城,2025-08-02,10:00,2025-08-02,12:00,,,,"天守閣, 庭園"\n'
+        )))
+        exported = ''.join(calendar_stream(schedule_plans(self.schedule), self.schedule.title)).encode()
+        copy = Schedule.objects.create(user=self.user, title='コピー', trip_start_date=date(2025, 8, 1), trip_end_date=date(2025, 8, 3))
+        result = import_plans(copy, ics_rows(SimpleUploadedFile('trip.ics', exported)))
+        self.assertEqual((result['created'], result['error_count']), (3, 0))
+        fields = ('action_category', 'name', 'start_datetime', 'end_datetime', 'departure_location', 'arrival_location', 'transportation_id', 'memo')
+        self.assertEqual(
+            list(copy.plans.order_by('start_datetime').values_list(*fields)),
+            list(self.schedule.plans.order_by('start_datetime').values_list(*fields)),
+        )
+
+    def test_conflicts_with_existing_plans_are_reported(self):
+        Plan.objects.create(schedule=self.schedule, action_category='sightseeing', name='城',
+                            start_datetime=timezone.make_aware(datetime(2025, 8, 2, 10)), end_datetime=timezone.make_aware(datetime(2025, 8, 2, 12)))
+        result = import_plans(self.schedule, csv_rows(self.csv_file('食事,昼食,2025-08-02,11:00,,12:30,,,,\n')))
+        self.assertEqual(result['conflict_count'], 1)
+        self.assertEqual([plan['name'] for plan in result['conflicts'][0]['plans']], ['城', '昼食'])
+
+    def test_view(self):
+        url = reverse('app:plan_import', args=[self.schedule.id])
+        data = self.client.post(url, {'file': self.csv_file('食事,昼食,2025-08-02,12:00,,13:00,,,,\n'), 'dry_run': '1'}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(data['created'], 1)
+        self.assertFalse(self.schedule.plans.exists()) #チェックだけ
+
+        response = self.client.post(url, {'file': self.csv_file('食事,昼食,2025-08-02,12:00,,13:00,,,,\n観光,,2025-08-02,14:00,2025-08-02,15:00,,,,\n')}, follow=True)
+        self.assertContains(response, '1件の予定を取り込みました')
+        self.assertContains(response, '3行目：名前：')
+        self.assertEqual(self.schedule.plans.count(), 1)
+
+        response = self.client.post(url, {'file': SimpleUploadedFile('plans.txt', b'abc')}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        #CSVとして読めないファイル（1つの項目が長すぎる）も500にせず400にして、途中の行も取り込まない
+        response = self.client.post(url, {'file': self.csv_file('食事,昼食,2025-08-02,12:00,,13:00,,,,\n食事,"' + 'あ' * 200000 + '",2025-08-02,,,,,,,\n')}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('3行目', response.json()['error'])
+        self.assertEqual(self.schedule.plans.count(), 1)
+
+        #取り込みに失敗しても予定表は変わらないが、予定詳細画面を304にせずメッセージを出す
+        detail_url = reverse('app:schedule_detail', args=[self.schedule.id])
+        etag = self.client.get(detail_url)['ETag']
+        self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(url, {'file': SimpleUploadedFile('plans.txt', b'abc')})
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['messages']), 1)
+        self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304) #表示した後は元に戻る
+
+        #チェックだけの時は「取り込みました」と言わない
+        response = self.client.post(url, {'file': self.csv_file('食事,夕食,2025-08-02,18:00,,19:00,,,,\n'), 'dry_run': '1'}, follow=True)
+        self.assertContains(response, '1件の予定を取り込めます')
+        self.assertNotContains(response, '取り込みました')
+
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(url, {'file': self.csv_file('')}).status_code, 404)
+
+    def test_ten_thousand_rows(self):
+        Schedule.objects.filter(id=self.schedule.id).update(trip_end_date=date(2025, 8, 30))
+        rows = []
+        for i in range(10000): #1日333件、4分ごとに3分間の予定（重なりなし）
+            day, slot = 1 + i // 334, i % 334
+            start, end = divmod(slot * 4, 60), divmod(slot * 4 + 3, 60)
+            rows.append(f'観光,観光{i},2025-08-{day:02d},{start[0]:02d}:{start[1]:02d},2025-08-{day:02d},{end[0]:02d}:{end[1]:02d},,,,\n')
+        started = time.monotonic()
+        result = import_plans(self.schedule, csv_rows(self.csv_file(''.join(rows))))
+        self.assertLess(time.monotonic() - started, 30) #ほとんどはPlanFormのチェックの時間（1件1ミリ秒弱）
+        self.assertEqual((result['created'], result['error_count'], result['conflict_count']), (10000, 0, 0))
+        self.assertEqual(Plan.objects.filter(schedule=self.schedule).count(), 10000)
+
+
+#印刷用の行程表（itinerary.py）のテスト
+@override_settings(BACKGROUND_WORKERS=0)
+class ItineraryTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='print@example.com', name='print', password='pass1234', username='print')
+        self.schedule = Schedule.objects.create(user=self.user, title='京都旅行', trip_start_date='2025-08-01', trip_end_date='2025-08-03')
+        aware = lambda *args: timezone.make_aware(datetime(*args))
+        temple = Plan.objects.create(schedule=self.schedule, action_category='sightseeing', name='清水寺',
+                                     start_datetime=aware(2025, 8, 1, 10), end_datetime=aware(2025, 8, 1, 12), memo='朝早く行く')
+        Link.objects.create(plan=temple, title='公式サイト', url='https://example.com/kiyomizu')
+        Picture.objects.create(plan=temple, image=make_image(), renditions_ready=True)
+        Plan.objects.create(schedule=self.schedule, action_category='stay', name='京都ホテル',
+                            start_datetime=aware(2025, 8, 1, 15), end_datetime=aware(2025, 8, 3, 10))
+        rebuild_schedule_occurrences(self.schedule.id)
+        self.schedule = Schedule.objects.get(pk=self.schedule.pk)
+        self.url = reverse('app:itinerary', args=[self.schedule.id])
+        self.client.force_login(self.user)
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_lays_out_all_days_with_links_and_thumbnails(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        html = self.read(response)
+        for text in ['1日目', '2日目', '3日目', '予定はありません', '清水寺', '朝早く行く', 'https://example.com/kiyomizu', 'チェックイン', 'チェックアウト']:
+            self.assertIn(text, html)
+        self.assertIn('.thumb.jpg', html) #写真は縮小版
+        self.assertTrue(os.path.exists(itinerary.itinerary_path(self.schedule)))
+
+        response = self.client.get(self.url + '?download=1')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_file_is_reused_until_schedule_changes(self):
+        with mock.patch.object(itinerary, 'render_itinerary', wraps=itinerary.render_itinerary) as render:
+            self.read(self.client.get(self.url))
+            old_path = itinerary.itinerary_path(self.schedule)
+            response = self.client.get(self.url)
+            self.read(response)
+            self.assertEqual(render.call_count, 1) #2回目は保存したファイルを返す
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+            refresh_schedule_summary(self.schedule) #予定表が変わると作り直す
+            self.read(self.client.get(self.url))
+            self.assertEqual(render.call_count, 2)
+        self.assertFalse(os.path.exists(old_path)) #古いバージョンは消える
+        self.assertTrue(os.path.exists(itinerary.itinerary_path(Schedule.objects.get(pk=self.schedule.pk))))
+
+    def test_late_render_of_older_version_keeps_newer_file(self):
+        directory = itinerary.schedule_dir(self.schedule.id)
+        os.makedirs(directory)
+        stamp = self.schedule.updated_at.timestamp()
+        older = os.path.join(directory, f'{stamp - 60:.6f}-0-{transportation.version()}.html')
+        newer = os.path.join(directory, f'{stamp + 60:.6f}-0-{transportation.version()}.html') #先に作り終わった新しいバージョン
+        for path in (older, newer):
+            with open(path, 'w') as f:
+                f.write('')
+        path = itinerary.render_itinerary(self.schedule.id)
+        self.assertEqual(sorted(os.listdir(directory)), sorted([os.path.basename(path), os.path.basename(newer)]))
+
+    def test_pending_while_worker_renders(self):
+        future = Future()
+        with mock.patch.object(workers, 'submit', return_value=future) as submit:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response['Retry-After'], '2')
+            self.assertFalse(response.has_header('ETag')) #作成中の画面は304にしない
+            self.client.get(self.url)
+            self.assertEqual(submit.call_count, 1) #作成中は同じ行程表を2回作らない
+        future.set_result(None)
+        self.assertEqual(itinerary._rendering, {})
+
+    def test_render_failure_is_logged_not_500(self):
+        #スレッドプールを使わずその場で作る時も、失敗はログに出すだけ（スレッドプールの時と同じ）で、作成中の画面を返す
+        with mock.patch.object(itinerary, 'render_to_string', side_effect=RuntimeError):
+            with self.assertLogs('app.workers', 'ERROR'):
+                response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(itinerary._rendering, {}) #次に開いた時は作り直す
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_other_user_and_deleted_schedule(self):
+        self.read(self.client.get(self.url))
+        other = User.objects.create_user(email='other@example.com', name='other', password='pass1234', username='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.delete()
+        self.assertFalse(os.path.exists(itinerary.schedule_dir(self.schedule.id)))
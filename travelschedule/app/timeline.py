@@ -0,0 +1,99 @@
+#予定詳細画面のタイムライン計算
+#1日分の予定を時刻順に並べて、重なりの深さ(nest_level)と横並びの列(lane)を決める
+import heapq
+
+
+#タイムライン1件分の表示用データ
+#planは共有のPlanオブジェクトをそのまま指すだけでコピーしない（deepcopyするとprefetchしたlinks/picturesまで複製されるため）
+#1件のplanが複数日・チェックイン/チェックアウトに出てきても、日ごとの表示情報だけをこの小さいオブジェクトに持たせる
+class TimelineEntry:
+    __slots__ = ('plan', 'display_type', 'display_datetime', 'is_stay_display', 'nest_level', 'lane', 'lane_count', 'cluster')
+
+    def __init__(self, plan, display_type='', display_datetime=None):
+        self.plan = plan
+        self.display_type = display_type #'checkin'、'checkout'、それ以外は空文字
+        self.display_datetime = display_datetime or plan.start_datetime #並び替えや表示用の時刻
+        self.is_stay_display = bool(display_type) #宿泊の表示用の目印
+        self.nest_level = 0
+        self.lane = 0
+        self.lane_count = 1
+        self.cluster = 0
+
+    #重なり判定ではplan本体の開始・終了時刻を使う
+    @property
+    def start_datetime(self):
+        return self.plan.start_datetime
+
+    @property
+    def end_datetime(self):
+        return self.plan.end_datetime
+
+
+#並び替えに使う時刻　宿泊の表示用コピーはdisplay_datetime（チェックイン・チェックアウト時刻）を使う
+def _sort_key(entry):
+    return getattr(entry, 'display_datetime', None) or entry.start_datetime
+
+
+#1日分の予定をスイープライン（開始時刻順に1回なめるだけ）で処理する関数
+#nest_level：その予定が始まる時点でまだ終わっていない先行予定の数（0なら重なりなし）
+#lane：重なっている予定同士を横に並べる時の列番号（0始まり）
+#lane_count：重なりのかたまり（cluster）全体で必要な列数　テンプレートで列幅を決めるために使う
+#cluster：重なりのかたまりの番号　テンプレートのregroupでまとめて横並びにするために使う
+def layout_day(entries):
+    sorted_entries = sorted(entries, key=_sort_key) #その日の予定を時刻順に並べる（1日につき1回だけ）
+
+    busy = [] #まだ終わっていない予定の(終了時刻, 列番号)を入れる最小ヒープ　先頭が一番早く終わる予定
+    free_lanes = [] #空いた列番号を入れる最小ヒープ　空いている一番左の列から使う
+    next_lane = 0 #次に新しく作る列番号
+    cluster_seq = 0 #かたまり番号の連番（宿泊も1件で1つのかたまりとして番号を使う）
+    cluster = None #今のかたまり番号
+    cluster_members = [] #今のかたまりに入っている予定
+    cluster_lanes = 0 #今のかたまりで使った列数
+
+    #かたまりが終わった時に、かたまり内の全予定にlane_countを書き込む
+    def close_cluster():
+        for member in cluster_members:
+            member.lane_count = cluster_lanes
+
+    for entry in sorted_entries:
+        entry.nest_level = 0 #重なっていない前提
+        entry.lane = 0
+        entry.lane_count = 1
+
+        if getattr(entry, 'is_stay_display', False): #宿泊カテゴリは背景扱いで重なり判定を除外
+            entry.cluster = cluster_seq
+            cluster_seq += 1
+            continue
+
+        #この予定の開始時刻までに終わった予定をヒープから取り出し、その列を空ける
+        while busy and busy[0][0] <= entry.start_datetime:
+            _, lane = heapq.heappop(busy)
+            heapq.heappush(free_lanes, lane)
+
+        #何も進行中の予定がなければ新しいかたまりを始める
+        if not busy:
+            close_cluster()
+            cluster = cluster_seq
+            cluster_seq += 1
+            cluster_members = []
+            cluster_lanes = 0
+            free_lanes = []
+            next_lane = 0
+
+        entry.nest_level = len(busy) #進行中の予定の数がそのまま重なりの深さ
+
+        #空いている列があれば再利用、なければ新しい列を作る
+        if free_lanes:
+            lane = heapq.heappop(free_lanes)
+        else:
+            lane = next_lane
+            next_lane += 1
+        entry.lane = lane
+        entry.cluster = cluster
+        cluster_members.append(entry)
+        cluster_lanes = max(cluster_lanes, lane + 1)
+
+        heapq.heappush(busy, (entry.end_datetime, lane))
+
+    close_cluster()
+    return sorted_entries
@@ -0,0 +1,76 @@
+#移動手段（TransportationMethod）の一覧をプロセスの中で1回だけ読み込んで使い回す
+#管理画面でしか変わらない小さい表なので、予定の追加・編集画面や予定詳細画面のたびにDBに取りに行かない
+#管理画面などで保存・削除された時はsignals.pyからinvalidate()を呼んで次に使う時に読み直す
+#（シグナルは保存したプロセスの中でしか届かないので、複数プロセスで動かす時は他のプロセスは再起動か、見つからないidが来た時の読み直しで追いつく）
+import hashlib
+import threading
+import time
+
+from .models import TransportationMethod
+
+_lock = threading.Lock()
+_methods = None #{id: TransportationMethod}　id順
+_version = None #読み込んだ一覧の内容から作ったバージョン
+_loaded_at = 0.0 #最後に読み込んだ時刻（time.monotonic()）
+MISS_RELOAD_INTERVAL = 10 #一覧にないidが来た時に読み直す間隔（秒）　でたらめなidが何度送られてきても毎回は読み直さない
+
+
+def _load():
+    global _methods, _version, _loaded_at
+    with _lock:
+        if _methods is None:
+            _methods = {m.id: m for m in TransportationMethod.objects.order_by('id')}
+            _loaded_at = time.monotonic()
+            contents = repr([(m.id, m.transportation, m.transportation_icon_class) for m in _methods.values()])
+            _version = hashlib.sha1(contents.encode()).hexdigest()[:8]
+        return _methods
+
+
+#読み込み済みの一覧を捨てる（次に使う時にDBから読み直す）
+def invalidate(**kwargs):
+    global _methods
+    with _lock:
+        _methods = None
+
+
+#一覧のバージョン　移動手段の名前・アイコンが変わると変わる
+#移動手段の名前を入れて作った表示キャッシュ（render_cache.py）・行程表のファイル（itinerary.py）・検証値（ETag）に入れて、
+#管理画面で移動手段を変えた時に予定表を保存し直さなくても作り直されるようにする
+#（内容から作るので、他のプロセスも読み直した時に同じ値になる）
+def version():
+    _load()
+    return _version
+
+
+#全ての移動手段（id順）
+def all_methods():
+    return list(_load().values())
+
+
+#idから移動手段を取り出す　一覧にないidは他のプロセスで追加された可能性があるので1回だけ読み直す
+#（読み直すのは前回の読み込みからMISS_RELOAD_INTERVAL秒たった時だけ）
+def get_method(method_id):
+    if method_id in (None, ''):
+        return None
+    try:
+        method_id = int(method_id)
+    except (TypeError, ValueError):
+        return None
+    methods = _load()
+    if method_id not in methods and time.monotonic() - _loaded_at > MISS_RELOAD_INTERVAL:
+        invalidate()
+        methods = _load()
+    return methods.get(method_id)
+
+
+#予定追加・編集画面のテンプレートに渡す形　[{'id':1, 'label': 'walk', 'icon': 'fa-person-walking'},{・・・},]
+def template_choices():
+    return [
+        {'id': m.id, 'label': m.transportation, 'icon': m.transportation_icon_class}
+        for m in all_methods()
+    ]
+
+
+#フォームのchoices用　[(id, 表示名), ...]
+def form_choices():
+    return [(m.id, str(m)) for m in all_methods()]
@@ -0,0 +1,61 @@
+#旅行期間を短くした時に、新しい期間からはみ出す予定を削除する
+#先にtrim_previewで消える予定・リンク・写真の数を返し（ユーザーが数を見て確認する）、確認後にtrim_scheduleで削除する
+#削除は予定の関連を全部まとめて読み込まずに、日別展開・リンク・写真・予定の順に「はみ出した予定」のサブクエリで絞って消す
+#（予定だけをdelete()すると、写真に削除のsignalがあるので、関連する行を全部読み込んでから消すことになり、件数が多いとSQLiteの書き込みロックを長く持つ）
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .conflicts import plan_label
+from .models import Link, Picture, Plan, PlanDayOccurrence
+from .summary import refresh_schedule_summary
+
+PREVIEW_NAMES = 5 #確認画面に名前を出す予定の数
+
+
+#新しい旅行期間（start_date～end_date）からはみ出す予定
+#開始日より前に始まる予定、終了日より後に終わる予定（宿泊など期間をまたぐ予定も一部がはみ出せば対象）
+def plans_outside(schedule, start_date, end_date):
+    start = timezone.make_aware(datetime.combine(start_date, time.min)) #新しい開始日の0:00（日本時間）
+    end = timezone.make_aware(datetime.combine(end_date, time.max)) #新しい終了日の23:59:59.999999
+    return Plan.objects.filter(schedule=schedule).filter(
+        Q(start_datetime__lt=start)
+        | Q(end_datetime__gt=end)
+        | (Q(end_datetime__isnull=True) & Q(start_datetime__gt=end))
+    )
+
+
+#消える予定・リンク・写真の数と、予定の名前（最初の数件）　削除する前の確認用
+#数は予定1件あたりのリンク・写真の数に関係なく1回のクエリで数える
+def trim_preview(schedule, start_date, end_date):
+    outside = plans_outside(schedule, start_date, end_date)
+    counts = outside.aggregate(
+        plans=Count('id', distinct=True),
+        links=Count('links', distinct=True),
+        pictures=Count('pictures', distinct=True),
+    )
+    names = []
+    if counts['plans']:
+        names = [plan_label(plan) for plan in outside.only('id', 'action_category', 'name', 'arrival_location').order_by('start_datetime', 'id')[:PREVIEW_NAMES]]
+    return {**counts, 'names': names}
+
+
+#はみ出した予定をまとめて削除する　消した予定の数を返す
+#日別展開・リンクはsignalがないので、delete()でもはみ出した予定のサブクエリでDELETE1回ずつになる
+#写真は削除のsignal（signals.release_picture_file）でファイルを解放するので、必要な列だけ読み込んでから消す
+#予定は関連する行を先に消してあるので、idだけ読み込んでdelete()する（Planに関連が増えてもDjangoのon_deleteの通りに消える）
+@transaction.atomic
+def trim_schedule(schedule, start_date, end_date):
+    outside = plans_outside(schedule, start_date, end_date)
+    plan_ids = outside.values('id') #毎回サブクエリとして実行する（予定を読み込まない）
+
+    PlanDayOccurrence.objects.filter(plan__in=plan_ids).delete()
+    Link.objects.filter(plan__in=plan_ids).delete()
+    Picture.objects.filter(plan__in=plan_ids).only('id', 'plan_id', 'image').delete()
+    _, deleted = outside.only('id').delete()
+    deleted = deleted.get(Plan._meta.label, 0)
+    if deleted:
+        refresh_schedule_summary(schedule) #消した予定・リンク・写真の分、件数を数え直してupdated_atを進める
+    return deleted
@@ -0,0 +1,39 @@
+#旅行全体の日程をN日ずらす（飛行機が1週間後に変更になった時など）
+#予定編集画面で1件ずつ直したり、edit_schedule_titleで旅行期間を変えて期間外の予定が消えたりしないように、
+#予定表の日付と全部の予定の日時を、予定の数に関係なくUPDATE文でまとめてずらす
+#日時はUTCのままN×24時間ずらす（日本時間にはサマータイムがないので、時刻はそのまま日付だけが変わる）
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Plan, Schedule
+from .occurrences import rebuild_schedule_occurrences
+
+MAX_SHIFT_DAYS = 3650 #ずらせる日数の上限（前後10年）
+
+
+#予定表をdays日ずらす（マイナスなら前にずらす）
+#日別展開テーブルは日付が変わるので作り直し、updated_atを進めて予定詳細画面のキャッシュ・ETagも新しくする
+#クエリの回数は予定の数に関係なく、予定表と予定のUPDATE各1回＋日別展開の作り直し
+@transaction.atomic
+def shift_schedule(schedule, days):
+    if not days:
+        return schedule
+    delta = timedelta(days=days)
+    now = timezone.now()
+    Plan.objects.filter(schedule=schedule).update(
+        start_datetime=F('start_datetime') + delta,
+        end_datetime=F('end_datetime') + delta,
+        updated_at=now, #update()ではauto_nowが動かない
+    )
+    #日別展開の行は日付だけずらすと(予定, 日付)の一意制約に途中でぶつかる（8/1→8/2にした時、まだずらしていない8/2の行がある）ので作り直す
+    rebuild_schedule_occurrences(schedule.id)
+    Schedule.objects.filter(pk=schedule.pk).update(
+        trip_start_date=F('trip_start_date') + delta,
+        trip_end_date=F('trip_end_date') + delta,
+        updated_at=now,
+    )
+    schedule.refresh_from_db(fields=['trip_start_date', 'trip_end_date', 'updated_at'])
+    return schedule
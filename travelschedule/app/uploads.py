@@ -0,0 +1,184 @@
+#写真の分割アップロード
+#スマホで撮った写真は1枚5～10MBあるので、予定フォームと一緒に1回のPOSTで送ると、回線が切れたり入力エラーで画面を出し直した時に全部送り直しになる
+#写真だけを先に小さく分けて送ってもらい（途中で切れたら受け取り済みの続きから）、予定フォームからはtokenで参照する
+#受け取ったデータはメモリにためずに、少しずつ一時ファイル（settings.UPLOAD_SESSION_DIR）に書き足す
+import os
+import secrets
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File, locks
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import Picture, UploadSession
+from .storage import picture_storage
+
+READ_SIZE = 64 * 1024 #リクエストから1回に読む大きさ
+#受け取り後にPillowで画像か確かめるので、Pillowで開ける形式だけ（HEICはpillow-heifがないと開けないので受け付けない）
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+
+#アップロードを受け付けられない時のエラー　statusはブラウザに返すHTTPステータス
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.offset = offset #受け取り済みの位置がずれている時に、どこから送り直せばいいか
+
+
+#受け取り途中のファイルの置き場所
+def part_path(token):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f'{token}.part')
+
+
+#期限切れとみなす日時（これより前から送られてこないアップロードは数えない・削除する）
+def expiry_threshold(now=None):
+    return (now or timezone.now()) - timedelta(hours=settings.UPLOAD_SESSION_EXPIRY_HOURS)
+
+
+#アップロードを始める　ファイル1枚の大きさと、同じ予定表に送っている途中の写真との合計を先に確認する
+#（予定を新規作成する時はまだ予定がないので、予定1つ分の上限は予定表ごとに数える　保存の時にもう一度予定1つ分で確認する）
+def start_upload(user, schedule, filename, size):
+    filename = os.path.basename(filename or '').strip()
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise UploadError('画像ファイル（jpg・png・gif・webp）を選んでください')
+    if size <= 0:
+        raise UploadError('ファイルが空です')
+    if size > settings.PICTURE_UPLOAD_MAX_FILE_SIZE:
+        raise UploadError('写真1枚の大きさの上限を超えています', status=413)
+
+    pending = UploadSession.objects.filter(
+        user=user, schedule=schedule, updated_at__gte=expiry_threshold(),
+    ).aggregate(total=Sum('size'))['total'] or 0
+    if pending + size > settings.PICTURE_UPLOAD_MAX_PLAN_SIZE:
+        raise UploadError('この予定に付ける写真の合計の上限を超えています', status=413)
+
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    session = UploadSession.objects.create(
+        user=user, schedule=schedule,
+        token=secrets.token_urlsafe(32), filename=filename[:255], size=size,
+    )
+    open(part_path(session.token), 'wb').close() #空のファイルを作っておく
+    return session
+
+
+#送られてきた1回分（offsetの位置からlengthバイト）を一時ファイルに書き足す
+#streamはrequestそのもの（request.read()で少しずつ読むので、request.bodyのようにメモリに全部読み込まない）
+#途中で回線が切れた時は、届いた所までを受け取り済みにするので、次はその続きから送ればいい
+def append_chunk(session, offset, stream, length):
+    if session.is_complete:
+        raise UploadError('このファイルはもう全部受け取っています', status=409, offset=session.received)
+    if offset != session.received:
+        raise UploadError('送る位置がずれています', status=409, offset=session.received)
+    if length <= 0 or offset + length > session.size:
+        raise UploadError('ファイルの大きさを超えて送られています', status=413, offset=session.received)
+
+    path = part_path(session.token)
+    if not os.path.exists(path): #一時ファイルが消えていたら最初から送り直してもらう
+        UploadSession.objects.filter(pk=session.pk).update(received=0, updated_at=timezone.now())
+        session.received = 0
+        os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+        open(path, 'wb').close()
+        raise UploadError('受け取ったデータが見つからないので、最初から送り直してください', status=409, offset=0)
+
+    #まずリクエストから別の一時ファイルに読み込む（回線が遅くても受け取り途中のファイルには触らない）
+    with tempfile.TemporaryFile(dir=settings.UPLOAD_SESSION_DIR) as chunk:
+        written = 0
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data: #回線が切れた
+                break
+            chunk.write(data)
+            written += len(data)
+        chunk.seek(0)
+
+        #受け取り途中のファイルにはロックを取ってから書き足す　同じ位置への送信が同時に来た時は、先にロックを取った方だけが書き、
+        #後の方はロックを取った後に受け取り済みの位置を読み直して409にする（先の方が書いたデータを上書き・切り捨てしない）
+        with open(path, 'r+b') as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                current = UploadSession.objects.filter(pk=session.pk).values_list('received', flat=True).first()
+                if current != offset:
+                    session.received = current or 0
+                    raise UploadError('同じファイルが同時に送られています', status=409, offset=session.received)
+                f.seek(offset)
+                shutil.copyfileobj(chunk, f, READ_SIZE)
+                f.truncate() #前に途中まで書かれていた余分なデータを切り捨てる
+                f.flush()
+                received = offset + written
+                UploadSession.objects.filter(pk=session.pk, received=offset).update(received=received, updated_at=timezone.now())
+                session.received = received
+            finally:
+                locks.unlock(f)
+
+    if received == session.size:
+        _complete(session)
+    return session
+
+
+#全部受け取ったら画像として開けるか確認する　画像でなければ一時ファイルごと捨てる
+def _complete(session):
+    path = part_path(session.token)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        discard(session)
+        raise UploadError('画像として読み込めないファイルです')
+    session.completed_at = timezone.now()
+    UploadSession.objects.filter(pk=session.pk).update(completed_at=session.completed_at)
+
+
+#アップロードを取りやめる（一時ファイルも削除）
+def discard(session):
+    UploadSession.objects.filter(pk=session.pk).delete()
+    _remove_part(session.token)
+
+
+def _remove_part(token):
+    try:
+        os.remove(part_path(token))
+    except FileNotFoundError:
+        pass
+
+
+#予定フォームから送られてきたtokenのうち、このユーザーが同じ予定表で送り終えたもの
+def completed_uploads(user, schedule, tokens):
+    if not tokens:
+        return []
+    sessions = UploadSession.objects.filter(user=user, schedule=schedule, token__in=tokens, completed_at__isnull=False)
+    by_token = {session.token: session for session in sessions}
+    return [by_token[token] for token in dict.fromkeys(tokens) if token in by_token] #送られてきた順（重複は1つ）
+
+
+#送り終えた写真をPictureにする（保存はsave_planのbulk_createでまとめて行う）
+#写真はここで保存先（storage.py）に移し、受け取り状況の行は削除、一時ファイルは保存が確定してから消す
+def claim_uploads(sessions, plan):
+    image_field = Picture._meta.get_field('image')
+    pictures = []
+    for session in sessions:
+        with open(part_path(session.token), 'rb') as f:
+            name = picture_storage.save(image_field.generate_filename(None, session.filename), File(f, name=session.filename))
+        pictures.append(Picture(plan=plan, image=name))
+    if sessions:
+        UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+        tokens = [session.token for session in sessions]
+        transaction.on_commit(lambda: [_remove_part(token) for token in tokens])
+    return pictures
+
+
+#期限切れの受け取り途中・使われなかったアップロードを削除する（purge_upload_sessionsコマンドから）
+def purge_expired(now=None):
+    expired = list(UploadSession.objects.filter(updated_at__lt=expiry_threshold(now)).values_list('pk', 'token'))
+    if expired:
+        UploadSession.objects.filter(pk__in=[pk for pk, _ in expired]).delete()
+        for _, token in expired:
+            _remove_part(token)
+    return len(expired)
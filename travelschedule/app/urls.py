@@ -14,16 +14,31 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('home/', views.home_view, name='home'),
+    path('home/schedules/', views.home_schedules_view, name='home_schedules'),
+    path('search/', views.search_view, name='search'),
     path('schedule/<int:schedule_id>/', views.schedule_detail_view, name='schedule_detail'),
+    path('schedule/<int:schedule_id>/day/<str:date>/', views.schedule_day_view, name='schedule_day'),
     path('schedule/<int:schedule_id>/plan/add/', views.plan_create_or_edit_view, name='plan_create_or_edit'),
     path('schedule/<int:schedule_id>/plan/<int:plan_id>/edit/', views.plan_create_or_edit_view, name='plan_edit'),
+    path('schedule/<int:schedule_id>/plans/batch/', views.plan_batch_view, name='plan_batch'),
+    path('schedule/<int:schedule_id>/plans/import/', views.plan_import_view, name='plan_import'),
+    path('schedule/<int:schedule_id>/conflicts/', views.schedule_conflicts_view, name='schedule_conflicts'),
+    path('schedule/<int:schedule_id>/calendar.ics', views.schedule_calendar_view, name='schedule_calendar'),
+    path('schedule/<int:schedule_id>/itinerary/', views.itinerary_view, name='itinerary'),
+    path('calendar/<str:token>.ics', views.calendar_feed_view, name='calendar_feed'),
     path('mypage/', views.mypage_view, name='mypage'),
+    path('mypage/calendar/', views.calendar_token_view, name='calendar_token'),
     path('mypage/username/', views.change_username_view, name='change_username'),
     path('mypage/email/', views.change_email_view, name='change_email'),
     path('mypage/password/', views.change_password_view, name='change_password'),
     path('edit_schedule_title/', views.edit_schedule_title, name='edit_schedule_title'),
+    path('schedule/<int:schedule_id>/trim/preview/', views.trim_preview_view, name='trim_preview'),
     path('delete_schedule/<int:schedule_id>/', views.delete_schedule, name='delete_schedule'),
+    path('schedule/<int:schedule_id>/duplicate/', views.duplicate_schedule_view, name='duplicate_schedule'),
+    path('schedule/<int:schedule_id>/shift/', views.shift_schedule_view, name='shift_schedule'),
     path('plan/<int:plan_id>/delete/', views.plan_delete_view, name='plan_delete_view'),
+    path('schedule/<int:schedule_id>/uploads/', views.upload_start_view, name='upload_start'),
+    path('uploads/<str:token>/', views.upload_view, name='upload'),
 ]
 
 # path('URL', 実行するview関数, name='URLの名前'(テンプレで使用))
\ No newline at end of file
@@ -3,17 +3,21 @@ from django.contrib.auth import authenticate, login, logout, update_session_auth
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Prefetch
 from django.db.models import  Q
 from django.db.models.functions import Coalesce
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.cache import cache_control
+from django.db.models import Max, Min, Count
 from django.utils.timezone import localtime
 from django.utils.dateparse import parse_date
-from django.forms import inlineformset_factory
 from app.models import Plan
 from django.utils import timezone
-from copy import deepcopy
 from django.urls import reverse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 
 
 from .forms import (
@@ -24,16 +28,33 @@ from .forms import (
     ChangeUsernameForm, 
     ChangeEmailForm,
     CustomPasswordChangeForm,
-    BasePictureFormSet,
-    BaseLinkFormSet,
-    PictureForm,
-    LinkForm,
+    LinkFormSet,
+    PictureFormSet,
+    UploadedPicturesForm,
+    trip_dates,
 )
 
-from .models import User, Schedule, Plan, Link, Picture, TransportationMethod
+from .models import User, Schedule, Plan, Link, Picture, PlanDayOccurrence, UploadSession
+from .occurrences import load_timeline
+from .plan_writer import save_plan
+from .plan_batch import apply_batch
+from .duplication import duplicate_schedule
+from .trip_shift import MAX_SHIFT_DAYS, shift_schedule
+from .trimming import trim_preview, trim_schedule
+from .ics import calendar_response, schedule_plans, user_plans
+from . import itinerary
+from .plan_import import FIELD_LABELS, PlanImportError, file_rows, import_plans
+from .conflicts import conflict_json, plan_conflicts, plan_label, schedule_conflicts
+from .uploads import UploadError, append_chunk, discard, start_upload
+from .pagination import paginate_schedules
+from .summary import refresh_schedule_summary, with_next_plan
+from .search import search_plans, search_schedules
+from . import render_cache
+from . import transportation
 
+import json
+import secrets
 from datetime import timedelta
-from datetime import datetime, time
 
 from collections import defaultdict
 
@@ -83,9 +104,13 @@ def mypage_view(request):
     request.user.refresh_from_db() #ログイン中のユーザー情報をもう一度データベースから取り出して最新状態にする
     
     referer = request.META.get('HTTP_REFERER') #直前に見ていたURLをヘッダから取り出す。戻るボタンに使用できる
+    calendar_url = None
+    if request.user.calendar_token: #購読用URLを作っていればカレンダーアプリに登録するURLを表示する
+        calendar_url = request.build_absolute_uri(reverse('app:calendar_feed', args=[request.user.calendar_token]))
     return render(request, 'app/mypage.html', {
         'user': request.user,
-        'back_url': referer
+        'back_url': referer,
+        'calendar_url': calendar_url,
     }) #'user'：テンプレート側でユーザーネームを表示、'back_url':戻るボタン用
 
 #ユーザー名変更画面
@@ -137,19 +162,137 @@ def logout_view(request):
     logout(request)
     return redirect('app:login')
 
+#条件付きGET（ETag / Last-Modified）
+#ブラウザの戻る・再読み込みの時、前回から何も変わっていなければ304を返してテンプレート描画や予定の検索をしない
+#ログインし直すとCSRFトークンが変わるので、ユーザーのlast_loginも検証値に含める
+
+#ホーム画面の検証値　ユーザーの予定表の最新updated_atと件数（削除された時に変わるように）を1回の集計で取る
+#カードの「次の予定」は今の時刻で変わる（予定の開始時刻を過ぎると次の予定になる）ので、これから始まる一番早い予定の開始時刻も入れる
+#どのカードの次の予定も、開始時刻を過ぎた時にはこれが一番早い予定なので、その時に検証値が変わって304にならない
+def home_validators(request):
+    if not hasattr(request, '_home_validators'): #etagとlast_modifiedの両方から呼ばれるので1リクエスト1回だけ集計する
+        stats = Schedule.objects.filter(user=request.user).aggregate(
+            latest=Max('updated_at'),
+            count=Count('id', distinct=True), #予定とJOINするので予定表の重複を数えない
+            next_start=Min('plans__start_datetime', filter=Q(plans__start_datetime__gte=timezone.now())),
+        )
+        times = [t for t in (stats['latest'], request.user.last_login) if t]
+        request._home_validators = (
+            f"home-{request.user.pk}-{stats['count']}-{validator_stamp(stats['latest'])}-{validator_stamp(stats['next_start'])}-{validator_stamp(request.user.last_login)}",
+            max(times) if times else None,
+        )
+    return request._home_validators
+
+def home_etag(request):
+    return home_validators(request)[0] if request.user.is_authenticated else None
+
+def home_last_modified(request):
+    return home_validators(request)[1] if request.user.is_authenticated else None
+
+#予定詳細画面の検証値　予定の保存・削除でSchedule.updated_atが必ず更新されるのでそれを使う
+#表示する移動手段の名前は管理画面で変わるので、移動手段の一覧のバージョン（transportation.version）も入れる（カレンダー・行程表も同じ）
+#写真の縮小版ができた時はupdated_atが変わらないので、rendition_versionも入れる（行程表も同じ）
+def schedule_validators(request, schedule_id):
+    schedule = get_user_schedule(request, schedule_id)
+    if schedule is None: #他人の予定表・存在しない予定表はビューで404にする
+        return None, None
+    times = [t for t in (schedule.updated_at, request.user.last_login) if t]
+    return (
+        f"schedule-{schedule.id}-{validator_stamp(schedule.updated_at)}-{schedule.rendition_version}-{transportation.version()}-{validator_stamp(request.user.last_login)}",
+        max(times),
+    )
+
+#ログイン中のユーザーの予定表を1件取得する　検証値を作る時に取得したものをビューでもそのまま使う（1リクエスト1回だけ検索）
+def get_user_schedule(request, schedule_id):
+    if getattr(request, '_user_schedule_id', None) != schedule_id:
+        request._user_schedule = Schedule.objects.filter(id=schedule_id, user=request.user).first()
+        request._user_schedule_id = schedule_id
+    return request._user_schedule
+
+#まだ表示していないメッセージ（取り込みの結果など）があるか　あれば304にせず画面を作り直してメッセージを出す
+#（予定表が変わらない取り込みの失敗などでは検証値が同じなので、304だとメッセージが表示されない）
+#len()はメッセージを読み込むだけで、表示済みにはしない
+def has_pending_messages(request):
+    return len(messages.get_messages(request)) > 0
+
+def schedule_etag(request, schedule_id, **kwargs):
+    if not request.user.is_authenticated or has_pending_messages(request):
+        return None
+    return schedule_validators(request, schedule_id)[0]
+
+def schedule_last_modified(request, schedule_id, **kwargs):
+    if not request.user.is_authenticated or has_pending_messages(request):
+        return None
+    return schedule_validators(request, schedule_id)[1]
+
+def validator_stamp(value):
+    return f'{value.timestamp():.6f}' if value else '0'
+
+#カレンダー（.ics）出力の検証値　カレンダーアプリは同じURLを何度も読みに来るので、変わっていなければ304だけ返す
+#予定表1件分は予定詳細画面と同じくSchedule.updated_atを使う
+def schedule_calendar_validators(request, schedule_id):
+    schedule = get_user_schedule(request, schedule_id)
+    if schedule is None:
+        return None, None
+    return f"ics-schedule-{schedule.id}-{validator_stamp(schedule.updated_at)}-{transportation.version()}", schedule.updated_at
+
+def schedule_calendar_etag(request, schedule_id):
+    return schedule_calendar_validators(request, schedule_id)[0] if request.user.is_authenticated else None
+
+def schedule_calendar_last_modified(request, schedule_id):
+    return schedule_calendar_validators(request, schedule_id)[1] if request.user.is_authenticated else None
+
+#印刷用の行程表の検証値　ファイルができている時だけ付ける（作成中の画面に付けると、できた後も304で作成中の画面のままになる）
+def itinerary_validators(request, schedule_id):
+    schedule = get_user_schedule(request, schedule_id)
+    if schedule is None or not itinerary.is_ready(schedule):
+        return None, None
+    return f"itinerary-{schedule.id}-{itinerary.itinerary_version(schedule)}", schedule.updated_at
+
+def itinerary_etag(request, schedule_id):
+    return itinerary_validators(request, schedule_id)[0] if request.user.is_authenticated else None
+
+def itinerary_last_modified(request, schedule_id):
+    return itinerary_validators(request, schedule_id)[1] if request.user.is_authenticated else None
+
+#購読用URLの検証値　tokenのユーザーの予定表の最新updated_atと件数（ホーム画面と同じ集計）
+def calendar_feed_validators(request, token):
+    if getattr(request, '_feed_token', None) != token:
+        request._feed_token = token
+        request._feed_user = User.objects.filter(calendar_token=token).first()
+        request._feed_validators = (None, None)
+        if request._feed_user is not None:
+            stats = Schedule.objects.filter(user=request._feed_user).aggregate(latest=Max('updated_at'), count=Count('id'))
+            request._feed_validators = (
+                f"ics-feed-{request._feed_user.pk}-{stats['count']}-{validator_stamp(stats['latest'])}-{transportation.version()}",
+                stats['latest'],
+            )
+    return request._feed_validators
+
+def calendar_feed_etag(request, token):
+    return calendar_feed_validators(request, token)[0]
+
+def calendar_feed_last_modified(request, token):
+    return calendar_feed_validators(request, token)[1]
+
 #ホーム画面（予定表一覧画面）
 @login_required
+@cache_control(private=True, no_cache=True) #ブラウザに保存はさせるが、使う前に毎回304かどうか問い合わせさせる
+@condition(etag_func=home_etag, last_modified_func=home_last_modified)
 def home_view(request):
     sort = request.GET.get('sort', 'date') #sort(並び替え) URLに?sort=updatedと書いてあればupdatadが入る　URLに何も指定がなければdateを使う
     
-    if sort == 'updated': #更新順にした時
-        schedules = Schedule.objects.filter(user=request.user).order_by('-updated_at') #-updated_atで最新が一番上になる
+    if sort == 'updated': #更新順にした時 最新が一番上になる
         sort_label ='予定日降順'
         next_sort = 'date'
-    else: #更新順以外の時
-        schedules = Schedule.objects.filter(user=request.user).order_by('-trip_start_date') #-trip_start_dateで一番後の予定が一番上に表示
+    else: #更新順以外の時 一番後の予定が一番上に表示
+        sort = 'date'
         sort_label = '更新順'
         next_sort = 'updated'
+    
+    #最初のページ分だけ取得　続きはスクロールした時にhome_schedules_viewから読み込む（pagination.py）
+    #予定数・写真数はScheduleの集計列、次の予定はサブクエリで同じ1回のクエリに入れる（summary.py）
+    schedules, next_cursor = paginate_schedules(with_next_plan(Schedule.objects.filter(user=request.user)), sort)
         
     if request.method == 'POST': #POSTの時
         form = ScheduleForm(request.POST) #request.POSTの中に旅行タイトル、旅行期間の入力内容が入っている
@@ -159,81 +302,112 @@ def home_view(request):
             schedule.save() #userをセットした後初めてDBに保存。scheduleテーブルに1行追加
             return redirect('app:plan_create_or_edit', schedule_id=schedule.id) #保存が終わったら、予定の中身を追加する画面に移動。schedule_id=schedule.idで今作った予定表のIDをURLパラメータとして渡している
         else: #バリエーションエラーの時
-            no_schedules = not schedules.exists() #not schedules.existsで予定がない→Ttue、予定がある→False まだ予定がありませんなどのメッセージを出すかのフラグ作成
             return render(request, 'app/home.html', {
                 'form': form, #エラーの付いたformをそのままテンプレートに渡す
                 'schedules': schedules,
+                'sort': sort,
+                'next_cursor': next_cursor,
                 'sort_label': sort_label,
                 'next_sort': next_sort,
                 'show_add_modal': True, #モーダルを開いたままにする
-                'no_schedules': no_schedules,
+                'no_schedules': not schedules, #最初のページが空なら予定表は0件
             })
     else: #GETの時
         form = ScheduleForm()
-        no_schedules = not schedules.exists() #not schedules.existsで予定がない→Ttue、予定がある→False まだ予定がありませんなどのメッセージを出すかのフラグ作成
         return render(request, 'app/home.html', {
             'form': form, #新しい予定表を追加するフォーム
-            'schedules': schedules, #ホーム画面で一覧表示している旅行リスト
+            'schedules': schedules, #ホーム画面で一覧表示している旅行リスト（最初のページ分）
+            'sort': sort, #続きを読み込む時の並び替え
+            'next_cursor': next_cursor, #続きを読み込む時の位置　最後のページならNone
             'sort_label': sort_label, #並び替えボタンの表示用リスト
             'next_sort': next_sort, #並び替えボタンを押した時に、予定日順→更新順・更新順→予定日順と切り替え表示を実現している
             'show_add_modal': False, #最初からモーダルは開かない
-            'no_schedules': no_schedules, #予定が一件もないかチェック
+            'no_schedules': not schedules, #予定が一件もないかチェック　最初のページが空なら予定表は0件
         })
+
+#ホーム画面の予定表一覧の続き　スクロールで一番下まで来た時にJavaScriptから呼ばれ、予定表カードのHTMLだけを返す
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=home_etag, last_modified_func=home_last_modified)
+def home_schedules_view(request):
+    sort = request.GET.get('sort', 'date')
+    if sort not in ('date', 'updated'):
+        sort = 'date'
+    schedules, next_cursor = paginate_schedules(
+        with_next_plan(Schedule.objects.filter(user=request.user)),
+        sort,
+        request.GET.get('cursor'), #前のページの最後の1件の位置
+    )
+    return render(request, 'app/home_schedule_cards.html', {
+        'schedules': schedules,
+        'sort': sort,
+        'next_cursor': next_cursor,
+    })
+
+#検索画面　予定表のタイトルと、予定の名前・メモ・出発地・到着地・リンクのタイトルから探す（search.py）
+@login_required
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    plans = search_plans(request.user, query)
+    for plan in plans:
+        #予定詳細画面で何日目を開くか（予定を保存した後のリダイレクトと同じ計算）
+        plan.selected_day = (localtime(plan.start_datetime).date() - plan.schedule.trip_start_date).days + 1
+    return render(request, 'app/search.html', {
+        'query': query,
+        'plans': plans, #一致した予定（一致度の高い順）
+        'schedules': search_schedules(request.user, query), #タイトルが一致した予定表
+    })
     
+#'2025-08-01'のような文字列を日付型にする　形が正しくない時も、2025-02-30のような存在しない日付の時もNone
+#（parse_dateは形が違うとNoneを返すが、存在しない日付だとValueErrorを出す）
+def to_date(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
 #予定表のタイトル・旅行期間編集ケバブ
+@login_required
 def edit_schedule_title(request):
     if request.method == 'POST':
         schedule_id = request.POST.get('schedule_id') #どの予定表かのIDを取り出す
         new_title = request.POST.get('title') #入力された新しいタイトルを取り出す
-        schedule = get_object_or_404(Schedule, id=schedule_id) #該当IDのscheduleがなければ404を返す便利関数
+        schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user) #自分の予定表でなければ404を返す
         
         #変更前の旅行開始日・終了日を変数に控えておく
         old_start = schedule.trip_start_date
         old_end = schedule.trip_end_date
         
-        #新しい日付（文字列）を取り出す
-        new_start_str = request.POST.get('start_date')
-        new_end_str = request.POST.get('end_date')
+        #新しい日付（文字列）を取り出してdate型に変換（形が正しくない・存在しない日付ならNone）
+        new_start = to_date(request.POST.get('start_date'))
+        new_end = to_date(request.POST.get('end_date'))
         
-        if new_start_str and new_end_str: #どちらも入力されている時だけ変更処理をする
-            new_start = datetime.strptime(new_start_str, '%Y-%m-%d').date() #文字列からdate型に変換
-            new_end = datetime.strptime(new_end_str, '%Y-%m-%d').date() #文字列からdate型に変換
-            #ここでやっとDBに保存できるdate型が出来上がる
-            
-            #スケジュールの中身を更新、保存
-            schedule.title = new_title
-            schedule.trip_start_date = new_start
-            schedule.trip_end_date = new_end
-            schedule.save()
-            
-            #旅行期間が短くなったかを判定
-            shortened = (new_start > old_start) or (new_end < old_end) #new_start > old_startで開始日が後ろにずれた時、new_end < old_endで終了日が手前になった時どちらかが起こっていたら短くなっているとみなしてshortened=True
-            if shortened: #短くなった時、期間外のplanを消去する処理を走らせる
-                #新しい期間の一日分丸ごとを表すdatetimeを作る（新しい旅行期間の始まり～終わりをdatetimeで表現）
-                #datetime.combineはPythonの標準ライブラリにある関数。日付と時刻をくっつけて１つのdatetimeを作る
-                start_naive =  datetime.combine(new_start, time.min) #datetime.combineでその日の〇時〇分のdatetimeを作る。minはその日の最初の日時。第１引数→new_start=dateのみ、第２引数→time.min=時刻のみ 合わせるとdatetime型になる
-                end_naive = datetime.combine(new_end, time.max) #maxはその日の最後の日時
-                #タイムゾーン付（aware）に変える naiveはタイムゾーン情報を持っていない（どこの国の時間か） awareはタイムゾーン付のdatetime
-                if timezone.is_naive(start_naive): #もし、start_naiveがnaive（タイムゾーン情報なし）ならそのdatetimeに現在の設定タイムゾーンをくっつけてawareにする
-                    new_end_dt = timezone.make_aware(end_naive)
-                    new_start_dt = timezone.make_aware(start_naive) if timezone.is_naive(start_naive) else start_naive
-                    new_end_dt = timezone.make_aware(end_naive) if timezone.is_naive(end_naive) else end_naive
+        if new_start and new_end and new_start <= new_end: #どちらも正しく入力されている時だけ変更処理をする
+            with transaction.atomic(): #予定表の更新と期間外の予定の削除を同じトランザクションで行う
+                #スケジュールの中身を更新、保存
+                schedule.title = new_title
+                schedule.trip_start_date = new_start
+                schedule.trip_end_date = new_end
+                schedule.save()
                 
-                    #Qオブジェクトで期間外の予定を探す
-                    #Plan.objects.filter(schedule=schedule)でこの予定表に紐づくplanだけを対象にする。その上で.filter()の中のQ()をorで繋いでいる
-                    plans_to_delete = Plan.objects.filter(schedule=schedule).filter(
-                        Q(start_datetime__lt=new_start_dt) | 
-                        Q(end_datetime__gt=new_end_dt) | 
-                        (Q(end_datetime__isnull=True) & Q(start_datetime__gt=new_end_dt))
-                    )
-                    #Q(start_datetime__lt=new_start_dt) planの開始時刻が新しい旅行開始日時より前（新しい開始日より前にスタートしている予定）
-                    #Q(end_datetime__gt=new_end_dt)　planの終了時刻が新しい旅行終了日時より後（新しい終了日より後に終わる予定）
-                    #Q(end_datetime__isnull=True) & Q(start_datetime__gt=new_end_dt) 「終わり時間が設定されていない」かつ「開始時間が新しい旅行終了日時より後」の予定
-                    #上記の条件で選択した旅行期間外に飛び出しているplanを全部集めている
-                    plans_to_delete.delete() #集めたplans_to_deleteをdelete()で一括削除
+                #旅行期間が短くなったかを判定
+                shortened = (new_start > old_start) or (new_end < old_end) #new_start > old_startで開始日が後ろにずれた時、new_end < old_endで終了日が手前になった時どちらかが起こっていたら短くなっているとみなしてshortened=True
+                if shortened: #短くなった時、期間外のplanを消去する（消える数は保存前にtrim_preview_viewで確認してもらっている）
+                    trim_schedule(schedule, new_start, new_end) #日別展開・リンク・写真・予定をまとめて削除して件数を数え直す（trimming.py）
         
     return redirect('app:home') #予定表のタイトルや旅行期間の編集が成功した時の遷移画面
 
+#旅行期間を短くした時に消える予定・リンク・写真の数（JSON）　編集モーダルの保存前の確認に使う
+#?start_date=2025-08-02&end_date=2025-08-03
+@login_required
+def trim_preview_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    new_start = to_date(request.GET.get('start_date'))
+    new_end = to_date(request.GET.get('end_date'))
+    if not new_start or not new_end or new_start > new_end:
+        return JsonResponse({'error': '旅行期間が正しくありません'}, status=400)
+    return JsonResponse(trim_preview(schedule, new_start, new_end))
+
 #予定表の削除モーダル
 @login_required
 def delete_schedule(request, schedule_id): #requestはブラウザから送られてきたリクエスト（消去ボタン押されたなどの情報）　schedule_idはURLの中に書かれている予定表ID
@@ -244,6 +418,121 @@ def delete_schedule(request, schedule_id): #requestはブラウザから送ら
         return redirect('app:home') #終わったらホーム画面に戻る
     return redirect('app:home')
 
+#予定表の複製　予定・リンク・写真をまとめてコピーした新しい予定表を作り、その予定詳細画面へ（duplication.py）
+#start_dateを送ると、その日から始まるように旅行期間と全部の予定の日時をずらす
+@login_required
+@require_POST
+def duplicate_schedule_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user) #自分の予定表だけ複製できる
+    new_start_str = request.POST.get('start_date')
+    new_start = to_date(new_start_str) if new_start_str else None
+    if new_start_str and new_start is None: #日付の形が正しくない・存在しない日付
+        return redirect('app:home')
+    if new_start and abs((new_start - schedule.trip_start_date).days) > MAX_SHIFT_DAYS: #日程をずらす時と同じ上限（9999年を超える日付になって500にならないように）
+        return redirect('app:home')
+    copy = duplicate_schedule(schedule, new_start_date=new_start)
+    return redirect('app:schedule_detail', schedule_id=copy.id)
+
+#旅行全体の日程をずらす　予定表の日付と全部の予定の日時を同じ日数だけまとめて動かす（trip_shift.py）
+#start_date（新しい開始日）かdays（ずらす日数）を送る
+@login_required
+@require_POST
+def shift_schedule_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    try:
+        new_start = parse_date(request.POST.get('start_date') or '') #2025-02-30のような存在しない日付はValueError
+        days = (new_start - schedule.trip_start_date).days if new_start else int(request.POST.get('days', ''))
+    except ValueError: #日付も日数も正しくない
+        return redirect('app:home')
+    if abs(days) > MAX_SHIFT_DAYS:
+        return redirect('app:home')
+    shift_schedule(schedule, days)
+    return redirect('app:schedule_detail', schedule_id=schedule.id)
+
+#予定表1件分の予定をカレンダー（.ics）ファイルでダウンロード（ics.py）
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedule_calendar_etag, last_modified_func=schedule_calendar_last_modified)
+def schedule_calendar_view(request, schedule_id):
+    schedule = get_user_schedule(request, schedule_id) #検証値を作る時に取得したものを使う
+    if schedule is None:
+        raise Http404
+    return calendar_response(schedule_plans(schedule), schedule.title, filename=f'schedule-{schedule.id}.ics')
+
+#印刷用の行程表（itinerary.py）　作ってあるファイルをそのまま返す
+#まだなければスレッドプールで作り始めて、作成中の画面（数秒ごとに読み直す）を202で返す　?download=1の時はファイルとしてダウンロード
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=itinerary_etag, last_modified_func=itinerary_last_modified)
+def itinerary_view(request, schedule_id):
+    schedule = get_user_schedule(request, schedule_id)
+    if schedule is None:
+        raise Http404
+    path = itinerary.request_itinerary(schedule)
+    if path is None:
+        response = render(request, 'app/itinerary_pending.html', {'schedule': schedule}, status=202)
+        response['Retry-After'] = '2'
+        return response
+    return FileResponse(
+        open(path, 'rb'),
+        content_type='text/html; charset=utf-8',
+        as_attachment=request.GET.get('download') == '1',
+        filename=f'itinerary-{schedule.id}.html',
+    )
+
+#全部の予定表の予定をカレンダーアプリから購読するURL（ログインできないカレンダーアプリが読むので、ログインの代わりにURLのtokenで本人を確かめる）
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=calendar_feed_etag, last_modified_func=calendar_feed_last_modified)
+def calendar_feed_view(request, token):
+    calendar_feed_validators(request, token) #tokenのユーザーを探す（検証値を作る時に探していればそのまま使う）
+    user = request._feed_user
+    if user is None:
+        raise Http404
+    return calendar_response(user_plans(user), f'{user.name}の旅行', feed=True)
+
+#購読用URLを作る（作り直すと前のURLは使えなくなる）
+@login_required
+@require_POST
+def calendar_token_view(request):
+    request.user.calendar_token = secrets.token_urlsafe(32)
+    request.user.save(update_fields=['calendar_token', 'updated_at'])
+    messages.success(request, 'カレンダー購読用のURLを作りました')
+    return redirect('app:mypage')
+
+#行程表（CSV・iCalendar）から予定をまとめて取り込む（plan_import.py）
+#dry_runを送るとチェックだけして保存しない　JSONを求められた時（Accept: application/json）は結果をJSONで返し、それ以外は予定詳細画面にメッセージを出す
+@login_required
+@require_POST
+def plan_import_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    uploaded = request.FILES.get('file')
+    dry_run = bool(request.POST.get('dry_run'))
+    try:
+        if uploaded is None:
+            raise PlanImportError('取り込むファイルを選んでください')
+        result = import_plans(schedule, file_rows(uploaded), dry_run=dry_run)
+    except PlanImportError as e:
+        if wants_json:
+            return JsonResponse({'error': e.message}, status=400)
+        messages.error(request, e.message)
+        return redirect('app:schedule_detail', schedule_id=schedule.id)
+    if wants_json:
+        return JsonResponse(result)
+
+    if result['created'] and dry_run: #チェックだけの時は保存していないので「取り込みました」と言わない
+        messages.info(request, f"{result['created']}件の予定を取り込めます（確認だけで、まだ保存していません）")
+    elif result['created']:
+        messages.success(request, f"{result['created']}件の予定を取り込みました")
+    for error in result['errors'][:5]: #画面には最初の数件だけ出す
+        fields = '、'.join(f"{FIELD_LABELS.get(field, field)}：{' '.join(texts) or '入力してください'}" for field, texts in error['errors'].items())
+        messages.error(request, f"{error['row']}行目：{fields}")
+    if result['error_count'] > 5:
+        messages.error(request, f"ほか{result['error_count'] - 5}行にエラーがあります")
+    if result['conflict_count']:
+        messages.warning(request, f"取り込んだ予定のうち{result['conflict_count']}組が他の予定と時間が重なっています")
+    return redirect('app:schedule_detail', schedule_id=schedule.id)
+
 #予定追加・編集画面
 @login_required
 def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新規作成と既存予定の編集view　schedule_idでどの予定表の予定か　plan_id=Noneでなしなら新規予定、ありで編集
@@ -254,31 +543,7 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
 
     trip_choices = generate_trip_date_choices(schedule) #旅行期間から日付選択肢を作る 下のdef generate_trip_date_choicesに繋がる
     
-    #リンクフォームセットを定義　フォームセット＝planに紐づくリンクを複数扱うための仕組み
-    extra_links = 1 #空フォームを最初に1個表示
-    #inlineformset_factoryで親（Plan）に紐づく子（Link）をまとめて編集できるフォームセットを作成
-    LinkFormSet = inlineformset_factory(
-        Plan, #親
-        Link, #子（１対多）
-        form=LinkForm, #linkモデルの一行分のフォームの形
-        formset=BaseLinkFormSet, #カスタムルール　フォームセット全体に独自のルールを足せる
-        extra=extra_links,
-        max_num=5,
-        validate_max=True, #６個以上送られたらエラーにする
-        can_delete=True #削除チェックを自動で付ける
-    )
-
-    extra_pictures = 1
-    PictureFormSet = inlineformset_factory(
-        Plan,
-        Picture,
-        form=PictureForm,
-        formset=BasePictureFormSet,
-        extra=extra_pictures,
-        max_num=6,
-        validate_max=True,
-        can_delete=True,
-    )
+    #リンク・写真のフォームセット（planに紐づくリンク・写真を複数扱うための仕組み）はforms.pyで1回だけ作ったLinkFormSet・PictureFormSetを使う
     
     if request.method == 'POST':
         form = PlanForm(
@@ -298,40 +563,24 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
             if delete_flag:
                 f.empty_permitted = True
         
+        #分割アップロードで先に送り終えた写真（hiddenのupload_tokens）
+        upload_form = UploadedPicturesForm(request.POST, user=request.user, schedule=schedule, picture_formset=picture_formset)
+        
         #どのカテゴリが選ばれたか取る　バリエーションエラーで画面を再表示する時に選択状態を保つ目的    
         selected_category = request.POST.get('action_category') or ''
         
-        #plan、link、pictureの３つすべてOKの時だけ保存
-        if form.is_valid() and link_formset.is_valid() and picture_formset.is_valid():
+        #plan、link、picture、アップロード済みの写真のすべてOKの時だけ保存
+        if form.is_valid() and link_formset.is_valid() and picture_formset.is_valid() and upload_form.is_valid():
             
-            plan_instance = form.save(commit=False) #commit=FalseでDBに保存しないでオブジェクトだけ作る　plan_instance.schedule = scheduleを入れたいから（planモデルをscheduleと紐づけしてから保存したいから）
-            plan_instance.schedule = schedule #planモデルをscheduleと紐づけ
-            plan_instance.save()
+            #予定本体・リンク・写真をまとめて1つのトランザクションで保存する（plan_writer.py）
+            plan_instance = save_plan(form, link_formset, picture_formset, schedule, uploads=upload_form.sessions)
             
-            #予定表画面（ホーム画面）で更新順に並び替えできるように、予定が更新された＝予定表も更新されたと印をつける
-            schedule.updated_at = timezone.now()
-            schedule.save(update_fields=['updated_at']) #updated_atだけを更新（他のフィールド触らない）
-            
-            #写真フォームセットを１つずつ処理
-            for picture_form in picture_formset: #picture_formでフォームセットの中の1枚分のフォーム
-                instance = picture_form.instance #instanceはそのフォームが紐づくpictureモデルの実体（DBの1行）　既存画像ならinstance.pkがある（DBに存在）　新規ならinstance.pkがない
-                delete_flag = picture_form.cleaned_data.get('DELETE', False) #そのフォームで削除にチェック入ったか
-                image = picture_form.cleaned_data.get('image') #新しくアップロードされた画像ファイルが入っているか
-                
-                #新規で何もしていない空フォームは無視する
-                #削除チェックなし、画像も選ばれてない、DBにも存在しない→（continue）ただの空フォームだから保存しないで次へ
-                if not delete_flag and not image and not instance.pk:
-                    continue
-                
-                #既存画像に削除チェックが入っていたら削除
-                if delete_flag and instance.pk:
-                    instance.delete()
-                    continue
-                #削除じゃない場合は保存する（新規or既存更新）
-                if not delete_flag:
-                    picture = picture_form.save(commit=False) #save(commit=False)で一旦DBに保存せずにpictureオブジェクトだけ作る
-                    picture.plan = plan_instance #その画像をどの予定の画像か紐づける（FKセット）
-                    picture.save() #DBに保存
+            #時間が重なっている予定があれば、保存はした上で予定詳細画面で知らせる（conflicts.py）
+            conflicts = plan_conflicts(plan_instance)
+            if conflicts:
+                names = '」「'.join(plan_label(conflict) for conflict in conflicts[:3])
+                more = f'など{len(conflicts)}件' if len(conflicts) > 3 else ''
+                messages.warning(request, f'「{names}」{more}と時間が重なっています')
         
             #保存後に何日目を表示するかを決める
             if plan_instance.start_datetime:
@@ -340,40 +589,14 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
                 selected_day = (saved_date - trip_start).days + 1 #（例：8/3－8/1＝2日差　そこに＋1して3日目を表示する）
             else:
                 selected_day = 1 #start_datetimeが未入力なら1日目を表示
-                    
-            #リンクフォームセットを保存するが一旦DBには保存しない（リンクの保存時に追加処理をしたいため）
-            link_instances = link_formset.save(commit=False)
-            
-            #フォームセットでcan_delete=Trueにしているため、削除チェックが入ったリンクはdeleted_objectsに入る
-            for obj in link_formset.deleted_objects:
-                obj.delete()
-                
-            #削除チェックはないが、URLが空になった既存データを消す
-            for form in link_formset:
-                if form.instance.pk:
-                    url_value = form.cleaned_data.get('url') if form.is_valid() else form.data.get(form.add_prefix('url')) #通常のURLとバリエーション失敗時でも値を拾えるように
-                    if not url_value: #URL空の時
-                        form.instance.delete()
-                
-            #新規と更新のリンクを保存（空欄は保存しない）
-            for link in link_instances:
-                if link.url and link.url.strip(): #URLが空じゃないものだけ保存（スペースだけも弾く）
-                    link.plan = plan_instance #どの予定のリンクかFKで紐づける
-                    link.action_category = plan_instance.action_category #リンク側にもカテゴリを持たせているなら同期
-                    link.save() #DBに保存
                 
             #保存が終わったら詳細画面に戻す　reverseでschedule/<id>/みたいなURL文字列を作る＋selected_day=3のようなクエリをつける
             return redirect(reverse('app:schedule_detail', args=[schedule_id]) + f'?selected_day={selected_day}')
             
         else: #バリエーションエラー後の再表示
-            #テンプレートに渡す移動手段の一覧データ　DBのTransportationMethodを全部取ってテンプレートで使いやすい形に辞書型を使って整形
-            tm = [] #tmの中のイメージ[{'id':1, 'label': 'walk', 'icon': 'fa-person-walking'},{・・・},]
-            for m in TransportationMethod.objects.all():
-                tm.append({
-                    'id': m.id,
-                    'label': m.transportation,
-                    'icon': m.transportation_icon_class,
-                })
+            #テンプレートに渡す移動手段の一覧データ　メモリに読み込み済みの一覧をテンプレートで使いやすい形に整形（transportation.py）
+            tm = transportation.template_choices() #tmの中のイメージ[{'id':1, 'label': 'walk', 'icon': 'fa-person-walking'},{・・・},]
+            upload_form.is_valid() #先に他のフォームでエラーになった時も、送り終えた写真を画面に残すために確認しておく
                 
             #画面に渡すcontextを揃える
             return render(request, 'app/plan_form.html', {
@@ -386,6 +609,7 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
                 'transportation_methods': tm, #移動手段の選択肢一覧
                 'selected_category': selected_category, #カテゴリの初期選択に使う
                 'plan': plan, #編集なら既存plan、追加ならNone
+                'upload_form': upload_form, #送り終えた写真（tokenをhiddenで残す）とそのエラー
             })
     else: #GETの時（編集・新規）
         selected_category = plan.action_category if plan else '' #編集ならplan.action_category（移動、観光など）を入れる、新規なら空文字
@@ -432,14 +656,8 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
             link_formset = LinkFormSet(request.POST or None, request.FILES or None, instance=plan, prefix='links')
             picture_formset = PictureFormSet(instance=plan, prefix='pictures')
             
-        #POST時と同様にテンプレートに渡す移動手段の一覧データ　DBのTransportationMethodを全部取ってテンプレートで使いやすい形に辞書型を使って整形
-        tm = []
-        for m in TransportationMethod.objects.all():
-            tm.append({
-                'id': m.id,
-                'label': m.transportation,
-                'icon': m.transportation_icon_class,
-            })
+        #POST時と同様にテンプレートに渡す移動手段の一覧データ（メモリに読み込み済みの一覧から作る）
+        tm = transportation.template_choices()
             
         #POST時と同様に画面に渡すcontextを揃える
         return render(request, 'app/plan_form.html', {
@@ -456,111 +674,79 @@ def plan_create_or_edit_view(request, schedule_id, plan_id=None): #予定を新
     
 #旅行期間（開始日～終了日）をもとに、1日ずつの日付リストを作る関数
 def generate_trip_date_choices(schedule): #scheduleはscheduleモデルの１件
-    start = schedule.trip_start_date #date型として開始日を取り出す
-    end = schedule.trip_end_date #date型として終了日を取り出す
-    delta = (end - start).days #end - startで期間オブジェクト　.daysで何日分か　例）delta = 3で表す
-    
-    #日付リストを作ってreturn
-    return [start + timedelta(days=i) for i in range(delta + 1)] #start + timedelta(days=i)はtimedelta(days=0)＝開始日　delta + 1をしないと最終日が抜けてしまう
+    #開始日～終了日の日付のタプル　同じ旅行期間なら前に作ったものを使い回す（forms.pyのtrip_dates）
+    return trip_dates(schedule.trip_start_date, schedule.trip_end_date)
 
 #予定詳細画面
-#予定表の詳細画面に表示するためにplanを日付ごとに並び替えてテンプレートに渡す処理
+#予定詳細画面の外枠（日付タブ）と、選択中の1日分の予定だけを表示する処理　他の日はタブを押した時にschedule_day_viewから読み込む
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedule_etag, last_modified_func=schedule_last_modified)
 def schedule_detail_view(request, schedule_id):
-    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user) #scheduleを1件取得
-    #取得したscheduleに紐づくplanを全部取得（リンク、写真も一緒に）
-    plans = Plan.objects.filter(schedule_id=schedule_id,).prefetch_related(
-        Prefetch('links'),
-        Prefetch('pictures'),
-    ).order_by('start_datetime')
-
-    #日付ごとの入れもの作る　例）2025-12-1: [paln1, plan2],
-    plans_by_date = defaultdict(list)
-    
-    #planを１つずつ見て、どの日付に入れるか決める
-    for plan in plans:
-        if not plan.start_datetime or not plan.end_datetime:
-            continue
-        
-        #日付ごとに表示するため、datetimeをdateに変換
-        start_date = localtime(plan.start_datetime).date()
-        end_date = localtime(plan.end_datetime).date()
-        
-        #宿泊カテゴリだけチェックインとアウトに分ける
-        if plan.action_category == 'stay':
-            ci = deepcopy(plan) #1件のplanを表示用に２つに分けるため、ci:チェックイン用のコピー、co:チェックアウト用のコピー
-            ci.display_type = 'checkin' #テンプレート側で表示を分岐するため
-            ci.display_datetime = plan.start_datetime #並び替えや表示用の時刻として使いやすく
-            ci.is_stay_display = True #表示用コピー目印
-            plans_by_date[start_date].append(ci) #チェックインはstart_dateの日に入れる
-            
-            co = deepcopy(plan)
-            co.display_type = 'checkout'
-            co.display_datetime = plan.end_datetime
-            co.is_stay_display = True
-            plans_by_date[end_date].append(co) #チェックアウトはend_dateの日に入れる
-            
-        #宿泊カテゴリ以外の予定を処理 開始日～終了日まで、予定を毎日分表示リストのに入れる 2日以上またぐ予定でも各日すべてに表示できる
-        else:
-            current_date = start_date #開始日をセット
-            #日付を1日ずつ進めるwhileループ current_dateがend_dateを超えるまで繰り返す
-            while current_date <= end_date:
-                plans_by_date[current_date].append(plan) #その日の予定リストにplanを追加 plans_by_dateは日付→その日の予定リストの辞書　例）plans_by_date[12/1] = [paln], plans_by_date[12/2] = [paln]
-                current_date += timedelta(days=1) #日付を1日進める
-        
-        #同じ日に、時間が重なっている予定の処理
-        for date, day_plans in plans_by_date.items(): #1日ずつ処理するループ
-            sorted_day_plans = sorted(day_plans, key=lambda plan: getattr(plan, 'display_datetime', plan.start_datetime)) #その日の予定を時刻順に並べる
-
-            #重なり判定の準備
-            active_ends = [] #今までに表示した予定の終了時刻一覧
-            for plan in sorted_day_plans:
-                plan.nest_level = 0 #重なっていない前提
-                
-                if getattr(plan, 'is_stay_display', False): #宿泊カテゴリは重なり判定を除外
-                    continue
-                
-                for end in active_ends: #新しい予定開始と既存予定の終了が被っていたら＋１する
-                    if plan.start_datetime < end:
-                        plan.nest_level += 1
-                active_ends.append(plan.end_datetime) #新しい予定の終了時刻を登録
-                
-            plans_by_date[date] = sorted_day_plans #その日の予定リストを更新
-
-    #旅行期間の日付リストを作る　開始日～終了日までを1日ずつ並べたリストを作成
-    date_list = []
-    current_date = schedule.trip_start_date
-    while current_date <= schedule.trip_end_date:
-        date_list.append(current_date)
-        current_date += timedelta(days=1)
-    
-    #予定が入っていない日にも空リストを用意　詳細画面で日付がクリックできるようにするため
-    for d in date_list:
-        if d not in plans_by_date:
-            plans_by_date[d] = []
-        
-    #日付の並び順を確定させる
-    sorted_dates = date_list
+    schedule = get_user_schedule(request, schedule_id) #scheduleを1件取得（検証値を作る時に取得済み）
+    if schedule is None:
+        raise Http404('予定表が見つかりません')
+    #日付タブに並べる日付　予定表が変わっていなければキャッシュから取り出す（render_cache.py）
+    sorted_dates, _ = render_cache.get_or_compute(schedule, 'dates', lambda: get_schedule_dates(schedule))
+
+    #最初に表示する日　?selected_day=3のように何日目かが指定されていればその日、なければ1日目
+    selected_day = request.GET.get('selected_day', '1')
+    selected_day = int(selected_day) if selected_day.isdigit() else 1
+    selected_day = min(max(selected_day, 1), len(sorted_dates)) if sorted_dates else 1
     
-    #移動手段マスタをテンプレート用の形に変換　アイコン表示と移動手段名の表示に使うため
-    tm = []
-    for m in TransportationMethod.objects.all():
-        tm.append({
-            'id': m.id,
-            'label': m.transportation,
-            'icon': m.transportation_icon_class,
-        })
+    #選択中の日の予定のHTML　予定表が変わっていなければDBもテンプレートも使わずキャッシュから取り出す
+    selected_day_html = ''
+    cache_hit = True
+    if sorted_dates:
+        selected_day_html, cache_hit = render_day(schedule, sorted_dates[selected_day - 1])
 
     #テンプレートに渡すデータ一式
     context = {
         'schedule_id': schedule.id,
-        'plans_by_date': plans_by_date,
-        'sorted_dates': sorted_dates,
         'schedule': schedule,
-        'transportation_methods': tm,
-        'sorted_dates': sorted(plans_by_date.keys()),
+        'sorted_dates': sorted_dates,
+        'selected_day': selected_day,
+        'selected_day_html': selected_day_html,
     }
-    return render(request, 'app/schedule_detail.html', context)
+    response = render(request, 'app/schedule_detail.html', context)
+    response['X-Render-Cache'] = 'hit' if cache_hit else 'miss' #キャッシュが効いたか確認用
+    return response
+
+#予定詳細画面の1日分だけを返す処理　日付タブを押した時にJavaScriptから呼ばれ、day-blockの中身のHTMLだけを返す
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedule_etag, last_modified_func=schedule_last_modified)
+def schedule_day_view(request, schedule_id, date):
+    schedule = get_user_schedule(request, schedule_id)
+    if schedule is None:
+        raise Http404('予定表が見つかりません')
+    day = to_date(date) #URLの'2025-08-01'のような文字列を日付型に変換（2025-02-30のような存在しない日付もNone）
+    if day is None:
+        raise Http404('日付の形式が正しくありません')
+    
+    html, cache_hit = render_day(schedule, day)
+    response = HttpResponse(html)
+    response['X-Render-Cache'] = 'hit' if cache_hit else 'miss'
+    return response
+
+#1日分の予定のHTMLを作る関数　（予定表ID, updated_at, 日付）でキャッシュする
+def render_day(schedule, day):
+    def compute():
+        #その日の予定だけを日別展開テーブル（PlanDayOccurrence）から範囲検索する（occurrences.py）
+        #planはリンク、写真も一緒に取得し、その日の予定は時刻順・重なり判定済み
+        entries = load_timeline(schedule, day, day).get(day, [])
+        return render_to_string('app/schedule_day.html', {
+            'schedule': schedule,
+            'entries': entries,
+        })
+    return render_cache.get_or_compute(schedule, f'day:{day.isoformat()}', compute)
+
+#予定詳細画面の日付タブに並べる日付リストを作る関数
+#旅行期間（開始日～終了日）の全日付に、旅行期間の外に予定が残っている日も加える
+def get_schedule_dates(schedule):
+    dates = set(generate_trip_date_choices(schedule)) #予定が入っていない日も日付タブをクリックできるように旅行期間は全部入れる
+    dates.update(PlanDayOccurrence.objects.filter(schedule=schedule).values_list('date', flat=True).distinct())
+    return sorted(dates) #日付の並び順を確定させる
 
 #予定削除モーダル
 @login_required
@@ -579,8 +765,95 @@ def plan_delete_view(request, plan_id):
         else:
             selected_day = 1
             
-        plan.delete()
-        schedule.updated_at = timezone.now() #scheduleの更新日時を更新
-        schedule.save(update_fields=['updated_at'])
+        with transaction.atomic(): #削除と件数の数え直しを同じトランザクションで行い、件数がずれないようにする
+            plan.delete() #日別展開テーブルの行もon_delete=CASCADEで一緒に消える
+            refresh_schedule_summary(schedule) #scheduleの更新日時の更新とホーム画面用の件数の数え直し
         
-        return redirect(f"{reverse('app:schedule_detail', args=[schedule.id])}?selected_day={selected_day}")
\ No newline at end of file
+        return redirect(f"{reverse('app:schedule_detail', args=[schedule.id])}?selected_day={selected_day}")
+
+#写真の分割アップロード（uploads.py）
+#ブラウザのJavaScriptが、予定フォームとは別に写真を少しずつ送る　送り終えたらtokenを予定フォームのhiddenに入れて保存する
+
+#受け取り状況をJSONにする　offsetは次に送る位置
+def upload_status(session, **extra):
+    return {
+        'token': session.token,
+        'offset': session.received,
+        'size': session.size,
+        'complete': session.is_complete,
+        'chunk_size': settings.PICTURE_UPLOAD_CHUNK_SIZE,
+        'url': reverse('app:upload', args=[session.token]),
+        **extra,
+    }
+
+def upload_error(error):
+    data = {'error': error.message}
+    if error.offset is not None:
+        data['offset'] = error.offset
+    return JsonResponse(data, status=error.status)
+
+#アップロードを始める　POSTでfilename（元のファイル名）とsize（バイト）を送る
+@login_required
+@require_POST
+def upload_start_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'ファイルの大きさが正しくありません'}, status=400)
+    try:
+        session = start_upload(request.user, schedule, request.POST.get('filename'), size)
+    except UploadError as error:
+        return upload_error(error)
+    return JsonResponse(upload_status(session), status=201)
+
+#GET：どこまで受け取ったか（回線が切れた後、続きをどこから送るか確認する）
+#POST：続きを送る　Upload-OffsetヘッダーにoffsetとContent-Type: application/octet-streamの本文
+#DELETE：アップロードを取りやめる
+@login_required
+def upload_view(request, token):
+    session = get_object_or_404(UploadSession, token=token, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(upload_status(session))
+    if request.method == 'DELETE':
+        discard(session)
+        return HttpResponse(status=204)
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Upload-OffsetとContent-Lengthが必要です', 'offset': session.received}, status=400)
+    if length > settings.PICTURE_UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'error': '1回に送れる大きさを超えています', 'offset': session.received}, status=413)
+    try:
+        append_chunk(session, offset, request, length) #request.read()で少しずつ読みながら書き込む
+    except UploadError as error:
+        return upload_error(error)
+    return JsonResponse(upload_status(session))
+
+
+#予定のまとめて追加・更新・削除（plan_batch.py）
+#JSONで{"version": ..., "operations": [...]}を受け取り、1件ずつの結果と新しい予定表のバージョンを返す
+@login_required
+@require_POST
+def plan_batch_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'JSONの形式が正しくありません'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'JSONの形式が正しくありません'}, status=400)
+    status, body = apply_batch(schedule, payload.get('operations'), payload.get('version'))
+    return JsonResponse(body, status=status)
+
+
+#予定表の中で時間が重なっている予定の組の一覧（conflicts.py）　宿泊は宿泊同士だけで調べる
+@login_required
+def schedule_conflicts_view(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id, user=request.user)
+    pairs = schedule_conflicts(schedule)
+    return JsonResponse({'conflicts': [conflict_json(first, second) for first, second in pairs]})
@@ -0,0 +1,48 @@
+#リクエストの外で重い処理（写真の縮小版の作成など）を行うためのスレッドプール
+#プロセスごとに1つだけ作り、最初に使われた時に起動する　スレッド数はsettings.BACKGROUND_WORKERS
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='app-worker')
+        return _executor
+
+
+#処理を実行する　失敗してもログに出すだけで、呼び出し元には例外を返さない（結果はNone）
+def _call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('バックグラウンド処理 %s に失敗しました', getattr(func, '__name__', func))
+
+
+#スレッドの中で実行する　失敗してもプールは止めない
+#スレッドごとにDB接続が作られるので、終わったら閉じる
+def _run(func, *args, **kwargs):
+    try:
+        return _call(func, *args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+#処理をスレッドプールに渡す　BACKGROUND_WORKERSが0の時はその場で実行して、結果の入ったFutureを返す
+#その場で実行する時も失敗はログに出すだけにして、スレッドプールの時と同じ動きにする（リクエストのDB接続は閉じない）
+def submit(func, *args, **kwargs):
+    if settings.BACKGROUND_WORKERS <= 0:
+        future = Future()
+        future.set_result(_call(func, *args, **kwargs))
+        return future
+    return get_executor().submit(_run, func, *args, **kwargs)
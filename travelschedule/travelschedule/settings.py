@@ -86,6 +86,30 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# schedule_pages：予定詳細画面の表示キャッシュ（app/render_cache.py）
+# キーに予定表のupdated_atを含めているので削除はせず、古いキーはMAX_ENTRIESを超えた時に古い順（LocMemCacheはLRU）に1/CULL_FREQUENCYずつ追い出す
+# 本番で複数プロセスから同じキャッシュを使う時は、環境変数でRedisなどに切り替える
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'schedule_pages': {
+        'BACKEND': os.environ.get('SCHEDULE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SCHEDULE_CACHE_LOCATION', 'schedule-pages'),
+        'TIMEOUT': int(os.environ.get('SCHEDULE_CACHE_TIMEOUT', 60 * 60 * 24 * 7)), # 1週間見られなかった予定表は期限切れ
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SCHEDULE_CACHE_MAX_ENTRIES', 20000)), # 数千件の予定表×数日分
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+SCHEDULE_RENDER_CACHE = 'schedule_pages'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -138,4 +162,27 @@ LOGIN_URL = '/app/login/'
 LOGIN_REDIRECT_URL = 'app:home'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# バックグラウンド処理（写真の縮小版の作成など）のスレッド数
+# 0にするとバックグラウンドに回さずその場で実行する（テストや、スレッドを使えない環境用）
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+
+# 写真の分割アップロード（app/uploads.py）
+# 受け取り途中のファイルを置くフォルダ（公開しないのでMEDIA_ROOTの外に置く）
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', os.path.join(BASE_DIR, 'upload_sessions'))
+PICTURE_UPLOAD_MAX_FILE_SIZE = 20 * 1024 * 1024 # 写真1枚の上限
+PICTURE_UPLOAD_MAX_PLAN_SIZE = 60 * 1024 * 1024 # 1つの予定にまとめて付けられる写真の合計の上限
+PICTURE_UPLOAD_CHUNK_SIZE = 1024 * 1024 # ブラウザが1回のリクエストで送る大きさ
+UPLOAD_SESSION_EXPIRY_HOURS = 24 # この時間送られてこなかった受け取り途中のファイルは削除する
+
+# 参照されていない写真ファイルの片付け（collect_orphan_pictures）が、どこまで調べたかを覚えておくファイル
+PICTURE_GC_CHECKPOINT = os.environ.get('PICTURE_GC_CHECKPOINT', os.path.join(BASE_DIR, 'picture_gc_checkpoint.json'))
+
+# 写真の削除で参照がなくなったファイルでも、この秒数以内に保存・再利用されたファイルはすぐには消さない（app/storage.py）
+# 同じ画像を別のリクエストがコミット前に保存している途中かもしれないため　残ったファイルはcollect_orphan_picturesで片付ける
+PICTURE_RELEASE_GRACE_SECONDS = 10 * 60
+
+# 印刷用の行程表（app/itinerary.py）を作って置いておくフォルダ
+# 予定表ごとのフォルダにupdated_atのバージョン名で保存し、予定表が変わるまで同じファイルを返す（他人に見せないのでMEDIA_ROOTの外に置く）
+ITINERARY_DIR = os.environ.get('ITINERARY_DIR', os.path.join(BASE_DIR, 'itineraries'))